@@ -0,0 +1,585 @@
+"""An asyncio execution engine for Bladerunner, for Python 3.5+ only.
+
+Hosts are driven from a single event loop with pexpect's async expect rather
+than one thread per host, so the number of hosts in flight is bound by file
+descriptors and not by threads. What to make of each match, the error codes
+and the results are decided by the same Bladerunner helpers as the threaded
+engine, only the waiting on expect differs.
+
+This file is part of Bladerunner.
+
+Copyright (c) 2015, Activision Publishing, Inc.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* Neither the name of Activision Publishing, Inc. nor the names of its
+  contributors may be used to endorse or promote products derived from this
+  software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+
+import asyncio
+import collections
+
+import pexpect
+
+from bladerunner.base import (
+    COMMAND_PROMPTS,
+    FRAMED_PROMPT_WAIT,
+    LOGIN_PROMPTS,
+    SHELL_PROMPTS,
+    _Resync,
+    _as_list,
+    _split_first,
+)
+from bladerunner.formatting import format_output
+
+
+# options only the threaded engine supports, see arun
+THREADED_OPTIONS = ("delay", "timings", "session_cache", "adaptive_threads")
+
+
+def _running_loop():
+    """Returns the running event loop, get_running_loop is python 3.7+."""
+
+    if hasattr(asyncio, "get_running_loop"):
+        return asyncio.get_running_loop()
+    return asyncio.get_event_loop()
+
+
+async def arun(runner, commands=None, servers=None, commands_on_servers=None):
+    """Executes commands on servers from the running event loop.
+
+    Accepts the same arguments and returns the same structure as
+    Bladerunner.run. The number of hosts in flight at once is limited by the
+    threads option. Running through a jump_host's shell or with a delay is
+    serial by nature, those runs are handed to Bladerunner.run in an executor.
+    So are runs with the timings, session_cache or adaptive_threads options,
+    which keep their state per thread and are only supported by the threaded
+    engine.
+
+    Args::
+
+        runner: the Bladerunner object to take options and prompts from
+        commands: a list of strings of commands to run
+        servers: a list of strings of hostnames, or a lazy source of them
+        commands_on_servers: an optional dictionary used when providing
+                             unique lists of commands per server
+
+    Returns:
+        a list of dictionaries with two keys: name, and results. results
+        is a list of tuples of commands issued and their replies.
+    """
+
+    loop = _running_loop()
+
+    if runner._jumps_from_shell() or _needs_threads(runner.options):
+        return await loop.run_in_executor(
+            None,
+            runner.run,
+            commands,
+            servers,
+            commands_on_servers,
+        )
+
+    if servers is None or isinstance(servers, str):
+        servers = [servers]
+
+    if not isinstance(commands, (list, tuple)):
+        commands = [commands]
+
+    servers = runner._prep_servers(commands, servers, commands_on_servers)
+
+    if runner.options["progressbar"]:
+        servers = runner._start_progress(servers)
+
+    if runner.options["jump_host"]:
+        jumpuser = runner.options["jump_user"] or runner.options["username"]
+        (runner.sshc, error_code) = await connect(
+            runner,
+            runner.options["jump_host"],
+            jumpuser,
+            runner.options["jump_pass"],
+            runner.options["jump_port"],
+        )
+        if error_code < 0:
+            raise SystemExit("Jumpbox Error: {0}".format(
+                runner._error_message(error_code)))
+
+    try:
+        limit = asyncio.Semaphore(max(runner.options["threads"], 1))
+        results = []
+
+        if runner.options["password_safety"]:
+            first, servers = _split_first(servers)
+            if first is not None:
+                results.append(await _run_single(runner, first, limit))
+                if runner._login_error(results[0]):
+                    # first login failed, don't risk locking the account
+                    limit = asyncio.Semaphore(1)
+
+        results.extend(await _run_windowed(runner, servers, limit))
+    finally:
+        if runner.options["jump_host"]:
+            if runner.sshc:
+                await _close(runner, runner.sshc)
+            runner.sshc = None
+            runner._stop_control_master()
+        runner.prompt_store.save()
+
+    if runner.options["progressbar"]:
+        runner.progress.clear()
+
+    return results
+
+
+def _needs_threads(options):
+    """Checks if a run needs to be handed to the threaded engine.
+
+    Returns:
+        boolean True if any options are set which arun can't run with
+    """
+
+    return any(options[option] for option in THREADED_OPTIONS)
+
+
+async def _run_windowed(runner, servers, limit):
+    """Runs on servers in order, pulling more as the earlier ones finish.
+
+    At most twice the threads option are scheduled at once, so a lazy or
+    very large source of servers isn't turned into tasks all up front.
+    """
+
+    window = max(runner.options["threads"], 1) * 2
+    pending = collections.deque()
+    results = []
+
+    for server in servers:
+        pending.append(asyncio.ensure_future(
+            _run_single(runner, server, limit)
+        ))
+        if len(pending) >= window:
+            results.append(await pending.popleft())
+
+    while pending:
+        results.append(await pending.popleft())
+
+    return results
+
+
+async def _run_single(runner, server, limit):
+    """Runs commands on a single server once there is room under limit."""
+
+    async with limit:
+        (sshr, error_code) = await connect(
+            runner,
+            server,
+            runner.options["username"],
+            runner.options["password"],
+            runner.options["port"],
+        )
+        if error_code < 0:
+            results = runner._login_failure(server, error_code)
+        else:
+            results = await send_commands(runner, sshr, server)
+            await _close(runner, sshr)
+
+    if runner.options["progressbar"]:
+        runner.progress.update()
+
+    return results
+
+
+async def _expect(sshc, patterns, timeout):
+    """Awaits pexpect's expect_list with a list of compiled patterns."""
+
+    return await sshc.expect_list(patterns, timeout, async_=True)
+
+
+async def _close(runner, sshc):
+    """Closes a connection, pexpect's terminate blocks so use the executor."""
+
+    await _running_loop().run_in_executor(
+        None,
+        runner.close,
+        sshc,
+        True,
+    )
+
+
+async def connect(runner, target, username, password, port):
+    """Connects to a server from the local host. See Bladerunner.connect.
+
+    Returns:
+        a tuple of the pexpect object, or None, and the error code
+    """
+
+    resolvable = runner.resolver.cached(target)
+    if resolvable is None:
+        loop = _running_loop()
+        resolvable = await loop.run_in_executor(
+            None,
+            runner.resolver.resolve,
+            target,
+        )
+    if not resolvable:
+        return (None, -3)
+
+    if runner.options["probe_timeout"] and not runner.options["jump_host"]:
+        # hosts behind a jump_host may not be reachable from here at all
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    runner.resolver.address(target) or target,
+                    port,
+                ),
+                runner.options["probe_timeout"],
+            )
+        except (OSError, asyncio.TimeoutError):
+            return (None, -7)
+        writer.close()
+
+    ssh_cmd = runner._build_ssh_command(target, username, port)
+    sshr = runner._spawn(target, ssh_cmd)
+
+    try:
+        login_response = await _expect(
+            sshr,
+            runner._prompts(LOGIN_PROMPTS, sshr),
+            runner.options["timeout"],
+        )
+    except (pexpect.TIMEOUT, pexpect.EOF):
+        if sshr.isalive():
+            # logged in with no passwd and an unknown prompt
+            return await _try_for_unmatched_prompt(
+                runner,
+                sshr,
+                sshr.before,
+                ssh_cmd,
+                _from_login=True,
+            )
+        else:
+            return (None, -7)
+
+    return await _multipass(runner, sshr, password, login_response)
+
+
+async def _multipass(runner, sshc, passwords, login_response):
+    """Tries each password in turn. See Bladerunner._multipass."""
+
+    error_code = -1
+    for password in _as_list(passwords):
+        sshc_returned, error_code = await login(
+            runner,
+            sshc,
+            password,
+            login_response,
+        )
+        if sshc_returned and error_code > 0:
+            return (sshc_returned, error_code)
+
+    return (None, error_code)
+
+
+async def login(runner, sshc, password, login_response):
+    """Logs in on a fresh connection. See Bladerunner.login.
+
+    Returns:
+        a tuple of the connection object and error code
+    """
+
+    prompts = runner._prompts(LOGIN_PROMPTS, sshc)
+
+    if login_response == 0:
+        # new identity for known_hosts file
+        sshc.sendline("yes")
+        try:
+            login_response = await _expect(
+                sshc,
+                prompts,
+                runner.options["timeout"],
+            )
+        except (pexpect.TIMEOUT, pexpect.EOF):
+            await send_interrupt(runner, sshc)
+            return (None, -1)
+
+    if runner._password_prompted(login_response) and password:
+        sshc.sendline(password)
+        try:
+            send_response = await _expect(
+                sshc,
+                prompts,
+                runner.options["timeout"],
+            )
+        except (pexpect.TIMEOUT, pexpect.EOF):
+            return await _try_for_unmatched_prompt(
+                runner,
+                sshc,
+                sshc.before,
+                "login",
+                _from_login=True,
+            )
+
+        error_code = runner._password_code(send_response)
+        if error_code < 0:
+            await send_interrupt(runner, sshc)
+        return (sshc, error_code)
+
+    elif runner._password_prompted(login_response):
+        await send_interrupt(runner, sshc)
+        return (None, -2)
+    else:
+        return (sshc, 1)
+
+
+async def send_commands(runner, server, hostname):
+    """Executes the commands on a pexpect object. See send_commands.
+
+    Returns:
+        a dictionary with the name and results keys
+    """
+
+    commands = runner._commands_for(hostname)
+
+    if runner.options["pipelined"]:
+        replies = await _send_pipelined(runner, commands, server)
+    else:
+        replies = []
+        for command in commands:
+            if runner.options["framed"]:
+                replies.append(await _send_framed(runner, command, server))
+            else:
+                command_result = await _send_cmd(runner, command, server)
+                replies.append((command_result, None))
+
+    return runner._host_results(server, hostname, commands, replies)
+
+
+async def _send_cmd(runner, command, server):
+    """Sends a single command and awaits the prompt. See Bladerunner._send_cmd.
+
+    Returns:
+        the formatted output of the command as a string, or -1 on timeout
+    """
+
+    if runner.options["framed"]:
+        return (await _send_framed(runner, command, server))[0]
+
+    capture = runner._start_capture(
+        server,
+        command,
+        runner._prompts(COMMAND_PROMPTS, server),
+    )
+    try:
+        runner._send_line(server, command)
+
+        cmd_response = await _expect(
+            server,
+            runner._prompts(COMMAND_PROMPTS, server),
+            runner.options["cmd_timeout"],
+        )
+
+        if runner._second_password_due(cmd_response, server):
+            server.sendline(runner.options["second_password"])
+            await _expect(
+                server,
+                runner._prompts(SHELL_PROMPTS, server),
+                runner.options["cmd_timeout"],
+            )
+    except (pexpect.TIMEOUT, pexpect.EOF):
+        return await _try_for_unmatched_prompt(
+            runner,
+            server,
+            runner._captured(server, capture),
+            command,
+        )
+
+    return format_output(
+        runner._captured(server, capture),
+        command,
+        runner.options,
+    )
+
+
+async def _send_framed(runner, command, server):
+    """Sends a command between start and end markers. See _send_framed.
+
+    Returns:
+        a tuple of the formatted output as a string, or -1 on timeout, and
+        the integer exit status, or None if it didn't finish
+    """
+
+    line, start, end = runner._frame(command)
+    password_prompts = runner._options_prompts(("passwd_prompts",))
+    capture = runner._start_capture(
+        server,
+        command,
+        [end] + password_prompts,
+    )
+
+    try:
+        runner._send_line(server, line)
+
+        response = await _expect(
+            server,
+            [end] + password_prompts,
+            runner.options["cmd_timeout"],
+        )
+
+        if response > 0 and runner.options["second_password"]:
+            server.sendline(runner.options["second_password"])
+            response = await _expect(
+                server,
+                [end],
+                runner.options["cmd_timeout"],
+            )
+    except (pexpect.TIMEOUT, pexpect.EOF):
+        runner._captured(server, capture)
+        await send_interrupt(runner, server)
+        return (-1, None)
+
+    reply = runner._framed_reply(server, capture, start, response)
+    if reply[1] is None:
+        await send_interrupt(runner, server)
+    else:
+        await _framed_prompt(runner, server)
+    return reply
+
+
+async def _send_pipelined(runner, commands, server):
+    """Sends all of the commands in one write. See _send_pipelined.
+
+    Returns:
+        a list of tuples per command, as returned by _send_framed
+    """
+
+    frames = [runner._frame(command) for command in commands]
+    password_prompts = runner._options_prompts(("passwd_prompts",))
+    replies = []
+    capture = None
+
+    try:
+        runner._send_line(server, runner._line_ending().join(
+            line for line, _, _ in frames
+        ))
+
+        for command, (_, start, end) in zip(commands, frames):
+            capture = runner._start_capture(
+                server,
+                command,
+                [end] + password_prompts,
+            )
+            response = await _expect(
+                server,
+                [end] + password_prompts,
+                runner.options["cmd_timeout"],
+            )
+            replies.append(
+                runner._framed_reply(server, capture, start, response)
+            )
+            if replies[-1][1] is None:
+                break
+    except (pexpect.TIMEOUT, pexpect.EOF):
+        runner._captured(server, capture)
+
+    if len(replies) < len(frames):
+        await send_interrupt(runner, server)
+        return runner._unfinished(replies, len(frames))
+
+    await _framed_prompt(runner, server)
+    return replies
+
+
+async def _framed_prompt(runner, server):
+    """Moves past the prompt after a framed command. See _framed_prompt."""
+
+    try:
+        await _expect(
+            server,
+            runner._prompts(SHELL_PROMPTS, server),
+            FRAMED_PROMPT_WAIT,
+        )
+    except pexpect.TIMEOUT:
+        runner._learn_prompt(server.before, server)
+    except pexpect.EOF:
+        pass
+
+
+async def _try_for_unmatched_prompt(runner, server, output, command,
+                                    _from_login=False, _attempts_left=3):
+    """Guesses a missing shell prompt. See _try_for_unmatched_prompt.
+
+    Returns:
+        format_output if it can find a new prompt, or -1 on error. When
+        _from_login is set, the (connection, code) tuple is returned
+    """
+
+    runner._learn_prompt(output, server)
+
+    try:
+        server.sendline()
+        await _expect(
+            server,
+            runner._prompts(SHELL_PROMPTS, server),
+            2,
+        )
+    except (pexpect.TIMEOUT, pexpect.EOF):
+        if _attempts_left:
+            return await _try_for_unmatched_prompt(
+                runner,
+                server,
+                server.before,
+                command,
+                _from_login=_from_login,
+                _attempts_left=(_attempts_left - 1),
+            )
+    else:
+        await _push_expect_forward(runner, server)
+        return runner._unmatched_result(server, output, command, _from_login)
+
+    await send_interrupt(runner, server)
+    return runner._unmatched_result(None, output, command, _from_login)
+
+
+async def send_interrupt(runner, sshc):
+    """Sends ^c and pushes the pexpect object forward. See send_interrupt."""
+
+    sshc.sendline(chr(0x003))
+    await _push_expect_forward(runner, sshc)
+
+
+async def _push_expect_forward(runner, sshc):
+    """Moves the expect object forwards. See _push_expect_forward."""
+
+    prompts = runner._prompts(SHELL_PROMPTS, sshc)
+    resync = _Resync()
+    while resync.wait is not None:
+        try:
+            await _expect(sshc, prompts, resync.wait)
+        except pexpect.TIMEOUT:
+            resync.timed_out()
+        except pexpect.EOF:
+            return False
+        else:
+            resync.matched()
+    return resync.found
@@ -36,23 +36,50 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from __future__ import unicode_literals
 import os
+import re
 import sys
 import math
 import time
+import uuid
 import codecs
+import collections
+import shutil
 import getpass
 import inspect
 import pexpect
+import weakref
+import tempfile
 import threading
-from concurrent.futures import ThreadPoolExecutor
+import functools
+import itertools
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
 
+from bladerunner.cache import SessionCache
+from bladerunner.capture import Capture, spill_prefix
+from bladerunner.concurrency import AdaptiveLimit
+from bladerunner.timing import NOT_TIMING, TIMER, Timings
+from bladerunner.prompts import PromptStore
 from bladerunner.progressbar import ProgressBar
 from bladerunner.interactive import BladerunnerInteractive
-from bladerunner.networking import can_resolve, ips_in_subnet
+from bladerunner.networking import (
+    iter_subnet,
+    subnet_size,
+    ExpandedServers,
+    Resolver,
+    probe,
+)
+from bladerunner.hosts import iter_hosts
 from bladerunner.formatting import (
     FakeStdOut,
+    decode,
     format_line,
     format_output,
+    format_framed_output,
     DEFAULT_ENCODING,
 )
 
@@ -61,10 +88,37 @@ if sys.version_info > (3,):
     PY3 = True
     STRING_TYPE = str
     UNICODE_CHR = chr
+    import queue
 else:
     PY3 = False
     STRING_TYPE = basestring
     UNICODE_CHR = unichr
+    import Queue as queue
+
+
+# the options keys of each combination of prompts passed to expect, in order
+SHELL_PROMPTS = ("shell_prompts", "extra_prompts")
+COMMAND_PROMPTS = ("shell_prompts", "extra_prompts", "passwd_prompts")
+LOGIN_PROMPTS = ("passwd_prompts", "shell_prompts", "extra_prompts")
+
+# seconds to wait for the shell prompt after a framed command's end marker
+FRAMED_PROMPT_WAIT = 1
+
+# the number of hosts probed at once with the probe_timeout option
+PROBE_BATCH = 256
+
+# the most times per second the progressbar is redrawn
+PROGRESS_REFRESH = 10
+
+# escalating seconds to wait for a shell prompt when resynchronizing, the
+# first wait of 0 only drains what is already buffered without blocking
+RESYNC_WAITS = (0, 0.05, 0.1, 0.2, 0.4, 0.8, 1.6)
+
+# seconds without another prompt after which the shell is considered quiet
+RESYNC_QUIET = 0.1
+
+# the most extra prompts consumed after the first one while resynchronizing
+RESYNC_MAX_PROMPTS = 4
 
 
 class Bladerunner(object):
@@ -82,12 +136,48 @@ class Bladerunner(object):
         jump_user: alternate username for jump_host (None)
         jump_password: alternate password for jump_host (None)
         jump_port: SSH port for jump_host (22)
+        jump_sessions: integer number of parallel jump_host sessions (1)
+        jump_transport: how to reach hosts behind jump_host. "shell" types ssh
+                        into the jump_host's shell, "proxyjump" runs a local
+                        ssh per host, multiplexed over one jump_host master
+                        connection with ControlMaster ("shell")
         second_password: an additional different password for commands (None)
+        session_cache: integer maximum of logged in sessions to keep between
+                       runs for reuse, without a jump_host. 0 to disable (0)
+        session_idle: integer seconds before a cached session is closed (300)
+        prompt_file: path of a JSON file to save prompts learned per host in
+                     and load them from on the next run (None)
+        resolve_ttl: integer seconds to remember if a host resolves, 0 to
+                     look it up on every connection (300)
+        hosts_map: dictionary of hostnames to addresses to use instead of
+                   DNS, an address of None can't be resolved (None)
+        probe_timeout: float seconds to wait for each host to accept a TCP
+                       connection before running, hosts which don't are
+                       skipped with error -7. Not used with a jump_host (0)
         password_safety: check if the first login succeeds first (False)
         port: SSH port for the servers (22)
         cmd_timeout: integer in seconds to wait for commands (20)
+        capture_limit: integer bytes of each command's output to keep, the
+                       first and last halves are kept and a line saying how
+                       much was left out goes between them. 0 to keep it all
+                       (0)
+        capture_spill: with capture_limit, write the full output of commands
+                       going over it to temporary files, listed per host as
+                       (command, path) tuples under a spilled key (False)
+        framed: wrap each command in echoed start and end markers, to find
+                its output and exit status without the shell prompt. The
+                results include an exit_codes list. POSIX shells only (False)
+        pipelined: send all of the commands for a host in one write, framed
+                   as above. Commands can't read from stdin (False)
         timeout: integer in seconds to wait to connect (20)
+        timings: include the seconds spent resolving, spawning ssh, logging
+                 in, on each command and closing in each result, under a
+                 timings key. See bladerunner.timing.summarize (False)
         threads: integer number of parallel threads to run (100)
+        adaptive_threads: grow and shrink the number of hosts run at once
+                          between min_threads and threads, with how fast
+                          hosts connect and how often they fail to (False)
+        min_threads: integer fewest hosts to run at once when adaptive (4)
         style: integer for outputting. Between 0-3 are pretty, or CSV (0)
         csv_char: string character to use for CSV results (",")
         progressbar: boolean to declare if we want a progress display (False)
@@ -102,25 +192,40 @@ class Bladerunner(object):
             options = {}
 
         defaults = {
+            "adaptive_threads": False,
+            "capture_limit": 0,
+            "capture_spill": False,
             "cmd_timeout": 20,
             "csv_char": ",",
             "debug": False,
             "delay": None,
             "extra_prompts": [],
+            "framed": False,
+            "hosts_map": None,
             "jump_host": None,
             "jump_password": None,
             "jump_user": None,
             "jump_port": 22,
+            "jump_sessions": 1,
+            "jump_transport": "shell",
+            "min_threads": 4,
             "output_file": False,
             "password": None,
             "password_safety": False,
+            "pipelined": False,
             "port": 22,
             "progressbar": False,
+            "probe_timeout": 0,
+            "prompt_file": None,
+            "resolve_ttl": 300,
             "second_password": None,
+            "session_cache": 0,
+            "session_idle": 300,
             "ssh_key": None,
             "style": 0,
             "threads": 100,
             "timeout": 20,
+            "timings": False,
             "unix_line_endings": False,
             "username": None,
             "width": None,
@@ -147,9 +252,33 @@ class Bladerunner(object):
 
         self.progress = None
         self.sshc = None
+        self.jump_sessions = []
+        self.jump_control = None
         self.commands = None
         self.commands_on_servers = None
         self.interactive_hosts = {}
+        self._interactive_lock = threading.Lock()
+        self._prompt_cache = {}
+        self._session_hosts = weakref.WeakKeyDictionary()
+        self._encodings = weakref.WeakKeyDictionary()
+        self.prompt_store = PromptStore(self.options["prompt_file"])
+        self.unreachable = set()
+        self.limiter = None
+        self._timing = threading.local()
+        self.resolver = Resolver(
+            self.options["resolve_ttl"],
+            self.options["hosts_map"],
+        )
+
+        if self.options["session_cache"]:
+            self.session_cache = SessionCache(
+                self.options["session_cache"],
+                self.options["session_idle"],
+                closer=self._close_cached,
+                checker=self._session_alive,
+            )
+        else:
+            self.session_cache = None
 
         if not self.options["windows_line_endings"] and \
           not self.options["unix_line_endings"] and hasattr(os, "uname") and \
@@ -165,7 +294,9 @@ class Bladerunner(object):
         Args::
 
             commands: a list of strings of commands to run
-            servers: a list of strings of hostnames
+            servers: a list of strings of hostnames, or a lazy source of them
+                     such as a generator, open file or callable, see
+                     bladerunner.hosts.iter_hosts
             commands_on_servers: an optional dictionary used when providing
                                  unique lists of commands per server
 
@@ -174,7 +305,69 @@ class Bladerunner(object):
             is a list of tuples of commands issued and their replies.
         """
 
-        if not isinstance(servers, (list, tuple)):
+        servers = self._start_run(commands, servers, commands_on_servers)
+
+        if self.options["delay"] or len(self.jump_sessions) == 1:
+            results = self._run_serial(servers)
+        elif self.jump_sessions:
+            results = self._run_jumped(servers)
+        else:
+            results = self._run_parallel(servers)
+
+        self._end_run()
+
+        return results
+
+    def run_iter(self, commands=None, servers=None, commands_on_servers=None):
+        """Executes commands on servers, yielding results as they complete.
+
+        Takes the same arguments as run(), but rather than returning a list
+        once every server has finished, each server's result dictionary is
+        yielded as soon as it is available. Results are yielded in the order
+        the servers finish, not the order they were provided in.
+
+        Args::
+
+            commands: a list of strings of commands to run
+            servers: a list of strings of hostnames
+            commands_on_servers: an optional dictionary used when providing
+                                 unique lists of commands per server
+
+        Yields:
+            dictionaries with two keys: name, and results. results is a list
+            of tuples of commands issued and their replies.
+        """
+
+        servers = self._start_run(commands, servers, commands_on_servers)
+
+        try:
+            if self.options["delay"] or len(self.jump_sessions) == 1:
+                results = self._iter_serial(servers)
+            elif self.jump_sessions:
+                results = self._iter_jumped(servers)
+            elif self.options["password_safety"]:
+                results = self._iter_parallel_safely(servers)
+            else:
+                results = self._iter_completed(
+                    self._run_single,
+                    servers,
+                    self.options["threads"],
+                    self._start_limiter(),
+                )
+
+            for result in results:
+                yield result
+        finally:
+            self._end_run()
+
+    def _start_run(self, commands, servers, commands_on_servers):
+        """Prepares the servers, progressbar and jump_host for a run.
+
+        Returns:
+            the list of servers to run on
+        """
+
+        if servers is None or isinstance(servers, STRING_TYPE):
             servers = [servers]
 
         if not isinstance(commands, (list, tuple)):
@@ -182,9 +375,15 @@ class Bladerunner(object):
 
         servers = self._prep_servers(commands, servers, commands_on_servers)
 
+        if _known_length(servers) is not None:
+            # lazy sources are resolved as they're read instead
+            self.resolver.prefetch(iter(servers), self.options["threads"])
+
         if self.options["progressbar"]:
-            self.progress = ProgressBar(len(servers), self.options)
-            self.progress.setup()
+            servers = self._start_progress(servers)
+
+        if self.options["probe_timeout"] and not self.options["jump_host"]:
+            servers = self._probe_servers(servers)
 
         if self.options["jump_host"]:
             jumpuser = self.options["jump_user"] or self.options["username"]
@@ -195,22 +394,106 @@ class Bladerunner(object):
                 self.options["jump_port"],
             )
             if error_code < 0:
-                message = int(math.fabs(error_code)) - 1
                 raise SystemExit("Jumpbox Error: {0}".format(
-                    self.errors[message]))
+                    self._error_message(error_code)))
+
+            if not self._multiplexed():
+                self.jump_sessions = [self.sshc] + self._open_jump_sessions(
+                    min(
+                        self.options["jump_sessions"],
+                        _known_length(servers, self.options["jump_sessions"]),
+                    ) - 1,
+                )
 
-        if self.options["delay"] or self.options["jump_host"]:
-            results = self._run_serial(servers)
-        else:
-            results = self._run_parallel(servers)
+        return servers
+
+    def _probe_servers(self, servers):
+        """Yields servers after probing them for ssh, a batch at a time.
+
+        Servers which don't accept a connection within probe_timeout are
+        added to self.unreachable, for connect to fail without ssh. They're
+        looked up through self.resolver first, waiting at most probe_timeout
+        for DNS. Servers not resolved by then aren't probed, connect
+        resolves them as usual.
+        """
+
+        servers = iter(servers)
+        while True:
+            batch = list(itertools.islice(servers, PROBE_BATCH))
+            if not batch:
+                return
+
+            self.unreachable.update(probe(
+                batch,
+                self.options["port"],
+                self.options["probe_timeout"],
+                resolver=self.resolver,
+            ))
+            for server in batch:
+                yield server
+
+    def _start_progress(self, servers):
+        """Sets up the progressbar for the servers to run on.
+
+        Returns:
+            servers, wrapped to grow the progressbar's total as hosts are
+            read when the number of servers isn't known up front
+        """
+
+        total = _known_length(servers)
+        self.progress = ProgressBar(total or 0, dict(
+            self.options,
+            refresh_rate=PROGRESS_REFRESH,
+            show_rate=True,
+        ))
+        self.progress.setup()
+
+        if total is None:
+            return self._grow_progress(servers)
+        return servers
+
+    def _grow_progress(self, servers):
+        """Yields from servers, adding each one to the progressbar's total."""
+
+        for server in servers:
+            self.progress.grow()
+            yield server
+
+    def _end_run(self):
+        """Closes the jump_host sessions and clears the progressbar."""
+
+        self.resolver.cancel()
+        self.unreachable.clear()
+        self.limiter = None
 
         if self.options["jump_host"]:
-            self.close(self.sshc, True)
+            for jump_session in self.jump_sessions or [self.sshc]:
+                self.close(jump_session, True)
+            self.jump_sessions = []
+            self.sshc = None
+            self._stop_control_master()
 
         if self.options["progressbar"]:
             self.progress.clear()
 
-        return results
+        self.prompt_store.save()
+
+    def arun(self, commands=None, servers=None, commands_on_servers=None):
+        """Executes commands on servers from an asyncio event loop.
+
+        Python 3.5+ only. Takes the same arguments as run(), see
+        bladerunner.aio.arun for details. The delay, timings, session_cache
+        and adaptive_threads options are only supported by the threaded
+        engine, with any of them set the run is handed to run() in an
+        executor.
+
+        Returns:
+            a coroutine, which returns the same results as run()
+        """
+
+        # imported here, the module's syntax is python 3 only
+        from bladerunner.aio import arun
+        return arun(self, commands, servers, commands_on_servers)
 
     def _run_thread(self, commands, servers, commands_on_servers, callback):
         """Wrapper function to execute self.run with a callback."""
@@ -246,17 +529,26 @@ class Bladerunner(object):
     def _prep_servers(self, commands, servers, commands_on_servers=None):
         """Checks to see if any of the servers passed are CIDR-ish networks.
 
+        Servers starting with "!" are exclusions, any IP, network or hostname
+        after the "!" is skipped when expanding the other servers.
+
         Args::
 
             commands: list of commands to run
-            servers: list of servers to run the commands on
+            servers: list of servers to run the commands on, or a lazy
+                     source of servers for bladerunner.hosts.iter_hosts
             commands_on_servers: dictionary mapping commands to servers
 
         Returns:
-            list of servers to run on, including any expanded networks
+            sequence of servers to run on, networks are expanded lazily. Lazy
+            sources return an iterator, without a length
         """
 
         if commands_on_servers is not None:
+            exclude = [
+                server[1:] for server in commands_on_servers
+                if isinstance(server, STRING_TYPE) and server.startswith("!")
+            ]
             actual_commands_on_servers = {}
             for servers, command_list in commands_on_servers.items():
                 if not isinstance(servers, tuple):
@@ -265,25 +557,29 @@ class Bladerunner(object):
                     if not isinstance(command_list, (list, tuple)):
                         command_list = [command_list]
 
-                    network_members = ips_in_subnet(server)
-                    if network_members:
-                        for member in network_members:
+                    if server.startswith("!"):
+                        continue
+                    elif subnet_size(server) is not None:
+                        for member in iter_subnet(server, exclude):
                             actual_commands_on_servers[member] = command_list
-                    else:
+                    elif server not in exclude:
                         actual_commands_on_servers[server] = command_list
 
             self.commands = None
             self.commands_on_servers = actual_commands_on_servers
 
             expanded_servers = list(actual_commands_on_servers.keys())
+        elif not isinstance(servers, (list, tuple)):
+            expanded_servers = iter_hosts(servers)
+            self.commands = commands
         else:
-            expanded_servers = []
-            for server in servers:
-                network_members = ips_in_subnet(server)
-                if network_members:
-                    expanded_servers.extend(network_members)
-                else:
-                    expanded_servers.append(server)
+            exclude = [
+                server[1:] for server in servers if server.startswith("!")
+            ]
+            expanded_servers = ExpandedServers(
+                [server for server in servers if not server.startswith("!")],
+                exclude,
+            )
 
             self.commands = commands
 
@@ -308,14 +604,28 @@ class Bladerunner(object):
             servers: the list of servers to run
         """
 
-        results = []
+        return list(self._map_windowed(
+            self._run_single,
+            servers,
+            self.options["threads"],
+            self._start_limiter(),
+        ))
 
-        max_threads = self.options["threads"]
-        with ThreadPoolExecutor(max_workers=max_threads) as executor:
-            for result_dict in executor.map(self._run_single, servers):
-                results.append(result_dict)
+    def _start_limiter(self):
+        """Creates the AdaptiveLimit for a run with adaptive_threads.
 
-        return results
+        Returns:
+            the AdaptiveLimit, also set as self.limiter, or None
+        """
+
+        if self.options["adaptive_threads"]:
+            self.limiter = AdaptiveLimit(
+                self.options["min_threads"],
+                self.options["threads"],
+            )
+        else:
+            self.limiter = None
+        return self.limiter
 
     def _run_parallel_safely(self, servers):
         """Runs commands in parallel after checking the success of first login.
@@ -325,117 +635,748 @@ class Bladerunner(object):
         """
 
         results = []
-        sshr, error_code = self.connect(
-            servers[0],
-            self.options["username"],
-            self.options["password"],
-            self.options['port'],
-        )
-        if error_code < 0:
-            message = int(math.fabs(error_code)) - 1
-            results.append({
-                "name": servers[0],
-                "results": [("login", self.errors[message])],
-            })
-            return results + self._run_serial(
-                servers[1:],
-            )
+        first, servers = _split_first(servers)
+        if first is None:
+            return results
+
+        results.append(self._run_single(first))
+        if self._login_error(results[0]):
+            return results + self._run_serial(servers)
         else:
-            results.append(self.send_commands(sshr, servers[0]))
-            self.close(sshr, not self.options["jump_host"])
-            sshr = None
-            if self.options["progressbar"]:
-                self.progress.update()
+            return results + self._run_parallel_no_check(servers)
+
+    def _open_jump_sessions(self, count):
+        """Opens additional sessions on the jump_host, in parallel.
+
+        Args:
+            count: integer number of sessions to open alongside self.sshc
+
+        Returns:
+            list of the pexpect objects that connected, may be less than count
+        """
+
+        if count < 1:
+            return []
+
+        jumpuser = self.options["jump_user"] or self.options["username"]
+        sessions = []
+
+        max_threads = min(self.options["threads"], count)
+        with ThreadPoolExecutor(max_workers=max_threads) as executor:
+            futures = [executor.submit(
+                self.connect,
+                self.options["jump_host"],
+                jumpuser,
+                self.options["jump_pass"],
+                self.options["jump_port"],
+                jumpbox=False,
+            ) for _ in range(count)]
+
+            for future in futures:
+                sshc, error_code = future.result()
+                if error_code > 0:
+                    sessions.append(sshc)
+
+        return sessions
+
+    def _run_jumped(self, servers):
+        """Runs commands on servers in parallel over the jump_host sessions.
+
+        Each session hops to one target at a time, so the concurrency is the
+        number of sessions which could be opened on the jump_host. With
+        password_safety, the first server is run alone and the rest are run
+        in serial if it could not be logged into.
 
-            return results + self._run_parallel_no_check(servers[1:])
+        Args:
+            servers: the list of servers to run
+        """
+
+        results = []
+        if self.options["password_safety"]:
+            first, servers = _split_first(servers)
+            if first is None:
+                return results
+
+            results.append(self._run_single(first))
+            if self._login_error(results[0]):
+                return results + self._run_serial(servers)
+
+        pool = queue.Queue()
+        for jump_session in self.jump_sessions:
+            pool.put(jump_session)
+
+        return results + list(self._map_windowed(
+            functools.partial(self._run_single_jumped, pool),
+            servers,
+            len(self.jump_sessions),
+        ))
+
+    def _run_single_jumped(self, pool, server):
+        """Checks out a jump_host session from pool to run on a server."""
+
+        jumpbox = pool.get()
+        try:
+            return self._run_single(server, jumpbox)
+        finally:
+            pool.put(jumpbox)
 
     def _run_serial(self, servers):
         """Runs commands on servers in serial after jumpbox."""
 
-        results = []
-        for server in servers:
-            if self.options["delay"] and servers.index(server) > 0:
+        return list(self._iter_serial(servers))
+
+    def _iter_serial(self, servers):
+        """Yields the results of running on servers in serial."""
+
+        for index, server in enumerate(servers):
+            if self.options["delay"] and index > 0:
                 time.sleep(self.options["delay"])
-            results.append(self._run_single(server))
-        return results
+            yield self._run_single(server)
+
+    def _iter_jumped(self, servers):
+        """Yields results from servers over the jump_host sessions.
+
+        With password_safety, the first server is run alone and the rest are
+        run in serial if it could not be logged into.
+        """
+
+        if self.options["password_safety"]:
+            first, servers = _split_first(servers)
+            if first is None:
+                return
+
+            first = self._run_single(first)
+            yield first
+
+            if self._login_error(first):
+                for result in self._iter_serial(servers):
+                    yield result
+                return
+
+        pool = queue.Queue()
+        for jump_session in self.jump_sessions:
+            pool.put(jump_session)
+
+        for result in self._iter_completed(
+                functools.partial(self._run_single_jumped, pool),
+                servers,
+                len(self.jump_sessions),
+        ):
+            yield result
+
+    def _iter_parallel_safely(self, servers):
+        """Yields results in parallel after checking the first login."""
+
+        first, servers = _split_first(servers)
+        if first is None:
+            return
+
+        first = self._run_single(first)
+        yield first
+
+        if self._login_error(first):
+            remaining = self._iter_serial(servers)
+        else:
+            remaining = self._iter_completed(
+                self._run_single,
+                servers,
+                self.options["threads"],
+                self._start_limiter(),
+            )
+
+        for result in remaining:
+            yield result
+
+    @staticmethod
+    def _map_windowed(function, servers, max_workers, limiter=None):
+        """Yields the results of function(server) in the order of servers.
+
+        Like executor.map, but servers are only pulled from the iterable as
+        earlier ones finish, so an expanded network is never held at once.
+
+        Args::
+
+            function: the callable to run with each server
+            servers: an iterable of servers
+            max_workers: integer number of threads to run with
+            limiter: optional AdaptiveLimit of the servers run at once
+
+        Yields:
+            the return of function for each server, in order of servers
+        """
+
+        if limiter is not None:
+            max_workers = limiter.ceiling
+
+        window = max(max_workers, 1) * 2
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = collections.deque()
+            for server in servers:
+                if limiter is not None:
+                    limiter.acquire()
+                future = executor.submit(function, server)
+                if limiter is not None:
+                    future.add_done_callback(limiter.release)
+                pending.append(future)
+
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+
+    @staticmethod
+    def _iter_completed(function, servers, max_workers, limiter=None):
+        """Yields the results of function(server) as each one completes.
+
+        Only a small multiple of max_workers is submitted to the executor at
+        a time, so a huge list of servers doesn't queue up all at once.
+
+        Args::
+
+            function: the callable to run with each server
+            servers: an iterable of servers
+            max_workers: integer number of threads to run with
+            limiter: optional AdaptiveLimit of the servers run at once
+
+        Yields:
+            the return of function for each server, in order of completion
+        """
+
+        if limiter is not None:
+            max_workers = limiter.ceiling
+
+        window = max(max_workers, 1) * 2
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = set()
+            for server in servers:
+                if limiter is not None:
+                    limiter.acquire()
+                future = executor.submit(function, server)
+                if limiter is not None:
+                    future.add_done_callback(limiter.release)
+                pending.add(future)
+
+                if len(pending) >= window:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+
+            for future in as_completed(pending):
+                yield future.result()
+
+    def _error_message(self, error_code):
+        """Returns the message for a negative error code from connect."""
+
+        return self.errors[int(math.fabs(error_code)) - 1]
+
+    def _login_failure(self, server, error_code):
+        """Builds the results of a server which could not be logged into.
+
+        Args::
+
+            server: string hostname of the server
+            error_code: the negative error code returned from connect
+
+        Returns:
+            a results dictionary, with the login error as its only result
+        """
+
+        return {
+            "name": server,
+            "results": [("login", self._error_message(error_code))],
+        }
 
-    def _run_single(self, server):
-        """Runs commands on a single server."""
+    def _login_error(self, result):
+        """Checks if a result dictionary is from a failed login.
 
-        (sshr, error_code) = self.connect(
+        Returns:
+            boolean True if the server could not be logged into
+        """
+
+        return len(result["results"]) == 1 and \
+            result["results"][0][0] == "login" and \
+            result["results"][0][1] in self.errors
+
+    def _run_single(self, server, jumpbox=None):
+        """Runs commands on a single server.
+
+        Args::
+
+            server: string hostname to run on
+            jumpbox: optional jump_host pexpect object to connect through
+        """
+
+        if self.options["timings"]:
+            self._timing.current = Timings()
+
+        caching = self._caching() and jumpbox is None
+        sshr = self.session_cache.checkout(server) if caching else None
+
+        connect_args = (
             server,
             self.options["username"],
             self.options["password"],
             self.options['port'],
         )
+        if sshr is not None:
+            error_code = 1
+        elif jumpbox is None:
+            probed_out = server in self.unreachable
+            started = TIMER()
+            (sshr, error_code) = self.connect(*connect_args)
+            if self.limiter is not None and not probed_out:
+                self.limiter.record(TIMER() - started, error_code)
+        else:
+            (sshr, error_code) = self.connect(*connect_args, jumpbox=jumpbox)
+
         if error_code < 0:
-            message = int(math.fabs(error_code)) - 1
-            results = {
-                "name": server,
-                "results": [("login", self.errors[message])],
-            }
+            results = self._login_failure(server, error_code)
         else:
             results = self.send_commands(sshr, server)
-            self.close(sshr, not self.options["jump_host"])
+            with self._phase("close"):
+                if caching:
+                    self.session_cache.checkin(server, sshr)
+                else:
+                    self.close(sshr, not self._jumps_from_shell())
             sshr = None
 
-        if self.options["progressbar"]:
-            self.progress.update()
+        if self.options["timings"]:
+            results["timings"] = self._timing.current.as_dict()
+            self._timing.current = None
+
+        if self.options["progressbar"]:
+            self.progress.update()
+
+        return results
+
+    def _phase(self, name):
+        """Times a phase of the current host, if timings are enabled.
+
+        Returns:
+            a context manager to run the phase inside of
+        """
+
+        timings = getattr(self._timing, "current", None)
+        if timings is None:
+            return NOT_TIMING
+        return timings.phase(name)
+
+    def _timed_command(self, send, command, server):
+        """Calls send(command, server), timing it if timings are enabled."""
+
+        timings = getattr(self._timing, "current", None)
+        if timings is None:
+            return send(command, server)
+
+        started = TIMER()
+        try:
+            return send(command, server)
+        finally:
+            timings.add_command(command, TIMER() - started)
+
+    def _caching(self):
+        """Returns True if sessions should be kept in the session_cache."""
+
+        return self.session_cache is not None and \
+            not self.options["jump_host"]
+
+    def _session_alive(self, sshc):
+        """Checks a cached session is still alive and at a shell prompt.
+
+        Args:
+            sshc: the pexpect object
+
+        Returns:
+            boolean, True if the session can be used to issue commands
+        """
+
+        try:
+            if not sshc.isalive():
+                return False
+            sshc.sendline()
+            sshc.expect_list(
+                self._prompts(SHELL_PROMPTS, sshc),
+                2,
+            )
+        except (pexpect.TIMEOUT, pexpect.EOF, OSError):
+            return False
+        return True
+
+    def _close_cached(self, sshc):
+        """Closes a session evicted from the session_cache."""
+
+        try:
+            self.close(sshc, True)
+        except OSError:
+            pass  # already gone
+
+    def close_cached_sessions(self):
+        """Closes all sessions being held open in the session_cache."""
+
+        if self.session_cache is not None:
+            self.session_cache.clear()
+
+    def _send_cmd(self, command, server):
+        """Internal method to send a single command to the pexpect object.
+
+        Args::
+
+            command: the command to send
+            server: the pexpect object to send to
+
+        Returns:
+            The formatted output of the command as a string, or -1 on timeout
+        """
+
+        if self.options["framed"]:
+            return self._send_framed(command, server)[0]
+
+        capture = self._start_capture(
+            server,
+            command,
+            self._prompts(COMMAND_PROMPTS, server),
+        )
+        try:
+            self._send_line(server, command)
+
+            cmd_response = server.expect_list(
+                self._prompts(COMMAND_PROMPTS, server),
+                self.options["cmd_timeout"],
+            )
+
+            if self._second_password_due(cmd_response, server):
+                server.sendline(self.options["second_password"])
+                server.expect_list(
+                    self._prompts(SHELL_PROMPTS, server),
+                    self.options["cmd_timeout"],
+                )
+        except (pexpect.TIMEOUT, pexpect.EOF):
+            return self._try_for_unmatched_prompt(
+                server,
+                self._captured(server, capture),
+                command,
+            )
+
+        return format_output(
+            self._captured(server, capture),
+            command,
+            self.options,
+        )
+
+    def _second_password_due(self, cmd_response, server):
+        """Checks if the second_password should be sent after a command.
+
+        Args::
+
+            cmd_response: the index of the COMMAND_PROMPTS matched
+            server: the pexpect object the command was sent to
+
+        Returns:
+            boolean True if a password prompt matched and there's a
+            second_password to send
+        """
+
+        return cmd_response >= (
+            len(self._prompts(COMMAND_PROMPTS, server)) -
+            len(self.options["passwd_prompts"])
+        ) and len(self.options["second_password"] or "") > 0
+
+    def _send_framed(self, command, server):
+        """Sends a command wrapped in start and end markers.
+
+        The end marker carries the exit status of the command, so it's known
+        to be finished as soon as that is printed, without needing to match
+        the shell prompt.
+
+        Args::
+
+            command: the command to send
+            server: the pexpect object to send to
+
+        Returns:
+            a tuple of the formatted output as a string, or -1 on timeout,
+            and the integer exit status, or None if it didn't finish
+        """
+
+        line, start, end = self._frame(command)
+        password_prompts = self._options_prompts(("passwd_prompts",))
+        capture = self._start_capture(
+            server,
+            command,
+            [end] + password_prompts,
+        )
+
+        try:
+            self._send_line(server, line)
+
+            response = server.expect_list(
+                [end] + password_prompts,
+                self.options["cmd_timeout"],
+            )
+
+            if response > 0 and self.options["second_password"]:
+                server.sendline(self.options["second_password"])
+                response = server.expect_list(
+                    [end],
+                    self.options["cmd_timeout"],
+                )
+        except (pexpect.TIMEOUT, pexpect.EOF):
+            self._captured(server, capture)
+            self.send_interrupt(server)
+            return (-1, None)
+
+        reply = self._framed_reply(server, capture, start, response)
+        if reply[1] is None:
+            self.send_interrupt(server)
+        else:
+            self._framed_prompt(server)
+        return reply
+
+    def _send_pipelined(self, commands, server):
+        """Sends all of the commands in one write, each with its own markers.
+
+        The outputs are then read back in order by their end markers, so
+        there's one round trip for all of the commands instead of one each.
+        Commands which read from stdin would consume the commands after them.
+
+        Args::
+
+            commands: the list of commands to send
+            server: the pexpect object to send to
+
+        Returns:
+            a list of tuples per command, as returned by _send_framed
+        """
+
+        frames = [self._frame(command) for command in commands]
+        password_prompts = self._options_prompts(("passwd_prompts",))
+        replies = []
+        capture = None
+
+        try:
+            self._send_line(server, self._line_ending().join(
+                line for line, _, _ in frames
+            ))
+
+            for command, (_, start, end) in zip(commands, frames):
+                capture = self._start_capture(
+                    server,
+                    command,
+                    [end] + password_prompts,
+                )
+                response = server.expect_list(
+                    [end] + password_prompts,
+                    self.options["cmd_timeout"],
+                )
+                replies.append(
+                    self._framed_reply(server, capture, start, response)
+                )
+                if replies[-1][1] is None:
+                    # the password prompt will swallow the commands after it
+                    break
+        except (pexpect.TIMEOUT, pexpect.EOF):
+            self._captured(server, capture)
+
+        if len(replies) < len(frames):
+            # interrupting also clears the rest of the commands from the tty
+            self.send_interrupt(server)
+            return self._unfinished(replies, len(frames))
+
+        self._framed_prompt(server)
+        return replies
+
+    def _framed_reply(self, server, capture, start, response):
+        """Builds the reply to a framed command once expect has returned.
+
+        Args::
+
+            server: the pexpect object the command was sent to
+            capture: the Capture returned from _start_capture, or None
+            start: the start marker of the command, as returned by _frame
+            response: the index matched of the end marker and password prompts
+
+        Returns:
+            a tuple of the formatted output and the integer exit status, or
+            None if a password prompt was left waiting, which is interrupted
+        """
+
+        output = format_framed_output(
+            self._captured(server, capture),
+            start,
+            self.options,
+        )
+
+        if response > 0:
+            # a password prompt, without a second_password to send
+            return (output, None)
+        return (output, int(server.match.group(1)))
+
+    @staticmethod
+    def _unfinished(replies, count):
+        """Pads the replies of pipelined commands which didn't all finish.
+
+        Returns:
+            replies, with (-1, None) for each of the count which is missing
+        """
+
+        return replies + [(-1, None)] * (count - len(replies))
+
+    @staticmethod
+    def _frame(command):
+        """Wraps a command in echo commands for its start and end markers.
+
+        The markers are split by quotes in the command line, so the terminal
+        echoing it back isn't mistaken for the markers themselves. The
+        command is on its own line inside a { } group, so a trailing comment
+        or & in it can't swallow the end marker.
+
+        Args:
+            command: the command to wrap
+
+        Returns:
+            a tuple of the command line to send, the start marker as bytes
+            and the compiled end marker, which captures the exit status
+        """
+
+        marker = uuid.uuid4().hex
+        command = command.rstrip().rstrip(";").rstrip() or ":"
+
+        line = "echo BR''_S_{0}; {{\n{1}\n}}; echo BR''_E_{0}:$?".format(
+            marker,
+            command,
+        )
+        start = codecs.encode("BR_S_{0}".format(marker), "ascii")
+        # anchored to the line ending, so a status still arriving isn't cut
+        end = re.compile(codecs.encode(
+            "BR_E_{0}:(\\d+)\\r?\\n".format(marker),
+            "ascii",
+        ))
+        return (line, start, end)
+
+    def _framed_prompt(self, server):
+        """Moves past the shell prompt printed after a framed command.
+
+        If the prompt isn't known, what was printed is learned as the prompt
+        for the host, so this only waits once per host.
+
+        Args:
+            server: the pexpect object
+        """
+
+        try:
+            server.expect_list(
+                self._prompts(SHELL_PROMPTS, server),
+                FRAMED_PROMPT_WAIT,
+            )
+        except pexpect.TIMEOUT:
+            self._learn_prompt(server.before, server)
+        except pexpect.EOF:
+            pass
+
+    def _start_capture(self, server, command, patterns=()):
+        """Starts capturing the output of command, with capture_limit.
+
+        Args::
+
+            server: the pexpect object the command is sent to
+            command: the command being sent
+            patterns: the compiled patterns expected after the output
+
+        Returns:
+            the Capture teed from the server's reads, or None without a limit
+        """
+
+        if not self.options["capture_limit"]:
+            return None
+
+        capture = server.logfile_read
+        if not isinstance(capture, Capture):
+            capture = Capture(
+                server,
+                self.options["capture_limit"],
+                server.logfile_read,
+            )
+            server.logfile_read = capture
+
+        spill = None
+        if self.options["capture_spill"]:
+            # a jump_host's shell is shared, so the host is looked up each time
+            spill = spill_prefix(self._session_hosts.get(server))
+        capture.start(command, spill, patterns)
+        return capture
+
+    def _captured(self, server, capture):
+        """Returns the output to format after a command, see _start_capture.
+
+        Args::
+
+            server: the pexpect object the command was sent to
+            capture: the Capture returned from _start_capture, or None
 
-        return results
+        Returns:
+            the server's before, or its head and tail when over the limit,
+            decoded once with the server's encoding
+        """
 
-    def _send_cmd(self, command, server):
-        """Internal method to send a single command to the pexpect object.
+        if capture is None or not capture.capturing:
+            return self._decode(server, server.before)
+        return self._decode(server, capture.finish(server.before))
+
+    def _decode(self, server, output):
+        """Decodes output from server, with the encoding it last used.
+
+        The encoding found for a connection is tried on its following
+        outputs right after utf-8, which is always tried first so one
+        output falling back to latin-1 doesn't make the rest mojibake.
+        Output which can't be decoded is returned as is.
 
         Args::
 
-            command: the command to send
-            server: the pexpect object to send to
+            server: the pexpect object the output was read from
+            output: bytes of output
 
         Returns:
-            The formatted output of the command as a string, or -1 on timeout
+            the decoded text, or output if it couldn't be decoded
         """
 
-        try:
-            if self.options["unix_line_endings"]:
-                server.send("{0}{1}".format(
-                    command,
-                    UNICODE_CHR(0x000A),
-                ))
-            elif self.options["windows_line_endings"]:
-                server.send("{0}{1}{2}".format(
-                    command,
-                    UNICODE_CHR(0x000D),
-                    UNICODE_CHR(0x000A),
-                ))
-            else:
-                server.sendline(command)
+        text, encoding = decode(output, self._encodings.get(server))
+        if encoding is not None:
+            self._encodings[server] = encoding
+        return output if text is None else text
 
-            cmd_response = server.expect(
-                self.options["shell_prompts"] +
-                self.options["extra_prompts"] +
-                self.options["passwd_prompts"],
-                self.options["cmd_timeout"],
-            )
+    @staticmethod
+    def _take_spills(server):
+        """Returns the (command, path) of each output spilled from server."""
 
-            if cmd_response >= (
-                len(self.options["shell_prompts"]) +
-                len(self.options["extra_prompts"])
-            ) and len(self.options["second_password"] or "") > 0:
-                server.sendline(self.options["second_password"])
-                server.expect(
-                    self.options["shell_prompts"] +
-                    self.options["extra_prompts"],
-                    self.options["cmd_timeout"],
-                )
-        except (pexpect.TIMEOUT, pexpect.EOF):
-            return self._try_for_unmatched_prompt(
-                server,
-                server.before,
-                command,
-            )
+        if isinstance(server.logfile_read, Capture):
+            return server.logfile_read.take_spills()
+        return []
+
+    def _send_line(self, server, command):
+        """Sends a command with the configured line ending.
+
+        Args::
+
+            server: the pexpect object to send to
+            command: the command to send
+        """
+
+        if self.options["unix_line_endings"] or \
+           self.options["windows_line_endings"]:
+            server.send("{0}{1}".format(command, self._line_ending()))
+        else:
+            server.sendline(command)
+
+    def _line_ending(self):
+        """Returns the configured line ending string."""
 
-        return format_output(server.before, command, self.options)
+        if self.options["unix_line_endings"]:
+            return UNICODE_CHR(0x000A)
+        elif self.options["windows_line_endings"]:
+            return "{0}{1}".format(UNICODE_CHR(0x000D), UNICODE_CHR(0x000A))
+        else:
+            return os.linesep
 
     def _try_for_unmatched_prompt(self, server, output, command,
                                   _from_login=False, _attempts_left=3):
@@ -454,30 +1395,12 @@ class Bladerunner(object):
             format_output if it can find a new prompt, or -1 on error
         """
 
-        # prompt is usually in the last 30 chars of the last line of output
-        # do /not/ format_line the prompt, it could contain special characters
-        try:
-            new_prompt = output.splitlines()[-1][-30:]
-        except IndexError:
-            new_prompt = ""
-
-        if isinstance(new_prompt, bytes):
-            new_prompt = codecs.decode(new_prompt, DEFAULT_ENCODING)
-
-        # escape regex characters
-        replacements = ["\\", "/", ")", "(", "[", "]", "{", "}", " ", "$",
-                        "?", ">", "<", "^", ".", "*"]
-        for char in replacements:
-            new_prompt = new_prompt.replace(char, "\{0}".format(char))
-
-        if new_prompt and new_prompt not in self.options["shell_prompts"]:
-            self.options["shell_prompts"].append(new_prompt)
+        self._learn_prompt(output, server)
 
         try:
             server.sendline()
-            server.expect(
-                self.options["shell_prompts"] +
-                self.options["extra_prompts"],
+            server.expect_list(
+                self._prompts(SHELL_PROMPTS, server),
                 2,
             )
         except (pexpect.TIMEOUT, pexpect.EOF):
@@ -491,21 +1414,121 @@ class Bladerunner(object):
                 )
         else:
             self._push_expect_forward(server)
-            if _from_login:
-                return (server, 1)
-            else:
-                return format_output(output, command, self.options)
+            return self._unmatched_result(server, output, command, _from_login)
 
         self.send_interrupt(server)
+        return self._unmatched_result(None, output, command, _from_login)
+
+    def _unmatched_result(self, server, output, command, from_login):
+        """Builds the return of _try_for_unmatched_prompt.
 
-        if _from_login:
-            # if we get here, we tried to guess the prompt by sending enter 3
-            # times, but still didn't return to that same shell. Something odd
-            # is likely happening on the device that needs manual inspection
-            return (None, -6)
+        Args::
+
+            server: the pexpect object, or None if no prompt was found
+            output: the output of command before it timed out
+            command: the command issued that caused the initial timeout
+            from_login: boolean if the (connection, code) tuple is wanted
+
+        Returns:
+            format_output, or -1 if no prompt was found. From login, the
+            (connection, code) tuple
+        """
+
+        if from_login:
+            # without a server, we tried to guess the prompt by sending enter
+            # 3 times, but still didn't return to that same shell. Something
+            # odd is likely happening on the device that needs inspection
+            return (None, -6) if server is None else (server, 1)
+        elif server is not None:
+            return format_output(output, command, self.options)
         else:
             return -1
 
+    def _learn_prompt(self, output, server):
+        """Adds the end of output as a prompt to expect from server's host.
+
+        Args::
+
+            output: the sshc.before after a command which timed out
+            server: the pexpect object the output came from
+        """
+
+        # prompt is usually in the last 30 chars of the last line of output
+        # do /not/ format_line the prompt, it could contain special characters
+        try:
+            new_prompt = output.splitlines()[-1][-30:]
+        except IndexError:
+            new_prompt = ""
+
+        if isinstance(new_prompt, bytes):
+            new_prompt = codecs.decode(new_prompt, DEFAULT_ENCODING)
+
+        # escape regex characters
+        replacements = ["\\", "/", ")", "(", "[", "]", "{", "}", " ", "$",
+                        "?", ">", "<", "^", ".", "*"]
+        for char in replacements:
+            new_prompt = new_prompt.replace(char, "\{0}".format(char))
+
+        if new_prompt and new_prompt not in self.options["shell_prompts"]:
+            host = self._session_hosts.get(server)
+            self.prompt_store.learn(host, new_prompt)
+
+    def _prompts(self, keys, sshc=None):
+        """Returns the compiled prompts from the options keys for expect_list.
+
+        Compiling is the same as pexpect does on every call to expect, but
+        the result is kept until the prompts change so every session can
+        share it. The ids and lengths of the lists are the cache key, to
+        also catch prompts being changed on the options directly. Prompts
+        learned from the host sshc is connected to follow the shell_prompts.
+
+        Args::
+
+            keys: a tuple of options keys, one of SHELL_PROMPTS,
+                  COMMAND_PROMPTS or LOGIN_PROMPTS
+            sshc: the pexpect object the prompts will be expected from
+
+        Returns:
+            a list of compiled bytes regular expressions
+        """
+
+        compiled = self._options_prompts(keys)
+
+        if sshc is None:
+            return compiled
+
+        learned = self.prompt_store.compiled(self._session_hosts.get(sshc))
+        if not learned:
+            return compiled
+
+        shells_end = sum(
+            len(self.options[key])
+            for key in keys[:keys.index("shell_prompts") + 1]
+        )
+        return compiled[:shells_end] + learned + compiled[shells_end:]
+
+    def _options_prompts(self, keys):
+        """Returns and caches the compiled prompts from the options keys."""
+
+        lists = [self.options[key] for key in keys]
+        cache_key = tuple((id(prompts), len(prompts)) for prompts in lists)
+
+        try:
+            return self._prompt_cache[cache_key][1]
+        except KeyError:
+            pass
+
+        compiled = []
+        for prompts in lists:
+            for prompt in prompts:
+                if not isinstance(prompt, bytes):
+                    prompt = codecs.encode(prompt, DEFAULT_ENCODING)
+                compiled.append(re.compile(prompt, re.DOTALL))
+
+        # holding the lists keeps their ids from being reused in a new key
+        self._prompt_cache[cache_key] = (lists, compiled)
+        return compiled
+
     def send_commands(self, server, hostname):
         """Executes the commands on a pexpect object.
 
@@ -519,34 +1542,160 @@ class Bladerunner(object):
 
                 name: string of the server's hostname
                 results: a list of tuples with each command and its result
+
+            when framed or pipelined, exit_codes is also included, a list of
+            the integer exit status of each command, or None if unfinished
         """
 
-        results = {"name": hostname}
-        command_results = []
+        commands = self._commands_for(hostname)
 
-        if self.commands_on_servers:
-            commands = self.commands_on_servers[hostname]
+        if self.options["pipelined"]:
+            with self._phase("pipelined"):
+                replies = self._send_pipelined(commands, server)
+        elif self.options["framed"]:
+            replies = [
+                self._timed_command(self._send_framed, cmd, server)
+                for cmd in commands
+            ]
         else:
-            commands = self.commands
+            replies = [
+                (self._timed_command(self._send_cmd, cmd, server), None)
+                for cmd in commands
+            ]
 
-        for command in commands:
-            command_result = self._send_cmd(command, server)
-            if not command_result or command_result == "\n":
-                command_results.append((
-                    command,
-                    "no output from: {0}".format(command),
-                ))
-            elif command_result == -1:
-                command_results.append((
-                    command,
-                    "did not return after issuing: {0}".format(command),
-                ))
-            else:
-                command_results.append((command, command_result))
+        return self._host_results(server, hostname, commands, replies)
+
+    def _commands_for(self, hostname):
+        """Returns the list of commands to run on hostname."""
 
-        results["results"] = command_results
+        if self.commands_on_servers:
+            return self.commands_on_servers[hostname]
+        return self.commands
+
+    def _host_results(self, server, hostname, commands, replies):
+        """Builds the results dictionary of a host, see send_commands.
+
+        Args::
+
+            server: the pexpect object the commands were sent to
+            hostname: the string hostname of the server
+            commands: the list of commands sent
+            replies: a list of tuples of the output and exit status (or None)
+                     of each command
+
+        Returns:
+            the results dictionary, as returned by send_commands
+        """
+
+        results = {
+            "name": hostname,
+            "results": [
+                self._command_result(command, command_result)
+                for command, (command_result, _) in zip(commands, replies)
+            ],
+        }
+        if self.options["framed"] or self.options["pipelined"]:
+            results["exit_codes"] = [exit_code for _, exit_code in replies]
+        if self.options["capture_spill"]:
+            results["spilled"] = self._take_spills(server)
         return results
 
+    @staticmethod
+    def _command_result(command, command_result):
+        """Builds the (command, result) tuple for a command's output.
+
+        Args::
+
+            command: the command issued
+            command_result: the return from _send_cmd
+
+        Returns:
+            tuple of the command and the string result to report
+        """
+
+        if not command_result or command_result == "\n":
+            return (command, "no output from: {0}".format(command))
+        elif command_result == -1:
+            return (command, "did not return after issuing: {0}".format(
+                command))
+        else:
+            return (command, command_result)
+
+    def _multiplexed(self):
+        """Returns True if hosts are reached through a jump_host master."""
+
+        return bool(self.options["jump_host"]) and \
+            self.options["jump_transport"] == "proxyjump"
+
+    def _jumps_from_shell(self):
+        """Returns True if hosts are reached from the jump_host's shell."""
+
+        return bool(self.options["jump_host"]) and not self._multiplexed()
+
+    def _control_path(self):
+        """Returns the ControlPath socket for the jump_host master connection.
+
+        The socket lives in a private temporary directory which is created on
+        first use and removed by _stop_control_master.
+        """
+
+        if self.jump_control is None:
+            self.jump_control = tempfile.mkdtemp(prefix="bladerunner-")
+
+        return os.path.join(self.jump_control, "jump")
+
+    def _multiplex_flags(self, target):
+        """Builds the ssh flags for the proxyjump transport.
+
+        Connections to the jump_host become (or reuse) the master connection,
+        all others are proxied through it with ssh -W, which is what -J does,
+        but pinned to our ControlPath so no further jump_host logins are made.
+
+        Args:
+            target: string hostname being connected to
+
+        Returns:
+            list of ssh option flags
+        """
+
+        control_path = self._control_path()
+
+        if target == self.options["jump_host"]:
+            return [
+                "-o", "ControlMaster=auto",
+                "-o", "ControlPath={0}".format(control_path),
+                "-o", "ControlPersist=60",
+            ]
+
+        proxy = "ssh -o BatchMode=yes -o ControlPath={path} -p {port} " \
+                "-W %h:%p {user}@{host}".format(
+                    path=control_path,
+                    port=self.options["jump_port"],
+                    user=self.options["jump_user"] or self.options["username"],
+                    host=self.options["jump_host"],
+                )
+
+        return ["-o", "'ProxyCommand={0}'".format(proxy)]
+
+    def _stop_control_master(self):
+        """Stops the jump_host master connection and removes its socket."""
+
+        if self.jump_control is None:
+            return
+
+        control_path = os.path.join(self.jump_control, "jump")
+        if os.path.exists(control_path):
+            pexpect.run(
+                "ssh -o ControlPath={0} -O exit {1}".format(
+                    control_path,
+                    self.options["jump_host"],
+                ),
+                timeout=self.options["timeout"],
+            )
+
+        shutil.rmtree(self.jump_control, ignore_errors=True)
+        self.jump_control = None
+
     def _build_ssh_command(self, target, username, port):
         """Builds the ssh connection command.
 
@@ -570,13 +1719,16 @@ class Bladerunner(object):
         if isinstance(debug, int) and debug > 0:
             flags.append("-{0}".format("v" * debug))
 
+        if self._multiplexed():
+            flags.extend(self._multiplex_flags(target))
+
         return "ssh {flags} {user}@{host}".format(
             flags=" ".join(flags),
             user=username,
             host=target,
         )
 
-    def connect(self, target, username, password, port):
+    def connect(self, target, username, password, port, jumpbox=None):
         """Connects to a server, maybe from another server.
 
         Args::
@@ -585,34 +1737,45 @@ class Bladerunner(object):
             username: the user we are connecting as
             password: list or string plain text password(s) to try
             port: ssh port number, as integer
+            jumpbox: pexpect object to connect from, defaults to self.sshc.
+                     use False to always connect from the local host
 
         Returns:
             a pexpect object that can be passed back here or to send_commands()
         """
 
-        if not can_resolve(target):
+        with self._phase("resolve"):
+            resolvable = self.resolver.resolve(target)
+        if not resolvable:
             return (None, -3)
 
+        if target in self.unreachable:
+            self.unreachable.discard(target)
+            return (None, -7)
+
         ssh_cmd = self._build_ssh_command(target, username, port)
 
-        if not self.sshc:
-            try:
-                sshr = pexpect.spawn(ssh_cmd, timeout=self.options["timeout"])
+        # only a default connection is kept as the shared jump_host session
+        adopt = jumpbox is None and self._jumps_from_shell() and not self.sshc
 
-                if self.options["debug"]:
-                    sshr.logfile_read = FakeStdOut
+        if jumpbox is None and not self._multiplexed():
+            jumpbox = self.sshc
 
-                login_response = sshr.expect(
-                    self.options["passwd_prompts"] +
-                    self.options["shell_prompts"] +
-                    self.options["extra_prompts"],
-                    self.options["timeout"],
-                )
+        if not jumpbox:
+            try:
+                with self._phase("spawn"):
+                    sshr = self._spawn(target, ssh_cmd)
+
+                with self._phase("login"):
+                    login_response = sshr.expect_list(
+                        self._prompts(LOGIN_PROMPTS, sshr),
+                        self.options["timeout"],
+                    )
 
-                if self.options["jump_host"]:
-                    self.sshc = sshr
+                    if adopt:
+                        self.sshc = sshr
 
-                return self._multipass(sshr, password, login_response)
+                    return self._multipass(sshr, password, login_response)
             except (pexpect.TIMEOUT, pexpect.EOF):
                 if sshr.isalive():
                     # logged in with no passwd and an unknown prompt
@@ -625,21 +1788,22 @@ class Bladerunner(object):
                 else:
                     return (None, -7)
         else:
-            self.sshc.sendline(ssh_cmd)
+            with self._phase("spawn"):
+                jumpbox.sendline(ssh_cmd)
+            self._session_hosts[jumpbox] = target
 
             try:
-                login_response = self.sshc.expect(
-                    self.options["passwd_prompts"] +
-                    self.options["shell_prompts"] +
-                    self.options["extra_prompts"],
-                    self.options["timeout"],
-                )
+                with self._phase("login"):
+                    login_response = jumpbox.expect_list(
+                        self._prompts(LOGIN_PROMPTS, jumpbox),
+                        self.options["timeout"],
+                    )
             except (pexpect.TIMEOUT, pexpect.EOF):
                 # XXX: possible to use a jumpbox and login without a passwd
                 #      and the shell prompt is unknown... can't use isalive tho
                 #      so, this results in an error for now. workaround is to
                 #      provide the expected after-jumpbox expected shell prompt
-                self.send_interrupt(self.sshc)
+                self.send_interrupt(jumpbox)
                 return (None, -1)
 
             if PY3:
@@ -647,19 +1811,35 @@ class Bladerunner(object):
             else:
                 look_for = "Permission denied"
 
-            if self.sshc.before.find(look_for) != -1:
-                self.send_interrupt(self.sshc)
+            if jumpbox.before.find(look_for) != -1:
+                self.send_interrupt(jumpbox)
                 return (None, -4)
 
             for net_err in ("Network is unreachable", "Connection refused"):
                 if PY3:
                     net_err = bytes(net_err, DEFAULT_ENCODING)
 
-                if self.sshc.before.find(net_err) != -1:
-                    self.send_interrupt(self.sshc)
+                if jumpbox.before.find(net_err) != -1:
+                    self.send_interrupt(jumpbox)
                     return (None, -7)
 
-            return self._multipass(self.sshc, password, login_response)
+            with self._phase("login"):
+                return self._multipass(jumpbox, password, login_response)
+
+    def _spawn(self, target, ssh_cmd):
+        """Spawns ssh_cmd from the local host to connect to target.
+
+        Returns:
+            the pexpect object
+        """
+
+        sshr = pexpect.spawn(ssh_cmd, timeout=self.options["timeout"])
+
+        if self.options["debug"]:
+            sshr.logfile_read = FakeStdOut
+
+        self._session_hosts[sshr] = target
+        return sshr
 
     def _multipass(self, sshc, passwords, login_response):
         """Buffer to use multiple passwords if using a list of passwords.
@@ -674,11 +1854,8 @@ class Bladerunner(object):
             a tuple of the pexpect object and error code, tries to be positive
         """
 
-        if not isinstance(passwords, (list, tuple)):
-            passwords = [passwords]
-
         error_code = -1
-        for password in passwords:
+        for password in _as_list(passwords):
             sshc_returned, error_code = self.login(
                 sshc,
                 password,
@@ -702,30 +1879,24 @@ class Bladerunner(object):
             a tuple of the connection object and error code
         """
 
-        passlen = len(self.options["passwd_prompts"])
-
         if login_response == 0:
             # new identity for known_hosts file
             sshc.sendline("yes")
             try:
-                login_response = sshc.expect(
-                    self.options["passwd_prompts"] +
-                    self.options["shell_prompts"] +
-                    self.options["extra_prompts"],
+                login_response = sshc.expect_list(
+                    self._prompts(LOGIN_PROMPTS, sshc),
                     self.options["timeout"],
                 )
             except (pexpect.TIMEOUT, pexpect.EOF):
                 self.send_interrupt(sshc)
                 return (None, -1)
 
-        if login_response <= passlen and password:
+        if self._password_prompted(login_response) and password:
             # password prompt as expected
             sshc.sendline(password)
             try:
-                send_response = sshc.expect(
-                    self.options["passwd_prompts"] +
-                    self.options["shell_prompts"] +
-                    self.options["extra_prompts"],
+                send_response = sshc.expect_list(
+                    self._prompts(LOGIN_PROMPTS, sshc),
                     self.options["timeout"],
                 )
             except (pexpect.TIMEOUT, pexpect.EOF):
@@ -737,15 +1908,12 @@ class Bladerunner(object):
                     _from_login=True,
                 )
 
-            if send_response <= len(self.options["passwd_prompts"]):
-                # wrong password, or received another password prompt
+            error_code = self._password_code(send_response)
+            if error_code < 0:
                 self.send_interrupt(sshc)
-                return (sshc, -5)
-            else:
-                # logged in properly with a password
-                return (sshc, 1)
+            return (sshc, error_code)
 
-        elif login_response <= passlen and not password:
+        elif self._password_prompted(login_response):
             # password prompt not expected
             self.send_interrupt(sshc)
             return (None, -2)
@@ -755,6 +1923,26 @@ class Bladerunner(object):
             # logged into the box, it's time to issue some commands and GTFO
             return (sshc, 1)
 
+    def _password_prompted(self, login_response):
+        """Checks if the LOGIN_PROMPTS index matched is a password prompt.
+
+        Index 0 is the prompt for a new host key, handled before this.
+        """
+
+        return login_response <= len(self.options["passwd_prompts"])
+
+    def _password_code(self, send_response):
+        """Maps the LOGIN_PROMPTS index matched after sending a password.
+
+        Returns:
+            integer error code, -5 for another password prompt, as the
+            password was wrong, or 1 when logged in
+        """
+
+        if self._password_prompted(send_response):
+            return -5
+        return 1
+
     def send_interrupt(self, sshc):
         """Sends ^c and pushes pexpect forward on the object.
 
@@ -765,40 +1953,36 @@ class Bladerunner(object):
             None: the sshc maintains its state and should be ready for use
         """
 
-        try:
-            sshc.sendline(UNICODE_CHR(0x003))
-            sshc.expect(
-                self.options["shell_prompts"] +
-                self.options["extra_prompts"],
-                3,
-            )
-        except (pexpect.TIMEOUT, pexpect.EOF):
-            pass
+        sshc.sendline(UNICODE_CHR(0x003))
         self._push_expect_forward(sshc)
 
     def _push_expect_forward(self, sshc):
-        """Moves the expect object forwards.
+        """Moves the expect object forwards to a quiet shell prompt.
+
+        Whatever is already buffered is drained first without blocking, then
+        the prompt is waited for with escalating timeouts (RESYNC_WAITS).
+        Once a prompt matches, any further prompts are consumed until the
+        shell has been quiet for RESYNC_QUIET seconds.
 
         Args:
             sshc: the pexpect object you'd like to move up
+
+        Returns:
+            boolean of whether the shell prompt was found
         """
 
-        try:
-            sshc.expect(
-                self.options["shell_prompts"] +
-                self.options["extra_prompts"],
-                2,
-            )
-        except (pexpect.TIMEOUT, pexpect.EOF):
-            pass
-        try:
-            sshc.expect(
-                self.options["shell_prompts"] +
-                self.options["extra_prompts"],
-                2,
-            )
-        except (pexpect.TIMEOUT, pexpect.EOF):
-            pass
+        prompts = self._prompts(SHELL_PROMPTS, sshc)
+        resync = _Resync()
+        while resync.wait is not None:
+            try:
+                sshc.expect_list(prompts, resync.wait)
+            except pexpect.TIMEOUT:
+                resync.timed_out()
+            except pexpect.EOF:
+                return False
+            else:
+                resync.matched()
+        return resync.found
 
     def close(self, sshc, terminate):
         """Closes a connection object.
@@ -817,10 +2001,11 @@ class Bladerunner(object):
         if terminate:
             sshc.terminate()
         else:
+            # back on the jump_host, its prompts are expected again
+            self._session_hosts[sshc] = self.options["jump_host"]
             try:
-                sshc.expect(
-                    self.options["shell_prompts"] +
-                    self.options["extra_prompts"],
+                sshc.expect_list(
+                    self._prompts(SHELL_PROMPTS, sshc),
                     self.options["cmd_timeout"],
                 )
             except (pexpect.TIMEOUT, pexpect.EOF):
@@ -867,9 +2052,16 @@ class Bladerunner(object):
     def setup_interactive(self, hosts, connect=True):
         """Initializes a list of hosts to be used interactively.
 
+        All sessions are opened concurrently, each is added to the
+        interactive_hosts pool as soon as it has logged in.
+
         Args:
             hosts: list of hostnames to connect to for interative use later
             connect: boolean used to make the initial connection now or later
+
+        Returns:
+            dictionary of {host: {"connected": bool, "seconds": float}} for
+            each new host, seconds being the time taken to set up the session
         """
 
         hosts = self._prep_interactive_hosts(hosts)
@@ -879,16 +2071,49 @@ class Bladerunner(object):
             if host not in self.interactive_hosts:
                 prepare_hosts.append(host)
 
+        report = {}
         with ThreadPoolExecutor(max_workers=self.options["threads"]) as execor:
+            futures = {}
             for host in prepare_hosts:
-                con = execor.submit(self.interactive, host, connect).result()
-                if con:
-                    self.interactive_hosts[con.server] = con
+                future = execor.submit(self._setup_interactive_host, host,
+                                       connect)
+                futures[future] = host
+
+            for future in as_completed(futures):
+                connected, seconds = future.result()
+                report[futures[future]] = {
+                    "connected": connected,
+                    "seconds": seconds,
+                }
+
+        return report
+
+    def _setup_interactive_host(self, host, connect):
+        """Builds and registers the interactive session for a single host.
+
+        Args:
+            host: string hostname or IP to set up
+            connect: boolean used to make the initial connection now or later
+
+        Returns:
+            tuple of (boolean session registered, float seconds taken)
+        """
+
+        start = TIMER()
+        con = self.interactive(host, connect)
+        seconds = TIMER() - start
+
+        if con:
+            with self._interactive_lock:
+                self.interactive_hosts[con.server] = con
+
+        return (bool(con), seconds)
 
     def _end_interactive_session(self, host):
         """Ends the interactive session on a single host."""
 
-        session = self.interactive_hosts.pop(host, None)
+        with self._interactive_lock:
+            session = self.interactive_hosts.pop(host, None)
         if session is not None:
             session.end()
 
@@ -906,9 +2131,15 @@ class Bladerunner(object):
             for host in hosts:
                 execor.submit(self._end_interactive_session, host)
 
-    def run_interactive(self, command, hosts=None, print_results=True):
+        self.prompt_store.save()
+
+    def run_interactive(self, command, hosts=None, print_results=True,
+                        callback=None):
         """Runs a single command interactively on a list of hostnames.
 
+        The command is dispatched to every session before any result is
+        collected, so the call takes about as long as the slowest host.
+
         Note:
             the hosts kwarg can be omitted after the first run or if you call
             setup_interactive before calling this method
@@ -918,6 +2149,8 @@ class Bladerunner(object):
             command: string command to send
             hosts: string or list of hostnames to add to the interactive list
             print_results: boolean to print the results or return a dict
+            callback: optional function called with (host, result) as soon as
+                      each host returns, in order of completion
 
         Returns:
             None, or a dictionary of {host: result}
@@ -926,26 +2159,32 @@ class Bladerunner(object):
         if hosts is not None:
             self.setup_interactive(hosts)
 
-        hosts = self.interactive_hosts.keys()
+        hosts = list(self.interactive_hosts.keys())
         results = {}
         max_threads = self.options["threads"]
 
         with ThreadPoolExecutor(max_workers=max_threads) as executor:
+            futures = {}
             for host in hosts:
                 future = executor.submit(
                     self.interactive_hosts[host].run,
                     command,
                 )
-                results[host] = future.result()
+                futures[future] = host
 
-        if print_results:
-            for host, result in results.items():
-                print("{0}:{1}{2}".format(
-                    host,
-                    "\n" if len(result) > 79 else " ",
-                    result,
-                ))
-        else:
+            for future in as_completed(futures):
+                host = futures[future]
+                results[host] = future.result()
+                if callback:
+                    callback(host, results[host])
+                if print_results:
+                    print("{0}:{1}{2}".format(
+                        host,
+                        "\n" if len(results[host]) > 79 else " ",
+                        results[host],
+                    ))
+
+        if not print_results:
             return results
 
     def run_interactive_function(self, function, hosts=None):
@@ -1009,6 +2248,83 @@ class Bladerunner(object):
         return results or None
 
 
+def _known_length(servers, default=None):
+    """Returns the length of servers, or default for lazy sources.
+
+    Sequences too large for len(), like an expanded IPv6 network, are
+    treated as lazy and streamed.
+    """
+
+    try:
+        return len(servers)
+    except (TypeError, OverflowError):
+        return default
+
+
+def _split_first(servers):
+    """Splits the first server from the rest, without consuming a sequence.
+
+    Returns:
+        tuple of the first server (or None) and the remaining servers
+    """
+
+    if hasattr(servers, "__getitem__"):
+        return (servers[0] if servers else None), servers[1:]
+
+    servers = iter(servers)
+    return next(servers, None), servers
+
+
+def _as_list(passwords):
+    """Returns passwords as a list, if it's a single password."""
+
+    if isinstance(passwords, (list, tuple)):
+        return passwords
+    return [passwords]
+
+
+class _Resync(object):
+    """Decides the waits for a shell prompt when resynchronizing.
+
+    The prompt is waited for with each of RESYNC_WAITS in turn. Once it has
+    matched, up to RESYNC_MAX_PROMPTS more prompts are consumed until the
+    shell is quiet for RESYNC_QUIET seconds. Each wait is then reported back
+    with timed_out or matched.
+    """
+
+    def __init__(self):
+        """Starts at the first of RESYNC_WAITS."""
+
+        self.found = False
+        self.attempt = 0
+        self.wait = RESYNC_WAITS[0]
+
+    def timed_out(self):
+        """Moves to the next wait after one timed out."""
+
+        self.attempt += 1
+        if self.found:
+            self.wait = None  # quiet
+        elif self.attempt < len(RESYNC_WAITS):
+            self.wait = RESYNC_WAITS[self.attempt]
+        else:
+            self.wait = None  # gave up
+
+    def matched(self):
+        """Moves to the next wait after one matched the prompt."""
+
+        if not self.found:
+            self.found = True
+            self.attempt = 0
+        else:
+            self.attempt += 1
+
+        if self.attempt < RESYNC_MAX_PROMPTS:
+            self.wait = RESYNC_QUIET
+        else:
+            self.wait = None
+
+
 def _set_shells(options):
     """Set password, shell and extra prompts for the username.
 
@@ -0,0 +1,157 @@
+"""Reuse of logged in Bladerunner sessions between runs.
+
+This file is part of Bladerunner.
+
+Copyright (c) 2015, Activision Publishing, Inc.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* Neither the name of Activision Publishing, Inc. nor the names of its
+  contributors may be used to endorse or promote products derived from this
+  software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+
+import threading
+from collections import OrderedDict
+
+from bladerunner.timing import TIMER
+
+
+class SessionCache(object):
+    """A least recently used pool of idle, logged in sessions per hostname.
+
+    Sessions are checked out while in use, so one session is never shared by
+    two threads. Anything closed or found dead is passed to closer.
+
+    Args::
+
+        max_size: integer maximum number of idle sessions to keep
+        idle_timeout: seconds an idle session is kept, or None to keep forever
+        closer: function called with a session to close it
+        checker: function called with a session, returning if it's usable
+    """
+
+    def __init__(self, max_size, idle_timeout=None, closer=None, checker=None):
+        """Initializes an empty cache."""
+
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.closer = closer
+        self.checker = checker
+
+        self._sessions = OrderedDict()  # host: (session, last used)
+        self._lock = threading.Lock()
+
+        super(SessionCache, self).__init__()
+
+    def __len__(self):
+        """Returns the number of idle sessions held."""
+
+        return len(self._sessions)
+
+    def __contains__(self, host):
+        """Checks if an idle session is held for the host."""
+
+        return host in self._sessions
+
+    def checkout(self, host):
+        """Removes and returns the idle session for host.
+
+        Args:
+            host: string hostname
+
+        Returns:
+            the session, or None if there isn't a usable one cached
+        """
+
+        with self._lock:
+            expired = self._pop_expired()
+            session, _ = self._sessions.pop(host, (None, None))
+
+        self._close_all(expired)
+
+        if session is not None and self.checker and not self.checker(session):
+            self._close_all([session])
+            session = None
+
+        return session
+
+    def checkin(self, host, session):
+        """Returns a session to the cache once it is no longer in use.
+
+        The least recently used sessions are closed if this exceeds max_size.
+
+        Args::
+
+            host: string hostname the session is logged into
+            session: the session object
+        """
+
+        with self._lock:
+            expired = self._pop_expired()
+            replaced, _ = self._sessions.pop(host, (None, None))
+            if replaced is not None:
+                expired.append(replaced)
+
+            self._sessions[host] = (session, TIMER())
+            while len(self._sessions) > max(self.max_size, 0):
+                expired.append(self._sessions.popitem(last=False)[1][0])
+
+        self._close_all(expired)
+
+    def clear(self):
+        """Closes and removes all of the cached sessions."""
+
+        with self._lock:
+            sessions = [session for session, _ in self._sessions.values()]
+            self._sessions.clear()
+
+        self._close_all(sessions)
+
+    def _pop_expired(self):
+        """Removes sessions idle for longer than idle_timeout. Hold the lock.
+
+        Returns:
+            list of the sessions removed
+        """
+
+        if self.idle_timeout is None:
+            return []
+
+        cutoff = TIMER() - self.idle_timeout
+        expired = []
+        for host, (session, last_used) in list(self._sessions.items()):
+            if last_used >= cutoff:
+                break  # in order of use, the rest are newer
+            expired.append(session)
+            del self._sessions[host]
+
+        return expired
+
+    def _close_all(self, sessions):
+        """Passes each session to the closer."""
+
+        if self.closer:
+            for session in sessions:
+                self.closer(session)
@@ -0,0 +1,263 @@
+"""Bounded capture of command output, with an optional spill to disk.
+
+This file is part of Bladerunner.
+
+Copyright (c) 2015, Activision Publishing, Inc.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* Neither the name of Activision Publishing, Inc. nor the names of its
+  contributors may be used to endorse or promote products derived from this
+  software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+
+
+import os
+import re
+import tempfile
+import warnings
+
+import pexpect
+
+
+# the most bytes of the end of an output searched for the prompt
+SEARCH_WINDOW = 8192
+
+# the fewest bytes searched, prompts can match more than their pattern's length
+SEARCH_MIN = 256
+
+
+class Capture(object):
+    """Tees what a pexpect object reads to keep each output's memory bounded.
+
+    Assigned as the logfile_read of the pexpect object. While capturing, the
+    first half of limit bytes of the output are kept here and pexpect's own
+    buffer is trimmed down to the last half. When started with a spill
+    prefix, the full output of a command which goes over the limit is
+    written to a temporary file.
+
+    Trimming pexpect's buffer relies on its private _before and buffer_type
+    attributes, added in pexpect 4.8, which setup.py requires. Should they
+    go missing a RuntimeWarning is issued, the results are still cut to the
+    head and tail but memory isn't bounded while a command is printing.
+
+    Args::
+
+        sshc: the pexpect object to capture the reads of
+        limit: integer bytes of each output to keep in memory
+        chain: the previous logfile_read, which is still written to
+    """
+
+    def __init__(self, sshc, limit, chain=None):
+        """Attaches to sshc, nothing is kept until start is called."""
+
+        self.sshc = sshc
+        self.limit = limit
+        self.head_size = limit // 2
+        self.tail_size = limit - self.head_size
+        self.chain = chain
+        self.spills = []
+        self.capturing = False
+        self.trims = trimmable(sshc)
+        self._reset()
+
+    def _reset(self):
+        """Clears what was captured of the last output."""
+
+        self.command = None
+        self.spill = None
+        self.total = 0
+        self.pending = []  # everything while under the limit
+        self.head = b""
+        self.spilled = None
+        self._file = None
+        self._window = None
+        self.window = 0
+
+    def start(self, command, spill=None, patterns=()):
+        """Starts capturing the output of command.
+
+        The search window is never smaller than the longest of patterns, so
+        a small limit can't leave the prompt or end marker unmatched.
+
+        Args::
+
+            command: the command whose output is being read
+            spill: string prefix of the temporary file to spill the full
+                   output to, or None to only keep the head and tail
+            patterns: the compiled patterns expected after the output
+        """
+
+        self._reset()
+        self.command = command
+        self.spill = spill
+        self.capturing = True
+        self._window = self.sshc.searchwindowsize
+        self.window = max(
+            [min(SEARCH_WINDOW, self.tail_size), SEARCH_MIN] +
+            [len(pattern.pattern) for pattern in patterns]
+        )
+        self.sshc.searchwindowsize = self.window
+
+    @property
+    def truncated(self):
+        """Returns True if the current output has gone over the limit."""
+
+        return self.total > self.limit
+
+    def write(self, data):
+        """Receives everything pexpect reads, as logfile_read."""
+
+        if self.chain is not None:
+            self.chain.write(data)
+
+        if not self.capturing:
+            return
+
+        was_truncated = self.truncated
+        self.total += len(data)
+
+        if not was_truncated:
+            self.pending.append(data)
+            if self.truncated:
+                everything = b"".join(self.pending)
+                self.head = everything[:self.head_size]
+                self.pending = []
+                self._open_spill(everything)
+        elif self._file is not None:
+            self._file.write(data)
+
+        if self.truncated:
+            self._trim()
+
+    def flush(self):
+        """Flushes the chained logfile_read."""
+
+        if self.chain is not None:
+            self.chain.flush()
+
+    def _open_spill(self, everything):
+        """Opens the spill file and writes everything so far, with spill."""
+
+        if self.spill is None:
+            return
+
+        handle, self.spilled = tempfile.mkstemp(prefix=self.spill,
+                                                suffix=".out")
+        self._file = os.fdopen(handle, "wb")
+        self._file.write(everything)
+
+    def _trim(self):
+        """Trims pexpect's buffer of the output to around the tail size.
+
+        pexpect keeps everything read since its last match in a private
+        buffer, it's only trimmed when twice the tail size, so the copy is
+        amortized over the reads. At least the search window is kept.
+        """
+
+        if not self.trims:
+            return
+
+        keep = max(self.tail_size, self.window)
+        before = self.sshc._before
+        if before.tell() > keep * 2:
+            tail = before.getvalue()[-keep:]
+            self.sshc._before = self.sshc.buffer_type()
+            self.sshc._before.write(tail)
+
+    def finish(self, before):
+        """Stops capturing and builds the output to format.
+
+        Args:
+            before: the pexpect object's before after the output
+
+        Returns:
+            before, or when over the limit, the head and the tail of before,
+            around a line saying how much was left out and where it's spilled
+        """
+
+        self.capturing = False
+        self.sshc.searchwindowsize = self._window
+
+        if self._file is not None:
+            self._file.close()
+            self.spills.append((self.command, self.spilled))
+
+        if not self.truncated:
+            self._reset()
+            return before
+
+        # cut on line endings, which are never part of a multibyte character
+        head = self.head[:self.head.rfind(b"\n") + 1] or self.head
+        tail = before[-self.tail_size:]
+        tail = tail[tail.find(b"\n") + 1:] or tail
+        omitted = max(0, self.total - len(head) - len(tail))
+        if self.spilled:
+            note = "[{0} bytes not kept, full output in {1}]".format(
+                omitted,
+                self.spilled,
+            )
+        else:
+            note = "[{0} bytes not kept]".format(omitted)
+
+        output = b"".join([
+            head,
+            b"\n",
+            note.encode("utf-8"),
+            b"\n",
+            tail,
+        ])
+        self._reset()
+        return output
+
+    def take_spills(self):
+        """Returns and forgets the (command, path) of each spilled output."""
+
+        spills, self.spills = self.spills, []
+        return spills
+
+
+def spill_prefix(host):
+    """Returns the temporary file prefix for spilled outputs from host."""
+
+    return "bladerunner-{0}-".format(re.sub(r"[^\w.-]", "_", host or ""))
+
+
+def trimmable(sshc):
+    """Checks pexpect's buffer of sshc can be trimmed, warns if it can't.
+
+    Returns:
+        boolean True if sshc has the private attributes Capture trims
+    """
+
+    if hasattr(sshc, "_before") and hasattr(sshc, "buffer_type"):
+        return True
+
+    warnings.warn(
+        "pexpect {0} has no _before buffer to trim, capture_limit only "
+        "bounds the results, upgrade to pexpect 4.8".format(
+            getattr(pexpect, "__version__", "unknown")),
+        RuntimeWarning,
+    )
+    return False
@@ -37,14 +37,19 @@ import os
 import sys
 import getpass
 import argparse
+import itertools
 
 from bladerunner import Bladerunner, __version__, __release_date__
+from bladerunner.hosts import iter_host_file
 from bladerunner.formatting import (
     csv_results,
+    output_sink,
     pretty_results,
     stacked_results,
+    write,
     DEFAULT_ENCODINGS,
 )
+from bladerunner.timing import format_summary, summarize
 
 
 def cmdline_entry():
@@ -78,6 +83,9 @@ def cmdline_entry():
 
     if settings.printCSV or settings.csv_char != ",":
         options['style'] = -1
+        if not options["output_file"]:
+            # results are streamed to stdout as they arrive, skip the bar
+            options["progressbar"] = False
 
     if settings.settingsDebug:
         raise SystemExit(str(options))
@@ -90,22 +98,59 @@ def cmdline_entry():
 def cmdline_exit(results, options):
     """A buffer for selecting the correct output function and exiting.
 
+    The results are written through one buffered OutputSink, which is
+    flushed and closed before exiting.
+
     Args::
 
         results: the results dictionary from Bladerunner.run
         options: the options dictionary, uses 'style' and 'stacked' keys
     """
 
-    if options.get("stacked"):
-        stacked_results(results, options)
-    elif options["style"] < 0 or options["style"] > 3:
-        csv_results(results, options)
-    else:
-        pretty_results(results, options)
+    timings = []
+    if options.get("timings"):
+        results = _collect_timings(results, timings)
+        if not streams_results(options):
+            # consolidating goes over the results more than once
+            results = list(results)
+
+    with output_sink(options):
+        if options.get("stacked"):
+            stacked_results(results, options)
+        elif options["style"] < 0 or options["style"] > 3:
+            csv_results(results, options)
+        else:
+            pretty_results(results, options)
+
+        if timings:
+            write(format_summary(summarize(timings)), options, end="\n")
 
     raise SystemExit
 
 
+def _collect_timings(results, timings):
+    """Yields the results, appending each one's timings to timings."""
+
+    for result in results:
+        if "timings" in result:
+            timings.append(result["timings"])
+        yield result
+
+
+def streams_results(options):
+    """Checks if the output style can be written as each result arrives.
+
+    Args:
+        options: the options dictionary, uses 'style' and 'stacked' keys
+
+    Returns:
+        boolean True for CSV output, which doesn't consolidate the results
+    """
+
+    return not options.get("stacked") and \
+        (options["style"] < 0 or options["style"] > 3)
+
+
 def convert_to_options(settings):
     """Converts argparse's namespace into a dictionary. Removes temp keys."""
 
@@ -115,9 +160,13 @@ def convert_to_options(settings):
         "jump_host": settings.jump_host,
         "jump_pass": settings.jump_pass,
         "jump_port": settings.jump_port,
+        "jump_sessions": settings.jump_sessions,
+        "jump_transport": settings.jump_transport,
         "debug": settings.debug,
         "delay": settings.delay,
         "output_file": settings.output_file,
+        "prompt_file": settings.prompt_file,
+        "probe_timeout": settings.probe_timeout,
         "password": settings.password,
         "second_password": settings.second_password,
         "password_safety": settings.password_safety,
@@ -125,7 +174,11 @@ def convert_to_options(settings):
         "style": settings.style,
         "csv_char": settings.csv_char,
         "threads": settings.threads,
+        "adaptive_threads": settings.adaptive_threads,
+        "min_threads": settings.min_threads,
         "stacked": settings.stacked,
+        "framed": settings.framed,
+        "pipelined": settings.pipelined,
         "width": settings.printFixed or settings.width,
         "extra_prompts": settings.extra_prompts or [],
         "progressbar": True,
@@ -133,7 +186,10 @@ def convert_to_options(settings):
         "unix_line_endings": settings.unix_line_endings,
         "windows_line_endings": settings.windows_line_endings,
         "timeout": settings.timeout,
+        "timings": settings.timings,
         "cmd_timeout": settings.cmd_timeout,
+        "capture_limit": settings.capture_limit,
+        "capture_spill": settings.capture_spill,
     }
 
 
@@ -146,8 +202,12 @@ Usage:
 Note:
   <COMMAND> becomes optional if a command --file is used
   <HOST> becomes optional if a --host-file is supplied
+  <HOST> can be a network, prefix any host or network with ! to exclude it
 Options:
+     --adaptive-threads\t\t\tAdjust the threads in use to how hosts respond
   -a --ascii\t\t\t\tUse ASCII output with normal results (same as --style=1)
+     --capture-limit=<bytes>\t\tKeep the head and tail of bigger outputs
+     --capture-spill\t\t\tSave outputs over the limit to temp files
   -c --command-timeout=<seconds>\tTimeout between commands (default: 20s)
   -T --connection-timeout=<seconds>\tSpecify the SSH timeout (default: 20s)
   -C --csv\t\t\t\tOutput in CSV format, not grouped by similarity
@@ -157,23 +217,31 @@ Options:
   -f --file=<file>\t\t\tLoad commands from a file
   -F --flat\t\t\t\tOutput results with a flattened/stacked output style
   -x --fixed\t\t\t\tUse a fixed 80 character width for output
+     --framed\t\t\t\tFind output and exit codes by markers, not prompts
   -h --help\t\t\t\tThis help screen
-  -H --host-file=<file>\t\t\tLoad hosts from a file
+  -H --host-file=<file>\t\t\tLoad hosts from a file, - for stdin
   -j --jumpbox=<host>\t\t\tUse a jumpbox to intermediary the targets
   -P --jumpbox-password=<password>\tSeparate jumpbox password (-P to prompt)
   -J --jumpbox-port=<port>\t\tUse a non-standard SSH port for the jumpbox
   -U --jumpbox-username=<username>\tJumpbox user name (default: {username})
+     --jumpbox-sessions=<int>\t\tParallel sessions on the jumpbox (default: 1)
+     --jumpbox-transport=<mode>\t\tshell or proxyjump (default: shell)
   -m --match=<pattern> [pattern] ...\tMatch additional shell prompts
+     --min-threads=<int>\t\tFewest threads when adaptive (default: 4)
   -n --no-password\t\t\tNo password prompt
   -N --no-password-check\t\tDon't check if the first login succeeded
   -o --output-file=<file>\t\tAppend the output to a file rather than stdout
   -p --password=<password>\t\tSupply the host password on the command line
+     --pipelined\t\t\tSend all commands at once, implies --framed
   -D --port\t\t\t\tUse a non non-standard SSH port for the target hosts
+     --probe-timeout=<seconds>\t\tSkip hosts not accepting connections in time
+     --prompt-file=<file>\t\tRemember the prompts learned per host in a file
   -s --second-password=<password>\tSupply a second password (-s to prompt)
   -S --style=<int>\t\t\tOutput style (0=default, 1=ASCII, 2=double, 3=rounded)
   -k --ssh-key=<file>\t\t\tUse a non-default ssh key
   -t --threads=<int>\t\t\tMaximum concurrent threads (default: 100)
   -d --time-delay=<seconds>\t\tAdd a time delay between hosts (default: 0s)
+     --timings\t\t\t\tSummarize the time spent in each phase per host
   -X --unix-line-endings\t\tForce the use of \\n for newlines
   -u --username=<username>\t\tUse a different user name (default: {username})
   -v --version\t\t\t\tDisplays version information
@@ -219,23 +287,29 @@ def get_commands(settings):
 
 
 def get_servers(settings):
-    """Checks to see if a file has been passed as a list of servers."""
+    """Checks to see if a file has been passed as a list of servers.
 
-    servers = []
+    The hosts in the file are read lazily as the run reaches them, a file
+    of "-" reads the hosts from stdin.
+    """
 
     if settings.host_file:
         try:
-            with open(settings.host_file[0], "r") as serverfile:
-                for line in serverfile.readlines():
-                    for server in line.split(" "):
-                        if server.strip():
-                            servers.append(server.strip())
-            settings.servers = servers
+            if settings.host_file[0] == "-":
+                serverfile = sys.stdin
+            else:
+                serverfile = open(settings.host_file[0], "r")
         except IOError:
             raise SystemExit("Could not open file: {0}".format(
                 settings.host_file[0]))
 
-    if len(settings.servers) == 0 or not settings.servers[0]:
+        servers = iter_host_file(serverfile)
+        first = next(servers, None)
+        if first is None:
+            raise SystemExit(print_help())
+
+        settings.servers = itertools.chain([first], servers)
+    elif len(settings.servers) == 0 or not settings.servers[0]:
         raise SystemExit(print_help())
 
 
@@ -280,6 +354,9 @@ def argparse_unlisted(settings):
         "jump_port",
         "debug",
         "output_file",
+        "prompt_file",
+        "probe_timeout",
+        "capture_limit",
         "width",
     ]
 
@@ -291,6 +368,8 @@ def argparse_unlisted(settings):
         ("cmd_timeout", 20),
         ("timeout", 20),
         ("threads", 100),
+        ("min_threads", 4),
+        ("jump_sessions", 1),
     ]
 
     for setting, default in unlist_from_defaults:
@@ -427,6 +506,20 @@ def setup_argparse(args):
         default=False,
     )
 
+    parser.add_argument(
+        "--framed",
+        dest="framed",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--pipelined",
+        dest="pipelined",
+        action="store_true",
+        default=False,
+    )
+
     parser.add_argument(
         "--fixed",
         "-x",
@@ -487,6 +580,39 @@ def setup_argparse(args):
         default=22,
     )
 
+    parser.add_argument(
+        "--jumpbox-sessions",
+        dest="jump_sessions",
+        metavar="INT",
+        nargs=1,
+        type=int,
+        default=1,
+    )
+
+    parser.add_argument(
+        "--jumpbox-transport",
+        dest="jump_transport",
+        metavar="MODE",
+        choices=("shell", "proxyjump"),
+        default="shell",
+    )
+
+    parser.add_argument(
+        "--capture-limit",
+        dest="capture_limit",
+        metavar="BYTES",
+        nargs=1,
+        type=int,
+        default=0,
+    )
+
+    parser.add_argument(
+        "--capture-spill",
+        dest="capture_spill",
+        action="store_true",
+        default=False,
+    )
+
     parser.add_argument(
         "--match",
         "-m",
@@ -512,6 +638,23 @@ def setup_argparse(args):
         default=False,
     )
 
+    parser.add_argument(
+        "--probe-timeout",
+        dest="probe_timeout",
+        metavar="SECONDS",
+        nargs=1,
+        type=float,
+        default=0,
+    )
+
+    parser.add_argument(
+        "--prompt-file",
+        dest="prompt_file",
+        metavar="FILE",
+        nargs=1,
+        default=None,
+    )
+
     parser.add_argument(
         "--password",
         "-p",
@@ -576,6 +719,13 @@ def setup_argparse(args):
         default=0,
     )
 
+    parser.add_argument(
+        "--timings",
+        dest="timings",
+        action="store_true",
+        default=False,
+    )
+
     parser.add_argument(
         "--time-delay",
         "-d",
@@ -586,6 +736,22 @@ def setup_argparse(args):
         default=0,
     )
 
+    parser.add_argument(
+        "--adaptive-threads",
+        dest="adaptive_threads",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--min-threads",
+        dest="min_threads",
+        metavar="INT",
+        nargs=1,
+        type=int,
+        default=4,
+    )
+
     parser.add_argument(
         "--threads",
         "-t",
@@ -666,7 +832,11 @@ def main():
 
     try:
         commands, servers, options = cmdline_entry()
-        results = Bladerunner(options).run(commands, servers)
+        runner = Bladerunner(options)
+        if streams_results(options):
+            results = runner.run_iter(commands, servers)
+        else:
+            results = runner.run(commands, servers)
         cmdline_exit(results, options)
     except KeyboardInterrupt:
         raise SystemExit("interrupted")
@@ -0,0 +1,183 @@
+"""Adaptive limits on the number of hosts run on at once.
+
+This file is part of Bladerunner.
+
+Copyright (c) 2015, Activision Publishing, Inc.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* Neither the name of Activision Publishing, Inc. nor the names of its
+  contributors may be used to endorse or promote products derived from this
+  software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+
+from __future__ import division
+
+import os
+import threading
+
+try:
+    import resource
+except ImportError:
+    pass
+
+
+# file descriptors held open by each host's ssh process and pty
+FDS_PER_HOST = 3
+
+# file descriptors kept free for everything else
+FD_RESERVE = 32
+
+# error codes from connect which mean hosts are being tried too quickly
+CONGESTION_ERRORS = (-1, -7)
+
+
+class AdaptiveLimit(object):
+    """An AIMD limit on the number of hosts in flight at once.
+
+    The limit starts at minimum and doubles each round of hosts until the
+    first sign of congestion, then grows by one host per round. A connect
+    error in CONGESTION_ERRORS, or the average connect time growing past
+    slow_factor times its lowest, cuts the limit by the decrease factor, at
+    most once per round. The limit never goes past the file descriptors and
+    ptys available when it was created.
+
+    Args::
+
+        minimum: integer lowest number of hosts to keep in flight
+        maximum: integer highest number of hosts to keep in flight
+        decrease: float multiplier for the limit on congestion
+        slow_factor: float multiple of the lowest average connect time
+                     which is considered congestion
+    """
+
+    def __init__(self, minimum=1, maximum=100, decrease=0.5, slow_factor=3):
+        """Initializes the limit at minimum, within the local headroom."""
+
+        self.ceiling = max(1, min(maximum, local_headroom()))
+        self.minimum = max(1, min(minimum, self.ceiling))
+        self.limit = float(self.minimum)
+        self.decrease = decrease
+        self.slow_factor = slow_factor
+
+        self.in_flight = 0
+        self.average = None  # moving average of successful connect times
+        self.lowest = None  # the lowest average seen
+
+        self._slow_start = True
+        self._completed = 0
+        self._last_decrease = None  # completions at the last decrease
+        self._condition = threading.Condition()
+
+        super(AdaptiveLimit, self).__init__()
+
+    def acquire(self):
+        """Blocks until there is room for another host in flight."""
+
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, *_):
+        """Frees the room taken by acquire. Accepts a finished future."""
+
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def record(self, latency, error_code=1):
+        """Adjusts the limit after a connection attempt.
+
+        Args::
+
+            latency: float seconds the connection attempt took
+            error_code: the error code returned from connect
+        """
+
+        with self._condition:
+            self._completed += 1
+            congested = error_code in CONGESTION_ERRORS
+
+            if error_code > 0:
+                if self.average is None:
+                    self.average = latency
+                else:
+                    self.average = self.average * 0.8 + latency * 0.2
+                if self.lowest is None or self.average < self.lowest:
+                    self.lowest = self.average
+                elif self.average > self.lowest * self.slow_factor:
+                    congested = True
+
+            if congested:
+                if self._last_decrease is None or \
+                   self._completed >= self._last_decrease + self.limit:
+                    self._last_decrease = self._completed
+                    self._slow_start = False
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+            elif self._slow_start:
+                self.limit = min(self.ceiling, self.limit + 1)
+            else:
+                self.limit = min(self.ceiling, self.limit + 1 / self.limit)
+
+            self._condition.notify_all()
+
+
+def local_headroom():
+    """Counts how many more hosts this process could open sessions to.
+
+    Returns:
+        integer number of hosts, limited by free file descriptors and ptys
+    """
+
+    headroom = []
+
+    try:
+        soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (NameError, ValueError, OSError):
+        soft_limit = None
+
+    if soft_limit is not None and soft_limit != resource.RLIM_INFINITY:
+        free_fds = soft_limit - _open_fds() - FD_RESERVE
+        headroom.append(max(free_fds, 0) // FDS_PER_HOST)
+
+    try:
+        with open("/proc/sys/kernel/pty/max") as pty_max:
+            with open("/proc/sys/kernel/pty/nr") as pty_nr:
+                headroom.append(int(pty_max.read()) - int(pty_nr.read()))
+    except (IOError, OSError, ValueError):
+        pass
+
+    return min(headroom) if headroom else float("inf")
+
+
+def _open_fds():
+    """Returns the number of file descriptors open in this process."""
+
+    for fd_dir in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return len(os.listdir(fd_dir))
+        except OSError:
+            continue
+    return 0
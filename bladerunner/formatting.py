@@ -40,6 +40,8 @@ import os
 import re
 import sys
 import codecs
+import hashlib
+import contextlib
 
 from bladerunner.progressbar import get_term_width
 
@@ -47,6 +49,26 @@ from bladerunner.progressbar import get_term_width
 DEFAULT_ENCODINGS = ["utf-8", "latin-1", "utf-16"]
 DEFAULT_ENCODING = "utf-8"
 
+# results longer than this are grouped by their digest rather than in full
+DIGEST_OVER = 4096
+
+# colours, cursor positioning "tabs" and the odd reset
+TERMINAL_NOISE = re.compile("\x1b\\[(?:[0-9;]+[mG]|m\x0f)")
+
+# commands at least this long are looked for wrapping into their output, in
+# sections of ECHO_CHUNK characters
+ECHO_MIN = 60
+ECHO_CHUNK = 30
+
+# compiled echo patterns, keyed by the command they were made from
+_ECHO_PATTERNS = {}
+
+# the options keys which may hold passwords to hide from the output
+PASSWORD_KEYS = ("password", "second_password", "jump_password")
+
+# compiled password alternations, keyed by the passwords they match
+_PASSWORD_PATTERNS = {}
+
 if sys.version_info > (3,):
     UNICODE_TYPE = str
 else:
@@ -75,23 +97,122 @@ class FakeStdOut(object):
         pass
 
 
+class OutputSink(object):
+    """A buffered writer for results, to an output file or stdout.
+
+    The output file is opened once, on the first flush, in the first of the
+    DEFAULT_ENCODINGS which can encode what is being written.
+
+    Args::
+
+        output_file: string path of a file to append to, or None for stdout
+        buffer_size: integer number of characters to buffer between writes
+    """
+
+    def __init__(self, output_file=None, buffer_size=65536):
+        """Initializes the sink with an empty buffer."""
+
+        self.output_file = output_file
+        self.buffer_size = buffer_size
+        self.encoding = None
+
+        self._handle = None
+        self._buffer = []
+        self._buffered = 0
+
+        super(OutputSink, self).__init__()
+
+    def write(self, string):
+        """Buffers the string, writing out the buffer once it's full."""
+
+        self._buffer.append(string)
+        self._buffered += len(string)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Writes out everything buffered."""
+
+        data = "".join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+
+        if not data:
+            return
+
+        if not self.output_file:
+            try:
+                sys.stdout.write(data)
+                sys.stdout.flush()
+                return
+            except (UnicodeEncodeError, UnicodeDecodeError):
+                self.output_file = _ask_for_output_file()
+
+        if self._handle is None:
+            self.encoding = _encoding_for(data)
+            self._handle = io.open(
+                self.output_file,
+                "a",
+                encoding=self.encoding,
+                errors="replace",
+            )
+
+        self._handle.write(UNICODE_TYPE(data))
+
+    def close(self):
+        """Flushes the buffer and closes the output file."""
+
+        self.flush()
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+
+@contextlib.contextmanager
+def output_sink(options):
+    """Writes through a single OutputSink while in this context.
+
+    The sink is held in options under output_sink, so write() uses it. If
+    there's one there already it is used and left open for its owner.
+
+    Args:
+        options: the options dictionary, uses the 'output_file' key
+
+    Yields:
+        the OutputSink object
+    """
+
+    if options.get("output_sink") is not None:
+        yield options["output_sink"]
+        return
+
+    sink = OutputSink(options.get("output_file"))
+    options["output_sink"] = sink
+    try:
+        yield sink
+    finally:
+        del options["output_sink"]
+        sink.close()
+
+
+def _encoding_for(string):
+    """Returns the first of DEFAULT_ENCODINGS which can encode string."""
+
+    for encoding in DEFAULT_ENCODINGS:
+        try:
+            codecs.encode(string, encoding)
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+        else:
+            return encoding
+
+    return DEFAULT_ENCODING
+
+
 def no_empties(input_list):
-    """Searches through a list and tosses empty elements."""
-
-    out_list = []
-    for item in input_list:
-        if item:
-            for encoding in DEFAULT_ENCODINGS:
-                try:
-                    out_list.append(codecs.decode(
-                        codecs.encode(item, encoding),
-                        encoding,
-                    ).strip())
-                except UnicodeEncodeError:
-                    pass
-                else:
-                    break
-    return out_list
+    """Searches through a list of text and tosses empty elements."""
+
+    return [item.strip() for item in input_list if item]
 
 
 def format_output(output, command, options=None):
@@ -107,32 +228,95 @@ def format_output(output, command, options=None):
         a (hopefully) nicely formatted string of the command's output
     """
 
-    if options is None:
-        options = {}
+    # the first line is the command, the last is /probably/ the prompt
+    # there can be cases that disobey this though, like exiting without a \n
+    lines = clean_lines(output, options)[1:-1]
+    echo = _echo_pattern(command)
+    if echo is not None:
+        # the wrapped echo can only take as many lines as it has sections
+        leading = (len(command) + ECHO_CHUNK - 1) // ECHO_CHUNK
+        lines = [
+            line for line in lines[:leading] if not echo.search(line)
+        ] + lines[leading:]
 
-    def cmd_in_line(command, line):
-        """Checks for long commands wrapping into the output."""
+    return "\n".join(line for line in lines if line)
 
-        if len(command) < 60:
-            return False
 
-        # how large of command sections we'll look for.
-        size = 30
-        cmd_split = [command[i:i + size] for i in range(0, len(command), size)]
+def _echo_pattern(command):
+    """Compiles the sections of a long command into one search pattern.
 
-        for fraction in cmd_split:
-            if line.find(fraction) > -1:
-                return True
+    Small terminals wrap long commands into the output, any of its leading
+    lines containing one of the sections is considered part of the echo.
 
-    output = output.splitlines()
-    results = []
-    # the first line is the command, the last is /probably/ the prompt
-    # there can be cases that disobey this though, like exiting without a \n
-    for line in output[1:-1]:
-        line = format_line(line, options)
-        if line and not cmd_in_line(command, line):
-            results.append(line)
-    return "\n".join(results)
+    Returns:
+        a compiled regex, or None if the command is too short to wrap
+    """
+
+    if len(command) < ECHO_MIN:
+        return None
+
+    try:
+        return _ECHO_PATTERNS[command]
+    except KeyError:
+        pass
+
+    sections = set(
+        command[i:i + ECHO_CHUNK] for i in range(0, len(command), ECHO_CHUNK)
+    )
+    pattern = re.compile("|".join(
+        re.escape(section) for section in sorted(sections, key=len)[::-1]
+    ))
+    if len(_ECHO_PATTERNS) > 32:
+        _ECHO_PATTERNS.clear()
+    _ECHO_PATTERNS[command] = pattern
+    return pattern
+
+
+def format_framed_output(output, start, options=None):
+    """Formatting function for the output of a framed command.
+
+    Args::
+
+        output: the pexpect object's before method after the end marker
+        start: the start marker, anything before it is the echoed command
+        options: dictionary of Bladerunner options
+
+    Returns:
+        the formatted string of everything printed between the markers
+    """
+
+    if not isinstance(output, bytes) and isinstance(start, bytes):
+        start = codecs.decode(start, "ascii")
+
+    position = output.find(start)
+    if position > -1:
+        output = output[position + len(start):]
+
+    return "\n".join(line for line in clean_lines(output, options) if line)
+
+
+def clean_lines(output, options=None):
+    """Cleans a whole output buffer at once and splits it into lines.
+
+    The buffer is decoded once, then terminal noise and passwords are each
+    removed in a single regex pass before the lines are split. Carriage
+    returns are left to splitting, so lone ones still separate lines.
+
+    Args::
+
+        output: string or bytes of output to clean
+        options: dictionary of Bladerunner options
+
+    Returns:
+        a list of cleaned lines, without leading whitespace
+    """
+
+    text, _ = decode(output)
+    if text is None:
+        # can't decode it all, fall back to cleaning what we can line by line
+        return [format_line(line, options) for line in output.splitlines()]
+
+    return [line.lstrip() for line in _clean(text, options).splitlines()]
 
 
 def format_line(line, options=None):
@@ -144,44 +328,97 @@ def format_line(line, options=None):
         options: dictionary of Bladerunner options
     """
 
-    if options is None:
-        options = {}
+    text, _ = decode(line)
+    if text is None:
+        return line  # can't decode this, not sure what to do. pass it back
 
-    for encoding in DEFAULT_ENCODINGS:
+    text = text.strip(os.linesep).replace("\r", "")  # no extra returns
+    return _clean(text, options).lstrip()
+
+
+def decode(output, encoding=None):
+    """Decodes bytes of output once, for the formatters to work on text.
+
+    Args::
+
+        output: bytes to decode, anything else is returned as it is
+        encoding: string encoding to try after the first of
+                  DEFAULT_ENCODINGS, usually the one the last output from
+                  the same host was decoded with. latin-1 decodes any bytes,
+                  so it's never tried before utf-8
+
+    Returns:
+        a tuple of the decoded text and the encoding which decoded it, or
+        (None, None) if no encoding could decode it
+    """
+
+    if not isinstance(output, bytes):
+        return (output, None)
+
+    encodings = DEFAULT_ENCODINGS
+    if encoding is not None and encoding != encodings[0]:
+        encodings = encodings[:1] + [encoding] + encodings[1:]
+
+    for encoding in encodings:
         try:
-            line = codecs.decode(line, encoding)
+            return (codecs.decode(output, encoding), encoding)
         except (UnicodeDecodeError, UnicodeEncodeError):
             pass
-        else:
-            break
-    else:
-        return line  # can't decode this, not sure what to do. pass it back
 
-    line = line.strip(os.linesep)  # can't strip new lines enough
-    line = line.replace("\r", "")  # no extra carriage returns
-    line = re.sub("\033\[[0-9;]+m", "", line)  # no colours
-    line = re.sub("\x1b\[[0-9;]+G", "", line)  # no crazy tabs
-    line = re.sub("\\x1b\[m\\x0f", "", line)
-    line = re.sub("^\s+", "", line)  # no trailing whitespace
-
-    # hide the user's passwords in the output in case the term echo'd them
-    for key in ["password", "second_password", "jump_password"]:
-        password = options.get(key)
-        if password:
-            if isinstance(password, (list, tuple)):
-                for passwd in password:
-                    line = line.replace(passwd, "*" * len(passwd))
-            else:
-                line = line.replace(password, "*" * len(password))
+    return (None, None)
+
+
+def _clean(text, options):
+    """Strips terminal noise and hides passwords in decoded text."""
+
+    text = TERMINAL_NOISE.sub("", text)
+    passwords = _password_pattern(options)
+    if passwords is not None:
+        # hide the user's passwords in the output in case the term echo'd them
+        text = passwords.sub(lambda match: "*" * len(match.group()), text)
+    return text
+
 
-    return line
+def _password_pattern(options):
+    """Returns one compiled alternation of all passwords in options, or None.
+
+    Longer passwords are tried first, so one containing another is hidden
+    entirely.
+    """
+
+    passwords = set()
+    for key in PASSWORD_KEYS:
+        password = (options or {}).get(key)
+        if isinstance(password, (list, tuple)):
+            passwords.update(passwd for passwd in password if passwd)
+        elif password:
+            passwords.add(password)
+
+    if not passwords:
+        return None
+
+    passwords = tuple(sorted(passwords, key=lambda pw: (-len(pw), pw)))
+    try:
+        return _PASSWORD_PATTERNS[passwords]
+    except KeyError:
+        if len(_PASSWORD_PATTERNS) > 32:
+            _PASSWORD_PATTERNS.clear()
+        pattern = re.compile("|".join(re.escape(pw) for pw in passwords))
+        _PASSWORD_PATTERNS[passwords] = pattern
+        return pattern
 
 
-def consolidate(results):
+def consolidate(results, digest_over=DIGEST_OVER):
     """Makes a list of servers and replies, consolidates dupes.
 
-    Args:
+    Servers are grouped through a dictionary, in the order each group was
+    first seen.
+
+    Args::
+
         results: the results dictionary from Bladerunner.run
+        digest_over: results longer than this are compared by a digest of
+                     their content, or None to always compare in full
 
     Returns:
         a results dictionary, with a names key instead of name, containing a
@@ -189,19 +426,43 @@ def consolidate(results):
     """
 
     finalresults = []
+    groups = {}
     for server in results:
-        for tempserver in finalresults:
-            if tempserver["results"] == server["results"]:
-                tempserver["names"].append(server["name"])
-                break
+        key = _results_key(server, digest_over)
+        if key in groups:
+            groups[key]["names"].append(server["name"])
         else:
             server["names"] = [server["name"]]
             del server["name"]
+            groups[key] = server
             finalresults.append(server)
 
     return finalresults
 
 
+def _results_key(server, digest_over):
+    """Builds a hashable key from a server's results and exit codes.
+
+    Args::
+
+        server: a server's results dictionary from Bladerunner.run
+        digest_over: results longer than this are replaced by their digest
+
+    Returns:
+        a tuple which is equal for servers with matching results
+    """
+
+    key = []
+    for command, result in server["results"]:
+        if digest_over is not None and len(result) > digest_over:
+            if not isinstance(result, bytes):
+                result = codecs.encode(result, DEFAULT_ENCODING)
+            result = (hashlib.sha1(result).digest(), len(result))
+        key.append((command, result))
+
+    return (tuple(key), tuple(server.get("exit_codes") or ()))
+
+
 def csv_results(results, options=None):
     """Prints the results consolidated and in a CSV-ish fashion.
 
@@ -220,6 +481,13 @@ def csv_results(results, options=None):
     else:
         csv_char = ","
 
+    with output_sink(options) as sink:
+        _csv_results(results, options, csv_char, sink)
+
+
+def _csv_results(results, options, csv_char, sink):
+    """Writes the CSV results, flushing the sink after each server."""
+
     write("server{csv}command{csv}result\r\n".format(csv=csv_char), options)
     for server in results:
         for command, command_result in server["results"]:
@@ -243,6 +511,7 @@ def csv_results(results, options=None):
                 ),
                 options,
             )
+        sink.flush()  # results may be streaming in from run_iter
 
 
 def stacked_results(results, options=None):
@@ -255,6 +524,13 @@ def stacked_results(results, options=None):
     """
 
     results, options = prepare_results(results, options)
+    with output_sink(options):
+        _stacked_results(results, options)
+
+
+def _stacked_results(results, options):
+    """Writes the prepared results in a vertical stack."""
+
     spacer = False
     for result_set in results:
         if spacer:
@@ -360,6 +636,12 @@ def pretty_results(results, options=None):
     """
 
     results, options = prepare_results(results, options)
+    with output_sink(options):
+        _pretty_results(results, options)
+
+
+def _pretty_results(results, options):
+    """Writes the prepared results with a frame around them."""
 
     pretty_header(options)
 
@@ -574,11 +856,14 @@ def write(string, options, end=""):
     Args::
 
         string: the string to write out
-        options: the options dictionary, uses 'output_file' key only
+        options: the options dictionary, uses the 'output_sink' or
+                 'output_file' keys
         end: character or empty string to end the print statement with
     """
 
-    if options.get("output_file"):
+    if options.get("output_sink") is not None:
+        options["output_sink"].write("{0}{1}".format(string, end))
+    elif options.get("output_file"):
         for enc in DEFAULT_ENCODINGS:
             try:
                 with io.open(options["output_file"], "a", encoding=enc) as out:
@@ -608,6 +893,17 @@ def _retry_write(string, options, end):
         error: the Exception class to raise if the user cancels
     """
 
+    options["output_file"] = _ask_for_output_file()
+    return write(string, options, end)
+
+
+def _ask_for_output_file():
+    """Asks the user for a file to write to after an error printing.
+
+    Returns:
+        the string file name, raises SystemExit if the user declines
+    """
+
     user_cancel = SystemExit(
         "Could not write results. Cancelled on user request."
     )
@@ -619,11 +915,7 @@ def _retry_write(string, options, end):
     )
 
     if double_check.lower().startswith("y"):
-        options["output_file"] = _prompt_for_input_on_error(
-            "File name: ",
-            user_cancel,
-        )
-        return write(string, options, end)
+        return _prompt_for_input_on_error("File name: ", user_cancel)
     else:
         raise user_cancel
 
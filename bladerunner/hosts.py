@@ -0,0 +1,172 @@
+"""Lazy sources of hosts to run on, for very large inventories.
+
+This file is part of Bladerunner.
+
+Copyright (c) 2015, Activision Publishing, Inc.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* Neither the name of Activision Publishing, Inc. nor the names of its
+  contributors may be used to endorse or promote products derived from this
+  software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+
+
+from __future__ import unicode_literals
+
+import sys
+from collections import OrderedDict
+
+from bladerunner.networking import is_excluded, iter_subnet, subnet_size
+
+
+if sys.version_info > (3,):
+    STRING_TYPE = str
+else:
+    STRING_TYPE = basestring
+
+
+# the number of recently seen hosts remembered to skip duplicates
+DEFAULT_MAX_SEEN = 100000
+
+
+class BoundedSet(object):
+    """A set which forgets its least recently added members past max_size.
+
+    Args:
+        max_size: integer maximum number of members to remember
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SEEN):
+        """Initializes an empty set."""
+
+        self.max_size = max_size
+        self._members = OrderedDict()
+        super(BoundedSet, self).__init__()
+
+    def __contains__(self, member):
+        """Checks if member is remembered."""
+
+        return member in self._members
+
+    def __len__(self):
+        """Returns the number of members remembered."""
+
+        return len(self._members)
+
+    def add(self, member):
+        """Adds member to the set.
+
+        Returns:
+            True if member was not already in the set
+        """
+
+        if member in self._members:
+            return False
+
+        self._members[member] = None
+        if len(self._members) > self.max_size:
+            self._members.popitem(last=False)
+        return True
+
+
+def iter_host_file(host_file):
+    """Lazily yields the hosts in a file, separated by any whitespace.
+
+    Args:
+        host_file: an open file object, string path, or "-" for stdin
+
+    Yields:
+        string hosts, the file is closed when they run out
+    """
+
+    if host_file == "-":
+        host_file = sys.stdin
+    elif isinstance(host_file, STRING_TYPE):
+        host_file = open(host_file, "r")
+
+    try:
+        for line in host_file:
+            for host in line.split():
+                yield host
+    finally:
+        if host_file is not sys.stdin:
+            host_file.close()
+
+
+def _iter_entries(source):
+    """Flattens a source of hosts to its string entries, lazily."""
+
+    if isinstance(source, STRING_TYPE):
+        yield source
+    elif callable(source):
+        for entry in _iter_entries(source()):
+            yield entry
+    elif hasattr(source, "readline"):
+        for entry in iter_host_file(source):
+            yield entry
+    else:
+        for item in source:
+            for entry in _iter_entries(item):
+                yield entry
+
+
+def iter_hosts(sources, exclude=None, max_seen=DEFAULT_MAX_SEEN):
+    """Yields each host from sources once, expanding networks lazily.
+
+    Nothing is read ahead, so hosts can be scheduled as soon as the first
+    is known. Duplicates are skipped within the last max_seen hosts, which
+    keeps memory flat for inventories of any size.
+
+    Args::
+
+        sources: a host or network string, an open file, a callable which
+                 returns more sources, or an iterable of any of those
+        exclude: list of IP addresses, networks or hostnames to skip. Any
+                 source entry starting with "!" is also excluded from then
+                 on, or from the start when sources is a list or tuple
+        max_seen: integer number of recent hosts remembered to dedupe
+
+    Yields:
+        string hostnames and IP addresses
+    """
+
+    exclude = list(exclude or [])
+    if isinstance(sources, (list, tuple)):
+        exclude.extend(
+            source[1:] for source in sources
+            if isinstance(source, STRING_TYPE) and source.startswith("!")
+        )
+
+    seen = BoundedSet(max_seen)
+    for entry in _iter_entries(sources):
+        if entry.startswith("!"):
+            if entry[1:] not in exclude:
+                exclude.append(entry[1:])
+        elif subnet_size(entry) is not None:
+            for member in iter_subnet(entry, exclude):
+                if seen.add(member):
+                    yield member
+        elif not is_excluded(entry, exclude) and seen.add(entry):
+            yield entry
@@ -54,6 +54,7 @@ class BladerunnerInteractive(object):
         self.bladerunner = bladerunner
         self.server = server
         self.sshr = False
+        self.sshc = None  # this session's own jump_host connection
 
     def connect(self, status_return=False):
         """Initializes the ssh connection object(s).
@@ -65,7 +66,10 @@ class BladerunnerInteractive(object):
             False if no connection could be made
         """
 
+        jumpbox = None
         if self.bladerunner.options["jump_host"]:
+            # sessions are set up concurrently, so each has its own jump_host
+            # connection rather than sharing the Bladerunner's sshc
             sshc, error = self.bladerunner.connect(
                 self.bladerunner.options["jump_host"],
                 self.bladerunner.options.get("jump_user") or \
@@ -74,18 +78,22 @@ class BladerunnerInteractive(object):
                     self.bladerunner.options["password"],
                 self.bladerunner.options.get("jump_port") or \
                     self.bladerunner.options["port"],
+                jumpbox=False,
             )
             if error < 0:
                 self.log(self.bladerunner.errors[int(math.fabs(error)) - 1])
                 return False if status_return else None
 
-            self.bladerunner.sshc = sshc
+            self.sshc = sshc
+            if self.bladerunner._jumps_from_shell():
+                jumpbox = sshc
 
         sshr, error = self.bladerunner.connect(
             self.server,
             self.bladerunner.options["username"],
             self.bladerunner.options["password"],
             self.bladerunner.options["port"],
+            jumpbox=jumpbox,
         )
         if error < 0:
             self.log(self.bladerunner.errors[int(math.fabs(error)) - 1])
@@ -115,9 +123,12 @@ class BladerunnerInteractive(object):
             return
 
         try:
-            if self.bladerunner.options["jump_host"]:
+            if self.bladerunner._jumps_from_shell():
                 self.bladerunner.close(self.sshr, False)
-                self.bladerunner.close(self.bladerunner.sshc, True)
+                self.bladerunner.close(self.sshc, True)
+            elif self.bladerunner.options["jump_host"]:
+                self.bladerunner.close(self.sshr, True)
+                self.bladerunner.close(self.sshc, True)
             else:
                 self.bladerunner.close(self.sshr, True)
         except OSError as error:
@@ -125,6 +136,7 @@ class BladerunnerInteractive(object):
                 raise
 
         self.sshr = None  # specifically None here, False means call _connect
+        self.sshc = None
 
     def run(self, command):
         """Run the command on the server.
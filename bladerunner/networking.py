@@ -32,7 +32,21 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 
+import errno
 import socket
+import select
+import binascii
+import itertools
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+try:
+    import selectors
+except ImportError:  # python 2, where probing is limited to select's fds
+    selectors = None
+
+from bladerunner.timing import TIMER
 
 
 def can_resolve(target):
@@ -52,98 +66,737 @@ def can_resolve(target):
         return False
 
 
-def _quadrant_to_ip(quadrant):
-    """Convert a single binary quadrant to string base 10 integer."""
+def lookup_address(target):
+    """Looks up the first address of a hostname.
+
+    Args:
+        target: a hostname or IP address as a string
+
+    Returns:
+        the string IP address, or None if target can't be resolved
+    """
+
+    try:
+        return socket.getaddrinfo(target, None)[0][4][0]
+    except (socket.error, UnicodeError, IndexError):
+        return None
+
+
+# connect_ex results meaning the connection is still being made
+CONNECTING = (
+    errno.EINPROGRESS,
+    errno.EWOULDBLOCK,
+    errno.EAGAIN,
+    getattr(errno, "WSAEWOULDBLOCK", errno.EWOULDBLOCK),
+)
+
+
+def probe(targets, port, timeout, hosts=None, resolver=None):
+    """Tries to open a TCP connection to port on all of the targets at once.
+
+    Targets are resolved concurrently through the resolver first, waiting
+    at most timeout for DNS, then the connections are started without
+    blocking and waited on together for at most timeout again.
+
+    Args::
+
+        targets: list of hostnames or IP addresses
+        port: integer port to connect to, usually ssh
+        timeout: float seconds to wait for the lookups, then the connections
+        hosts: dictionary of hostnames to addresses to use instead of DNS,
+               when there's no resolver
+        resolver: the Resolver to look targets up with, a new one is made
+                  for only these targets without it
+
+    Returns:
+        set of the targets which did not accept a connection. Targets which
+        can't be resolved, or weren't within timeout, aren't included. That
+        is left to Resolver
+    """
+
+    if resolver is None:
+        resolver = Resolver(hosts=hosts)
+    addresses = resolver.addresses(targets, timeout)
+
+    connecting = {}  # socket: target
+    unreachable = set()
+
+    for target in targets:
+        address = addresses.get(target)
+        if address is None:
+            continue
+
+        try:
+            family, socktype, proto, _, sockaddr = socket.getaddrinfo(
+                address,
+                port,
+                0,
+                socket.SOCK_STREAM,
+                0,
+                socket.AI_NUMERICHOST,  # never blocks on DNS
+            )[0]
+        except (socket.error, UnicodeError):
+            continue
+
+        sock = socket.socket(family, socktype, proto)
+        sock.setblocking(False)
+        result = sock.connect_ex(sockaddr)
+        if result in CONNECTING:
+            connecting[sock] = target
+            continue
+        elif result != 0:
+            unreachable.add(target)
+        sock.close()
+
+    deadline = TIMER() + timeout
+    with _ConnectWaiter(connecting) as waiter:
+        while connecting:
+            remaining = deadline - TIMER()
+            if remaining <= 0:
+                break
+
+            for sock in waiter.wait(remaining):
+                target = connecting.pop(sock)
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if error != 0:
+                    unreachable.add(target)
+                sock.close()
+
+    for sock, target in connecting.items():
+        unreachable.add(target)
+        sock.close()
+
+    return unreachable
+
+
+class _ConnectWaiter(object):
+    """Waits on non-blocking connects, with selectors where available.
+
+    select.select can't wait on file descriptors numbered 1024 or above,
+    which a run with many hosts in flight soon opens, so it's only used
+    on python 2.
+
+    Args:
+        socks: the sockets being connected, finished ones are unregistered
+    """
+
+    def __init__(self, socks):
+        """Registers the sockets to wait on."""
+
+        self.socks = socks
+        self.selector = None
+        if selectors is not None:
+            self.selector = selectors.DefaultSelector()
+            for sock in socks:
+                self.selector.register(sock, selectors.EVENT_WRITE)
+
+    def wait(self, timeout):
+        """Returns the sockets which finished connecting within timeout."""
+
+        if self.selector is None:
+            _, writable, errored = select.select(
+                [],
+                list(self.socks),
+                list(self.socks),
+                timeout,
+            )
+            return set(writable) | set(errored)
+
+        finished = set(key.fileobj for key, _ in self.selector.select(timeout))
+        for sock in finished:
+            self.selector.unregister(sock)
+        return finished
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self.selector is not None:
+            self.selector.close()
+
+
+class Resolver(object):
+    """Resolves hostnames once, caching if they can be resolved for ttl.
+
+    Concurrent lookups of the same hostname share one getaddrinfo call, and
+    prefetch() resolves a list of hosts ahead of the workers which connect
+    to them, so an unresolvable host fails without waiting on DNS.
+
+    Args::
+
+        ttl: integer seconds to cache each result for, 0 to not cache
+        hosts: dictionary of hostnames to addresses, used instead of DNS.
+               an address of None makes that hostname unresolvable
+        max_entries: integer maximum number of hostnames to cache
+        lookup: function to resolve a hostname with, returning its address
+                as a string, None if it can't be resolved, or a boolean
+                when the address isn't known
+    """
+
+    def __init__(self, ttl=300, hosts=None, max_entries=100000, lookup=None):
+        """Initializes an empty cache."""
+
+        self.ttl = ttl
+        self.hosts = dict(hosts or {})
+        self.max_entries = max_entries
+        self.lookup = lookup or lookup_address
+
+        self._cache = OrderedDict()  # hostname: (lookup result, expires)
+        self._pending = {}  # hostname: Future of the lookup in progress
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+
+        super(Resolver, self).__init__()
+
+    def cached(self, target):
+        """Returns the known result for target without resolving it.
+
+        Returns:
+            True or False if the result is known, otherwise None
+        """
 
-    return str(int(quadrant, 2))
+        if target in self.hosts:
+            return self.hosts[target] is not None
 
+        if _ip_to_int(target)[0] is not None:
+            return True
 
-def _quadrant_to_binary(quadrant):
-    """Convert a single quandrant to a binary string."""
+        with self._lock:
+            result, expires = self._cache.get(target, (None, 0))
+        if expires > TIMER():
+            return bool(result)
+
+    def address(self, target):
+        """Returns the address of target if it's known, without resolving.
+
+        Returns:
+            the string IP address, or None if it isn't known (yet)
+        """
+
+        if target in self.hosts:
+            return self.hosts[target]
+
+        if _ip_to_int(target)[0] is not None:
+            return target
 
-    ip_as_int = int(str(quadrant))
-    if 0 <= ip_as_int <= 255:
-        return bin(ip_as_int)[2:].rjust(8, str(0))
+        with self._lock:
+            result, expires = self._cache.get(target, (None, 0))
+        if expires > TIMER() and not isinstance(result, bool):
+            return result
 
+    def addresses(self, targets, timeout, max_workers=32):
+        """Resolves the addresses of targets concurrently, for timeout.
 
-def _ip_to_binary(ip_addr):
-    """Convert a dotted quad IP address to a binary string representation."""
+        Lookups still running after timeout are left to finish in the
+        background, their targets aren't included.
 
-    full_binary = []
-    for quadrant in ip_addr.split("."):
-        quad_binary = _quadrant_to_binary(quadrant)
+        Args::
 
-        if not quad_binary:
+            targets: list of hostnames or IP addresses
+            timeout: float seconds to wait for the lookups
+            max_workers: integer number of lookups to run at once
+
+        Returns:
+            dictionary of the targets resolved within timeout to addresses
+        """
+
+        addresses = {}
+        unknown = []
+        for target in targets:
+            address = self.address(target)
+            if address is not None:
+                addresses[target] = address
+            elif self.cached(target) is None:
+                unknown.append(target)
+
+        if unknown:
+            executor = ThreadPoolExecutor(max_workers=max(max_workers, 1))
+            futures = dict(
+                (executor.submit(self._resolve, target), target)
+                for target in unknown
+            )
+            executor.shutdown(wait=False)
+            done, _ = wait(futures, timeout=timeout)
+            for future in done:
+                result = future.result()
+                if result and not isinstance(result, bool):
+                    addresses[futures[future]] = result
+
+        return addresses
+
+    def resolve(self, target):
+        """Checks if target can be resolved, from the cache if possible.
+
+        Args:
+            target: a hostname or IP address as a string
+
+        Returns:
+            True if the target is resolvable to a valid IP address
+        """
+
+        resolvable = self.cached(target)
+        if resolvable is not None:
+            return resolvable
+
+        return bool(self._resolve(target))
+
+    def _resolve(self, target):
+        """Looks target up, sharing any lookup of it already in progress.
+
+        Returns:
+            the result of the lookup function
+        """
+
+        with self._lock:
+            future = self._pending.get(target)
+            if future is not None:
+                owner = False
+            else:
+                owner = True
+                future = self._pending[target] = Future()
+
+        if not owner:
+            return future.result()
+
+        result = False
+        try:
+            result = self.lookup(target)
+        finally:
+            with self._lock:
+                del self._pending[target]
+                if self.ttl:
+                    self._cache.pop(target, None)
+                    self._cache[target] = (result, TIMER() + self.ttl)
+                    while len(self._cache) > self.max_entries:
+                        self._cache.popitem(last=False)
+            future.set_result(result)
+
+        return result
+
+    def prefetch(self, targets, max_workers=32):
+        """Resolves targets concurrently in a background thread.
+
+        At most max_entries targets are resolved, so a huge list doesn't
+        push the first of them out of the cache before they're used.
+
+        Args::
+
+            targets: an iterable of hostnames
+            max_workers: integer number of lookups to run at once
+
+        Returns:
+            the started thread, or None if results aren't being cached
+        """
+
+        if not self.ttl:
             return None
 
-        full_binary.append(quad_binary)
+        self._cancelled.clear()
+        thread = threading.Thread(
+            target=self._prefetch,
+            args=(targets, max_workers),
+        )
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _prefetch(self, targets, max_workers):
+        """Target of the prefetch thread, resolves a window at a time."""
+
+        window = max(max_workers, 1) * 2
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+            pending = deque()
+            for target in itertools.islice(targets, self.max_entries):
+                if self._cancelled.is_set():
+                    break
+                pending.append(executor.submit(self.resolve, target))
+                if len(pending) >= window:
+                    pending.popleft().exception()  # errors are the caller's
+
+    def cancel(self):
+        """Stops any prefetch from starting more lookups."""
+
+        self._cancelled.set()
+
+    def clear(self):
+        """Forgets all cached results."""
+
+        with self._lock:
+            self._cache.clear()
 
-    return "{0:b}".format(int("".join(full_binary), 2)).rjust(32, str(0))
 
+def _ip_to_int(ip_addr):
+    """Convert an IPv4 or IPv6 address to a tuple of (integer, bit length).
+
+    Returns:
+        (None, None) if ip_addr isn't a valid address
+    """
+
+    for family, bits in ((socket.AF_INET, 32), (socket.AF_INET6, 128)):
+        try:
+            packed = socket.inet_pton(family, ip_addr)
+        except (socket.error, ValueError, UnicodeError):
+            continue
+        return int(binascii.hexlify(packed), 16), bits
+
+    return None, None
+
+
+def _int_to_ip(ip_int, bits=32):
+    """Convert an integer back to an IPv4 (bits=32) or IPv6 address."""
+
+    family = socket.AF_INET if bits == 32 else socket.AF_INET6
+    packed = binascii.unhexlify("{0:0{1}x}".format(ip_int, bits // 4))
+    return socket.inet_ntop(family, packed)
+
+
+def _mask_to_prefix(mask, bits):
+    """Convert a /NN or dotted quad netmask to a prefix length.
+
+    Like the netmask itself, the prefix ends at the first unset bit.
+
+    Returns:
+        integer prefix length, or None if the mask is invalid
+    """
+
+    if "." in mask:
+        mask_int, mask_bits = _ip_to_int(mask)
+        if mask_bits != bits:
+            return None
+        inverted = ~mask_int & ((1 << bits) - 1)
+        # the host section is everything after the highest unset bit
+        return bits - inverted.bit_length()
 
-def _binary_to_ip(binary):
-    """Convert an binary IP address to dotted quads."""
+    try:
+        prefix = int(mask)
+    except ValueError:
+        return None
 
-    ip_address = []
-    for quadrant in range(0, len(binary), 8):
-        ip_address.append(_quadrant_to_ip(binary[quadrant:quadrant + 8]))
-    return ".".join(ip_address)
+    if 0 <= prefix <= bits:
+        return prefix
 
 
-def _subnet_to_binary(subnet):
-    """Convert a CIDR-ish subnet to it's binary representation.
+def _parse_subnet(subnet):
+    """Convert a CIDR-ish subnet to integer arithmetic.
 
     Args:
-        subnet: string, something like N.N.N.N/NN or N.N.N.N/N.N.N.N
+        subnet: string, like N.N.N.N/NN, N.N.N.N/N.N.N.N or an IPv6 prefix
 
     Returns:
-        a tuple of binary representations, (network, netmask)
+        a tuple of (first, last, bits) integers for the whole network, or
+        (None, None, None) if subnet isn't a network
     """
 
     try:
         net, mask = subnet.split("/")
-    except ValueError:
-        return None, None
+    except (ValueError, AttributeError):
+        return None, None, None
+
+    net_int, bits = _ip_to_int(net)
+    if net_int is None:
+        return None, None, None
+
+    prefix = _mask_to_prefix(mask, bits)
+    if prefix is None:
+        return None, None, None
+
+    host_mask = (1 << (bits - prefix)) - 1
+    first = net_int & ~host_mask
+    return first, first | host_mask, bits
+
+
+def _member_range(subnet):
+    """Returns the (first, last, bits) integers of the usable members.
 
-    if not "." in mask:
-        mask = int(mask)
-        if 0 <= mask <= 32:
-            binary_mask = ("1" * mask).ljust(32, "0")
+    The network address is skipped, as is the broadcast address for IPv4.
+    Point to point networks (/31 and /127) and single hosts keep them all.
+    """
+
+    first, last, bits = _parse_subnet(subnet)
+    if first is None:
+        return None, None, None
+
+    if last - first > 1:
+        first += 1
+        if bits == 32:
+            last -= 1
+
+    return first, last, bits
+
+
+def subnet_size(subnet):
+    """Counts the member IPs of a CIDR-ish network without expanding it.
+
+    Args:
+        subnet: string, like N.N.N.N/NN, N.N.N.N/N.N.N.N or an IPv6 prefix
+
+    Returns:
+        integer number of IPs iter_subnet would yield, or None if invalid
+    """
+
+    first, last, _ = _member_range(subnet)
+    if first is not None:
+        return last - first + 1
+
+
+def _exclusion_ranges(exclude, bits):
+    """Converts exclusions to a sorted list of merged (first, last) ranges."""
+
+    ranges = []
+    for excluded in exclude or []:
+        first, last, excluded_bits = _parse_subnet(excluded)
+        if first is None:
+            first, excluded_bits = _ip_to_int(excluded)
+            last = first
+        if first is not None and excluded_bits == bits:
+            ranges.append((first, last))
+
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
         else:
-            # invalid mask size, not that a /0 is much safer...
-            return None, None
-    else:
-        binary_mask = _ip_to_binary(mask)
+            merged.append((first, last))
+    return merged
+
+
+def is_excluded(server, exclude):
+    """Checks if a single hostname or IP address is excluded.
+
+    Args::
+
+        server: string hostname or IP address
+        exclude: iterable of IP addresses, networks or hostnames
+
+    Returns:
+        True if server is in exclude, or in one of its networks
+    """
+
+    if server in exclude:
+        return True
+
+    ip_int, bits = _ip_to_int(server)
+    return ip_int is not None and any(
+        first <= ip_int <= last
+        for first, last in _exclusion_ranges(exclude, bits)
+    )
+
+
+def iter_subnet(subnet, exclude=None):
+    """Lazily yields the member IPs of a CIDR-ish network.
+
+    Addresses are generated from integers one at a time, so even a /8 or
+    a large IPv6 prefix can be walked without building the whole list.
+
+    Args::
+
+        subnet: string, like N.N.N.N/NN, N.N.N.N/N.N.N.N or an IPv6 prefix
+        exclude: iterable of IP addresses or networks to skip
+
+    Yields:
+        string IP addresses without masks, nothing if subnet is invalid
+    """
+
+    first, last, bits = _member_range(subnet)
+    if first is None:
+        return
+
+    current = first
+    for excluded_first, excluded_last in _exclusion_ranges(exclude, bits):
+        if excluded_last < current:
+            continue
+        if excluded_first > last:
+            break
+        for ip_int in _int_range(current, min(excluded_first - 1, last)):
+            yield _int_to_ip(ip_int, bits)
+        current = excluded_last + 1
+
+    for ip_int in _int_range(current, last):
+        yield _int_to_ip(ip_int, bits)
+
+
+def _int_range(first, last):
+    """Yields integers from first to last inclusive, without range limits.
+
+    IPv6 integers can be larger than python 2's xrange allows.
+    """
 
-    return _ip_to_binary(net), binary_mask
+    while first <= last:
+        yield first
+        first += 1
 
 
-def ips_in_subnet(subnet):
+def ips_in_subnet(subnet, exclude=None):
     """Given a CIDR-ish network address, return all member IPs.
 
-    Args:
-        subnet: string, something like N.N.N.N/NN or N.N.N.N/N.N.N.N
+    Prefer iter_subnet for large networks, this builds the entire list.
+
+    Args::
+
+        subnet: string, like N.N.N.N/NN, N.N.N.N/N.N.N.N or an IPv6 prefix
+        exclude: iterable of IP addresses or networks to skip
 
     Returns:
-        list of IPv4 addresses without masks
+        list of IP addresses without masks, or None if subnet is invalid
     """
 
-    binary_net, binary_mask = _subnet_to_binary(subnet)
-    if binary_mask is None or binary_net is None:
+    if subnet_size(subnet) is None:
         return None
 
-    for i in range(32):
-        if binary_mask[i] != "1":
-            subnet_range = int("1" * (32 - i), 2)
-            network_section = binary_net[:i]
-            break
-    else:
-        # catches providing a /32 subnet mask, just return the network as an IP
-        return [_binary_to_ip(binary_net)]
+    return list(iter_subnet(subnet, exclude))
+
+
+class ExpandedServers(object):
+    """A lazy sequence of servers, expanding any networks while iterating.
+
+    The length is counted arithmetically and the member IPs are generated
+    one at a time, so a huge network never needs to be held in memory. Use
+    size() for networks which may be bigger than len() allows, like an IPv6
+    /64, for which len() raises OverflowError.
+
+    Args::
+
+        servers: list of hostnames, IP addresses and CIDR-ish networks
+        exclude: list of IP addresses, networks or hostnames to skip
+    """
+
+    def __init__(self, servers, exclude=None, start=0, stop=None):
+        """Counts the members of each server or network up front."""
+
+        self.servers = list(servers)
+        self.exclude = list(exclude or [])
+        self.start = start
+        self.stop = stop
+        self._sizes = [self._size(server) for server in self.servers]
+
+    def _size(self, server):
+        """Returns the number of servers a single entry expands to."""
+
+        first, last, bits = _member_range(server)
+        if first is None:
+            return int(not is_excluded(server, self.exclude))
+
+        size = last - first + 1
+        for excluded_first, excluded_last in _exclusion_ranges(self.exclude,
+                                                               bits):
+            size -= max(0, min(last, excluded_last) -
+                        max(first, excluded_first) + 1)
+        return size
+
+    def _expand(self):
+        """Yields every server, expanding the networks in place."""
+
+        for server, size in zip(self.servers, self._sizes):
+            if _parse_subnet(server)[0] is not None:
+                for member in iter_subnet(server, self.exclude):
+                    yield member
+            elif size:
+                yield server
+
+    def size(self):
+        """The number of servers in this sequence, without expanding it.
+
+        Returns:
+            integer, which may be larger than sys.maxsize
+        """
+
+        total = sum(self._sizes)
+        stop = total if self.stop is None else min(self.stop, total)
+        return max(0, stop - self.start)
+
+    def __len__(self):
+        """The number of servers, see size() for the unbounded count."""
+
+        return self.size()
+
+    def __bool__(self):
+        """True if there are any servers, without counting through len()."""
+
+        return self.size() > 0
+
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        """Lazily iterate over the servers."""
+
+        return itertools.islice(self._expand(), self.start, self.stop)
+
+    def __getitem__(self, index):
+        """Supports indexing, and slicing without a step, without iterating."""
+
+        length = self.size()
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError("slice steps are not supported")
+            start, stop, _ = index.indices(length)
+            return ExpandedServers(
+                self.servers,
+                self.exclude,
+                self.start + start,
+                self.start + max(start, stop),
+            )
+
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("server index out of range")
+
+        index += self.start
+        for server, size in zip(self.servers, self._sizes):
+            if index < size:
+                return self._member(server, index)
+            index -= size
+
+    def _member(self, server, offset):
+        """Returns the server at offset in a single entry, arithmetically.
+
+        Args::
+
+            server: a hostname, IP address or network from self.servers
+            offset: integer index of the member, less than its size
+
+        Returns:
+            the member IP address of a network, or server itself
+        """
+
+        first, last, bits = _member_range(server)
+        if first is None:
+            return server
+
+        current = first
+        for excluded_first, excluded_last in _exclusion_ranges(self.exclude,
+                                                               bits):
+            if excluded_last < current:
+                continue
+            gap = excluded_first - current
+            if offset < gap:
+                break
+            offset -= max(0, gap)
+            current = excluded_last + 1
+        return _int_to_ip(current + offset, bits)
+
+    def __eq__(self, other):
+        """Compares equal to any sequence of the same servers, in order."""
+
+        try:
+            return self.size() == len(other) and all(
+                mine == theirs for mine, theirs in zip(self, other)
+            )
+        except TypeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        """Python 2 doesn't derive __ne__ from __eq__."""
+
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
 
-    members = []
-    for ip_ in range(1, subnet_range):  # skip the network address
-        ip_ = bin(ip_)[2:].rjust(32 - len(network_section), str(0))
-        members.append(_binary_to_ip("{0}{1}".format(network_section, ip_)))
+    def __repr__(self):
+        """String representation of self, includes the length."""
 
-    return members
+        return "<{0} of {1} servers>".format(
+            self.__class__.__name__,
+            self.size(),
+        )
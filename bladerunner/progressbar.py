@@ -39,6 +39,7 @@ import os
 import sys
 import time
 import argparse
+import threading
 
 try:
     import fcntl
@@ -48,16 +49,29 @@ except ImportError:
     pass
 
 
+# the width of the rate and estimated time remaining, with show_rate
+RATE_WIDTH = 23
+
+
 class ProgressBar(object):
     """A simple textual progress bar.
 
+    update() and grow() are safe to call from many threads at once. With a
+    refresh_rate, they only count and the bar is redrawn from its own timer
+    thread, started by setup() and stopped by clear().
+
     Args::
 
-        total_updates: an integer of how many times update() will be called
+        total_updates: an integer of how many times update() will be called,
+                       which can be raised later with grow()
         options: a dictionary of additional options. schema:
             width: an integer for fixed terminal width printing
             style: an integer style, between 0-2
             show_counters: a boolean to declare showing the counters or not
+            show_rate: a boolean to show the updates per second and the
+                       estimated time remaining after the bar
+            refresh_rate: the most times per second to redraw the bar, or
+                          None to redraw on every update
             left_padding: a string to pad the left side of the bar with
             right_padding: a string to pad the right side of the bar with
     """
@@ -90,6 +104,8 @@ class ProgressBar(object):
             self.style = 0
 
         self.show_counters = options.get("show_counters")
+        self.show_rate = options.get("show_rate")
+        self.refresh_rate = options.get("refresh_rate")
 
         self.chars["left"][self.style] = "{0}{1}".format(
             options.get("left_padding", ""),
@@ -101,6 +117,20 @@ class ProgressBar(object):
             options.get("right_padding", ""),
         )
 
+        self._lock = threading.Lock()  # counter, total and width
+        self._draw_lock = threading.Lock()  # writes to stdout
+        self._drawn = None  # the (counter, total) last drawn
+        self._started = None
+        self._stop = threading.Event()
+        self._timer = None
+
+        self._set_width()
+
+        super(ProgressBar, self).__init__()
+
+    def _set_width(self):
+        """Sets the width of the bar, leaving room for the counters."""
+
         if self.show_counters:
             self.width = self.total_width - (
                 (len(str(self.total)) * 2)
@@ -114,83 +144,154 @@ class ProgressBar(object):
                 + len(self.chars["right"][self.style])
             )
 
-        super(ProgressBar, self).__init__()
+        if self.show_rate:
+            self.width -= RATE_WIDTH
 
     def setup(self):
         """Prints an empty progress bar to the screen."""
 
-        if self.show_counters:
-            counter_diff = len(str(self.total)) - len(str(self.counter))
-            spaces = self.width + counter_diff
-            sys.stdout.write("{left}{space}{right} {count}/{total}".format(
-                left=self.chars["left"][self.style],
-                space=self.chars["space"][self.style] * spaces,
-                right=self.chars["right"][self.style],
-                count=self.counter,
-                total=self.total,
-            ))
-        else:
-            sys.stdout.write("{left}{space}{right}".format(
-                left=self.chars["left"][self.style],
-                space=self.chars["space"][self.style] * self.width,
-                right=self.chars["right"][self.style],
-            ))
-        sys.stdout.flush()
+        self._started = time.time()
+        with self._lock:
+            bar = self._render(self.counter, self.total, self.width)
+        self._write(bar, (self.counter, self.total))
+
+        if self.refresh_rate and self._timer is None:
+            self._stop.clear()
+            self._timer = threading.Thread(target=self._refresh)
+            self._timer.daemon = True
+            self._timer.start()
 
     def update(self, increment=1):
-        """Updates self.counter by increment and reprints the progress bar."""
+        """Updates self.counter by increment and reprints the progress bar.
 
-        self.counter += increment
-        if self.counter > self.total:
-            return
-        counter_diff = len(str(self.total)) - len(str(self.counter))
-        percent = (self.counter / self.total) * (self.width + counter_diff)
+        With a refresh_rate, the bar is reprinted by the timer thread.
+        """
 
-        sys.stdout.write("\r{left}{spaces}".format(
-            left=self.chars["left"][self.style],
-            spaces=self.chars[100][self.style] * int(percent),
-        ))
+        with self._lock:
+            self.counter += increment
+            if self.refresh_rate or self.counter > self.total:
+                return
+            state = (self.counter, self.total)
+            bar = self._render(self.counter, self.total, self.width)
+
+        self._write("\r{0}".format(bar), state)
+
+    def _refresh(self):
+        """Timer thread target, redraws the bar if it has changed."""
+
+        while not self._stop.wait(1 / self.refresh_rate):
+            self._redraw()
+
+    def _redraw(self):
+        """Reprints the progress bar if it changed since it was last drawn."""
+
+        with self._lock:
+            state = (min(self.counter, self.total), self.total)
+            if state == self._drawn:
+                return
+            bar = self._render(state[0], self.total, self.width)
+
+        self._write("\r{0}".format(bar), state)
+
+    def _write(self, bar, state):
+        """Writes the bar to stdout in one write, remembering its state."""
+
+        with self._draw_lock:
+            sys.stdout.write(bar)
+            sys.stdout.flush()
+            self._drawn = state
+
+    def _render(self, counter, total, width):
+        """Builds the whole progress bar as a string.
+
+        Args::
+
+            counter: integer of updates so far
+            total: integer of updates expected
+            width: integer width of the bar between its left and right
+
+        Returns:
+            the progress bar string, without a carriage return
+        """
+
+        counter_diff = len(str(total)) - len(str(counter))
+        if total:
+            percent = (counter / total) * (width + counter_diff)
+        else:
+            percent = 0
 
         try:
-            if not self.total > self.width * 4:
+            if not total > width * 4:
                 halfchar = self.chars[rounded(percent, 50)][self.style]
             else:
                 halfchar = self.chars[rounded(percent, 25)][self.style]
         except KeyError:
             halfchar = ""
 
+        spaces = width - int(percent) - len(halfchar)
+        bar = "{left}{full}{half}{space}{right}".format(
+            left=self.chars["left"][self.style],
+            full=self.chars[100][self.style] * int(percent),
+            half=halfchar,
+            space=self.chars["space"][self.style] * (
+                spaces + counter_diff if self.show_counters else spaces
+            ),
+            right=self.chars["right"][self.style],
+        )
+
         if self.show_counters:
-            sys.stdout.write("{left}{space}{right} {count}/{total}".format(
-                left=halfchar,
-                space=self.chars["space"][self.style] * (
-                    self.width
-                    + counter_diff
-                    - int(percent)
-                    - len(halfchar)
-                ),
-                right=self.chars["right"][self.style],
-                count=self.counter,
-                total=self.total
-            ))
-        else:
-            sys.stdout.write("{left}{space}{right}".format(
-                left=halfchar,
-                space=self.chars["space"][self.style] * (
-                    self.width
-                    - int(percent)
-                    - len(halfchar)
-                ),
-                right=self.chars["right"][self.style],
-            ))
-        sys.stdout.flush()
+            bar = "{0} {1}/{2}".format(bar, counter, total)
+
+        if self.show_rate:
+            bar = "{0}{1}".format(bar, self._rate(counter, total))
+
+        return bar
+
+    def _rate(self, counter, total):
+        """Returns the rate and time remaining, padded to RATE_WIDTH."""
+
+        elapsed = time.time() - (self._started or time.time())
+        if not counter or elapsed <= 0:
+            return " " * RATE_WIDTH
+
+        rate = counter / elapsed
+        remaining = int(max(total - counter, 0) / rate)
+        minutes, seconds = divmod(remaining, 60)
+        hours, minutes = divmod(minutes, 60)
+
+        return " {0:>7.1f}/s ETA {1}:{2:02d}:{3:02d}".format(
+            min(rate, 99999.9),
+            min(hours, 99),
+            minutes,
+            seconds,
+        )[:RATE_WIDTH].ljust(RATE_WIDTH)
+
+    def grow(self, increment=1):
+        """Adds increment to self.total, for totals which aren't known yet."""
+
+        with self._lock:
+            self.total += increment
+            self._set_width()
 
     def clear(self):
-        """Clears the progress bar from the screen and resets the cursor."""
+        """Clears the progress bar from the screen and resets the cursor.
+
+        Stops the timer thread, which is started again by setup().
+        """
 
-        sys.stdout.write("\r{spaces}".format(spaces=" " * self.total_width))
-        sys.stdout.flush()
-        sys.stdout.write("\r")
-        sys.stdout.flush()
+        if self._timer is not None:
+            self._stop.set()
+            self._timer.join()
+            self._timer = None
+
+        with self._draw_lock:
+            sys.stdout.write("\r{spaces}".format(
+                spaces=" " * self.total_width,
+            ))
+            sys.stdout.flush()
+            sys.stdout.write("\r")
+            sys.stdout.flush()
+            self._drawn = None
 
 
 def rounded(number, round_to):
@@ -0,0 +1,176 @@
+"""Shell prompts learned from each host, kept between runs.
+
+This file is part of Bladerunner.
+
+Copyright (c) 2015, Activision Publishing, Inc.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* Neither the name of Activision Publishing, Inc. nor the names of its
+  contributors may be used to endorse or promote products derived from this
+  software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+
+from __future__ import unicode_literals
+
+import io
+import re
+import json
+import codecs
+import threading
+from collections import OrderedDict
+
+from bladerunner.formatting import DEFAULT_ENCODING, UNICODE_TYPE
+
+
+class PromptStore(object):
+    """Learned shell prompts per hostname, optionally saved to a JSON file.
+
+    Each host keeps its own most recent prompts, so a prompt guessed on one
+    host isn't expected on every other host. The least recently learned
+    hosts are dropped once max_hosts is reached.
+
+    Args::
+
+        path: string path of the JSON file to load and save, or None
+        max_prompts: integer maximum number of prompts kept per host
+        max_hosts: integer maximum number of hosts kept
+    """
+
+    def __init__(self, path=None, max_prompts=4, max_hosts=10000):
+        """Initializes the store, loading the prompts saved at path."""
+
+        self.path = path
+        self.max_prompts = max_prompts
+        self.max_hosts = max_hosts
+
+        self._prompts = OrderedDict()  # host: [(prompt, compiled), ...]
+        self._lock = threading.Lock()
+        self._changed = False
+
+        if path:
+            self.load()
+
+        super(PromptStore, self).__init__()
+
+    def __len__(self):
+        """Returns the number of hosts with learned prompts."""
+
+        return len(self._prompts)
+
+    def __contains__(self, host):
+        """Checks if any prompts have been learned for host."""
+
+        return host in self._prompts
+
+    def get(self, host):
+        """Returns the string prompts learned for host, oldest first."""
+
+        return [prompt for prompt, _ in self._prompts.get(host, [])]
+
+    def compiled(self, host):
+        """Returns the compiled prompts learned for host, oldest first.
+
+        The prompts are compiled to bytes regular expressions when learned,
+        ready to be passed to pexpect's expect_list.
+        """
+
+        return [compiled for _, compiled in self._prompts.get(host, [])]
+
+    def learn(self, host, prompt):
+        """Adds a prompt for host, dropping its oldest if over max_prompts.
+
+        Args::
+
+            host: string hostname the prompt was seen on
+            prompt: string regex of the shell prompt
+
+        Returns:
+            boolean, False if the prompt was already known for host
+        """
+
+        if isinstance(prompt, bytes):
+            prompt_bytes = prompt
+            prompt = codecs.decode(prompt, DEFAULT_ENCODING)
+        else:
+            prompt_bytes = codecs.encode(prompt, DEFAULT_ENCODING)
+
+        with self._lock:
+            # copy on write, readers don't need to take the lock
+            learned = list(self._prompts.pop(host, []))
+            if prompt in [known for known, _ in learned]:
+                self._prompts[host] = learned
+                return False
+
+            learned.append((prompt, re.compile(prompt_bytes, re.DOTALL)))
+            self._prompts[host] = learned[-max(self.max_prompts, 1):]
+            while len(self._prompts) > max(self.max_hosts, 1):
+                self._prompts.popitem(last=False)
+            self._changed = True
+
+        return True
+
+    def load(self):
+        """Loads the prompts saved at path, ignoring a missing or bad file."""
+
+        try:
+            with io.open(self.path, "r", encoding=DEFAULT_ENCODING) as prompts:
+                saved = json.load(prompts)
+        except (IOError, OSError, ValueError):
+            return
+
+        if not isinstance(saved, dict):
+            return
+
+        for host, prompts in saved.items():
+            for prompt in prompts:
+                self.learn(host, prompt)
+
+        self._changed = False
+
+    def save(self):
+        """Writes the learned prompts to path, if anything new was learned.
+
+        Returns:
+            boolean, True if the file was written
+        """
+
+        with self._lock:
+            if not self.path or not self._changed:
+                return False
+            saved = dict(
+                (host, [prompt for prompt, _ in learned])
+                for host, learned in self._prompts.items()
+                if host is not None  # sessions which weren't from connect
+            )
+            self._changed = False
+
+        try:
+            with io.open(self.path, "w", encoding=DEFAULT_ENCODING) as prompts:
+                prompts.write(UNICODE_TYPE(json.dumps(saved, indent=2)))
+        except (IOError, OSError):
+            self._changed = True
+            return False
+
+        return True
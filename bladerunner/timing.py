@@ -0,0 +1,194 @@
+"""Timings of each phase of running on a host, and their summary.
+
+This file is part of Bladerunner.
+
+Copyright (c) 2015, Activision Publishing, Inc.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* Neither the name of Activision Publishing, Inc. nor the names of its
+  contributors may be used to endorse or promote products derived from this
+  software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+
+from __future__ import division
+
+import math
+import time
+from collections import OrderedDict
+
+
+# durations should not be affected by wall clock changes where avoidable
+TIMER = getattr(time, "monotonic", time.time)
+
+# the phases of each host, in the order they happen
+PHASES = ("resolve", "spawn", "login", "commands", "pipelined", "close")
+
+# the percentiles in each phase's summary
+PERCENTILES = (50, 95, 99)
+
+
+class Timings(object):
+    """Records the seconds spent in each phase of running on one host."""
+
+    def __init__(self):
+        """Starts timing the host."""
+
+        self.started = TIMER()
+        self.phases = {}  # phase: seconds
+        self.commands = []  # (command, seconds)
+
+        super(Timings, self).__init__()
+
+    def phase(self, name):
+        """Returns a context manager which adds its duration to phase name."""
+
+        return _Phase(self, name)
+
+    def add(self, name, seconds):
+        """Adds seconds to the phase name."""
+
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def add_command(self, command, seconds):
+        """Records the seconds a single command took."""
+
+        self.commands.append((command, seconds))
+
+    def as_dict(self):
+        """Returns the timings to attach to the host's results.
+
+        Returns:
+            dictionary of phase names to seconds, with a total key and a
+            commands key of a list of (command, seconds) tuples
+        """
+
+        timings = dict(self.phases)
+        timings["commands"] = list(self.commands)
+        timings["total"] = TIMER() - self.started
+        return timings
+
+
+class _Phase(object):
+    """Context manager adding the time spent inside it to a phase."""
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        self.started = TIMER()
+        return self
+
+    def __exit__(self, *_):
+        self.timings.add(self.name, TIMER() - self.started)
+
+
+class _NotTiming(object):
+    """Context manager standing in for _Phase when timings are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+
+NOT_TIMING = _NotTiming()
+
+
+def percentile(values, percent):
+    """Returns the nearest rank percentile of a sorted list of values."""
+
+    if not values:
+        return None
+
+    rank = int(math.ceil(percent / 100 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def summarize(timings):
+    """Aggregates the timings of many hosts per phase and per command.
+
+    Args:
+        timings: an iterable of the timings dictionaries from results
+
+    Returns:
+        an OrderedDict of phase or "command: <command>" to a dictionary of
+        count, p50, p95, p99 and max seconds
+    """
+
+    samples = OrderedDict((phase, []) for phase in PHASES + ("total",))
+    for host_timings in timings:
+        for phase, seconds in host_timings.items():
+            if phase == "commands":
+                for command, command_seconds in seconds:
+                    samples.setdefault("command: {0}".format(command), [])
+                    samples["command: {0}".format(command)].append(
+                        command_seconds
+                    )
+                if seconds:
+                    samples["commands"].append(sum(s for _, s in seconds))
+            else:
+                samples.setdefault(phase, []).append(seconds)
+
+    summary = OrderedDict()
+    for phase, values in samples.items():
+        if not values:
+            continue
+        values.sort()
+        stats = {"count": len(values), "max": values[-1]}
+        for percent in PERCENTILES:
+            stats["p{0}".format(percent)] = percentile(values, percent)
+        summary[phase] = stats
+
+    return summary
+
+
+def format_summary(summary):
+    """Formats the summary from summarize() as a table of lines.
+
+    Returns:
+        a string of the table, one line per phase
+    """
+
+    headers = ["count"] + ["p{0}".format(p) for p in PERCENTILES] + ["max"]
+    width = max([len("phase")] + [len(phase) for phase in summary])
+
+    lines = ["{0:<{1}} {2}".format(
+        "phase",
+        width,
+        " ".join("{0:>9}".format(header) for header in headers),
+    )]
+    for phase, stats in summary.items():
+        lines.append("{0:<{1}} {2:>9} {3}".format(
+            phase,
+            width,
+            stats["count"],
+            " ".join("{0:>8.3f}s".format(stats[header])
+                     for header in headers[1:]),
+        ))
+
+    return "\n".join(lines)
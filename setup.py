@@ -45,7 +45,7 @@ setup(
     author="Adam Talsma",
     author_email="adam@demonware.net",
     packages=["bladerunner"],
-    install_requires=["pexpect >= 3.3", "futures"],
+    install_requires=["pexpect >= 4.8", "futures"],
     entry_points={
         'console_scripts': [
             'bladerunner = bladerunner.cmdline:main',
@@ -0,0 +1,290 @@
+"""Unit tests for Bladerunner's asyncio engine."""
+
+
+import sys
+import time
+import pytest
+from mock import patch
+
+from bladerunner import Bladerunner
+
+if sys.version_info < (3, 5):
+    pytest.skip("the asyncio engine requires python 3.5+",
+                allow_module_level=True)
+
+import asyncio
+import pexpect
+
+from bladerunner import aio
+from bladerunner.base import RESYNC_WAITS
+
+
+def run(coroutine):
+    """Runs the coroutine to completion on a new event loop."""
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class FakeSession(object):
+    """Stands in for pexpect.spawn, replies are returned from expect_list."""
+
+    def __init__(self, replies=None, before=b""):
+        self.replies = list(replies or [])
+        self.before = before
+        self.sent = []
+
+    async def expect_list(self, patterns, timeout, async_=False):
+        assert async_ is True
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def sendline(self, line=""):
+        self.sent.append(line)
+
+    def send(self, line):
+        self.sent.append(line)
+
+    def isalive(self):
+        return True
+
+
+def test_arun_is_concurrent():
+    """Hosts are run at the same time, not one after the other."""
+
+    runner = Bladerunner({"threads": 50})
+
+    async def slow_connect(*args):
+        await asyncio.sleep(0.2)
+        return ("session", 1)
+
+    async def fake_send(runner, sshr, hostname):
+        return {"name": hostname, "results": [("uptime", "ok")]}
+
+    async def fake_close(runner, sshr):
+        pass
+
+    servers = ["host{0}".format(i) for i in range(30)]
+    start = time.time()
+    with patch.object(aio, "connect", side_effect=slow_connect):
+        with patch.object(aio, "send_commands", side_effect=fake_send):
+            with patch.object(aio, "_close", side_effect=fake_close):
+                results = run(runner.arun("uptime", servers))
+
+    assert time.time() - start < 2
+    assert [result["name"] for result in results] == servers
+
+
+def test_arun_lazy_servers():
+    """Lazy sources are scheduled a window at a time, in order."""
+
+    runner = Bladerunner({"threads": 1})
+    read = []
+
+    def servers():
+        for server in ("one", "two", "three", "four"):
+            read.append(server)
+            yield server
+
+    async def fake_single(runner, server, limit):
+        if server == "one":
+            assert read == ["one", "two"]
+        return server
+
+    with patch.object(aio, "_run_single", side_effect=fake_single):
+        results = run(runner.arun("uptime", servers()))
+
+    assert results == ["one", "two", "three", "four"]
+
+
+def test_arun_login_errors():
+    """Login errors are reported the same way as Bladerunner.run."""
+
+    runner = Bladerunner()
+
+    async def fake_connect(*args):
+        return (None, -3)
+
+    with patch.object(aio, "connect", side_effect=fake_connect):
+        results = run(aio.arun(runner, "uptime", "nowhere"))
+
+    assert results == [
+        {"name": "nowhere", "results": [("login", runner.errors[2])]},
+    ]
+
+
+def test_connect_unresolvable():
+    """Hosts the resolver knows are unresolvable fail without ssh."""
+
+    runner = Bladerunner({"hosts_map": {"nowhere": None}})
+
+    with patch.object(aio.pexpect, "spawn") as p_spawn:
+        result = run(aio.connect(runner, "nowhere", "user", "pass", 22))
+
+    assert result == (None, -3)
+    assert not p_spawn.called
+
+
+def test_connect_probe_refused():
+    """Hosts refusing the probe connection fail without ssh."""
+
+    runner = Bladerunner({"probe_timeout": 1})
+
+    async def refused(*args):
+        raise ConnectionRefusedError()
+
+    with patch.object(aio.asyncio, "open_connection", side_effect=refused):
+        with patch.object(aio.pexpect, "spawn") as p_spawn:
+            result = run(aio.connect(runner, "127.0.0.1", "user", "pass", 22))
+
+    assert result == (None, -7)
+    assert not p_spawn.called
+
+
+def test_connect_probe_hosts_map():
+    """The probe connects to the address from hosts_map."""
+
+    runner = Bladerunner({"probe_timeout": 1, "hosts_map": {"web": "::1"}})
+    probed = []
+
+    async def refused(host, port):
+        probed.append((host, port))
+        raise ConnectionRefusedError()
+
+    with patch.object(aio.asyncio, "open_connection", side_effect=refused):
+        with patch.object(aio.pexpect, "spawn") as p_spawn:
+            result = run(aio.connect(runner, "web", "user", "pass", 2222))
+
+    assert result == (None, -7)
+    assert probed == [("::1", 2222)]
+    assert not p_spawn.called
+
+
+def test_connect_probe_skipped_with_jump_host():
+    """Hosts reached through a jump_host aren't probed from here."""
+
+    runner = Bladerunner({
+        "probe_timeout": 1,
+        "jump_host": "jumper",
+        "jump_transport": "proxyjump",
+        "hosts_map": {"behind": "10.1.1.1"},
+    })
+
+    with patch.object(aio.asyncio, "open_connection") as p_open:
+        with patch.object(aio.pexpect, "spawn",
+                          side_effect=RuntimeError("spawned")) as p_spawn:
+            with pytest.raises(RuntimeError):
+                run(aio.connect(runner, "behind", "user", "pass", 22))
+
+    assert not p_open.called
+    assert p_spawn.called
+
+
+def test_arun_jumpbox_shell_uses_run():
+    """Runs through a jump_host's shell are handed to the threaded run."""
+
+    runner = Bladerunner({"jump_host": "jumper"})
+
+    with patch.object(runner, "run", return_value=["fake"]) as p_run:
+        results = run(aio.arun(runner, ["uptime"], ["somewhere"]))
+
+    p_run.assert_called_once_with(["uptime"], ["somewhere"], None)
+    assert results == ["fake"]
+
+
+@pytest.mark.parametrize("option, value", [
+    ("timings", True),
+    ("session_cache", 10),
+    ("adaptive_threads", True),
+])
+def test_arun_threaded_options_use_run(option, value):
+    """Options only the threaded engine supports are handed to run."""
+
+    runner = Bladerunner({option: value})
+
+    with patch.object(runner, "run", return_value=["fake"]) as p_run:
+        with patch.object(aio, "connect") as p_connect:
+            results = run(aio.arun(runner, ["uptime"], ["somewhere"]))
+
+    p_run.assert_called_once_with(["uptime"], ["somewhere"], None)
+    assert not p_connect.called
+    assert results == ["fake"]
+
+
+def test_login_with_password():
+    """The password is sent on a password prompt, then the shell is found."""
+
+    runner = Bladerunner()
+    session = FakeSession([22])
+
+    assert run(aio.login(runner, session, "hunter2", 1)) == (session, 1)
+    assert session.sent == ["hunter2"]
+
+
+def test_login_password_denied():
+    """A second password prompt after sending the password is an error."""
+
+    runner = Bladerunner()
+    session = FakeSession([1] + [pexpect.TIMEOUT("x")] * len(RESYNC_WAITS))
+
+    assert run(aio.login(runner, session, "hunter2", 1)) == (session, -5)
+
+
+def test_send_cmd():
+    """Commands are sent and their output formatted."""
+
+    runner = Bladerunner()
+    session = FakeSession([0], before=b"uptime\r\n up 3 days\r\n[me@host ~]$")
+
+    assert run(aio._send_cmd(runner, "uptime", session)) == "up 3 days"
+    assert session.sent == ["uptime"]
+
+
+def test_send_cmd_timeout():
+    """A command that never returns is reported with -1."""
+
+    runner = Bladerunner()
+    session = FakeSession(
+        [pexpect.TIMEOUT("x")] * (len(RESYNC_WAITS) + 5),
+        before=b"out",
+    )
+
+    assert run(aio._send_cmd(runner, "sleep 100", session)) == -1
+
+
+def test_send_interrupt_resyncs():
+    """After ^c the prompt is found and extra prompts drained until quiet."""
+
+    runner = Bladerunner()
+    session = FakeSession([pexpect.TIMEOUT("x"), 0, 0, pexpect.TIMEOUT("x")])
+
+    assert run(aio.send_interrupt(runner, session)) is None
+    assert session.sent == [chr(0x003)]
+    assert session.replies == []
+
+
+def test_send_framed():
+    """Framed commands return their output and exit status."""
+
+    runner = Bladerunner({"framed": True})
+    runner.commands = ["ls"]
+    line, start, end = runner._frame("ls")
+    marker = start[len(b"BR_S_"):]
+    session = FakeSession([0, 0], before=b"\r\n" + start + b"\r\nfile\r\n")
+    session.match = end.search(b"BR_E_" + marker + b":2\r\n")
+
+    with patch.object(runner, "_frame", return_value=(line, start, end)):
+        assert run(aio._send_cmd(runner, "ls", session)) == "file"
+        session.replies = [0, 0]
+        assert run(aio.send_commands(runner, session, "host")) == {
+            "name": "host",
+            "results": [("ls", "file")],
+            "exit_codes": [2],
+        }
+
+    assert session.sent == [line, line]
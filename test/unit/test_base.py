@@ -3,10 +3,13 @@
 
 import os
 import sys
+import codecs
+import time
 import random
 import pytest
 import pexpect
 import tempfile
+import subprocess
 from mock import call
 from mock import Mock
 from mock import patch
@@ -15,6 +18,7 @@ from bladerunner import base
 from bladerunner import Bladerunner
 from bladerunner import ProgressBar
 from bladerunner.formatting import FakeStdOut
+from bladerunner.networking import ExpandedServers
 
 
 class TempFile(object):
@@ -147,7 +151,11 @@ def test_progressbar_setup():
         with patch.object(runner, "_run_parallel") as patched_run:
             runner.run("nothing", "nowhere")
 
-    patched_pbar.assert_called_once_with(1, runner.options)
+    patched_pbar.assert_called_once_with(1, dict(
+        runner.options,
+        refresh_rate=base.PROGRESS_REFRESH,
+        show_rate=True,
+    ))
     patched_run.assert_called_once_with(["nowhere"])
 
 
@@ -202,6 +210,147 @@ def test_jumpbox_errors_raise():
     assert runner.errors[0] in err_msg and "Jumpbox Error:" in err_msg
 
 
+def test_jumpbox_session_pool():
+    """Multiple jump_host sessions run the servers in parallel."""
+
+    runner = Bladerunner({
+        "jump_host": "some_fake_host",
+        "jump_pass": "hunter10",
+        "jump_sessions": 3,
+    })
+
+    with patch.object(runner, "connect", return_value=("ok", 0)):
+        with patch.object(runner, "_open_jump_sessions",
+                          return_value=["two", "three"]) as p_open:
+            with patch.object(runner, "_run_jumped") as p_run:
+                with patch.object(runner, "close") as p_close:
+                    runner.run("nothing", ["a", "b", "c", "d"])
+
+    p_open.assert_called_once_with(2)
+    p_run.assert_called_once_with(["a", "b", "c", "d"])
+    assert p_close.mock_calls == [
+        call("ok", True),
+        call("two", True),
+        call("three", True),
+    ]
+    assert runner.jump_sessions == []
+    assert runner.sshc is None
+
+
+def test_open_jump_sessions():
+    """Extra jump_host sessions are connected directly, failures dropped."""
+
+    runner = Bladerunner({
+        "jump_host": "jumper",
+        "jump_user": "jumpy",
+        "jump_pass": "hunter3",
+        "jump_port": 2020,
+    })
+
+    returns = iter([("first", 1), (None, -5), ("third", 1)])
+    with patch.object(runner, "connect",
+                      side_effect=lambda *a, **k: next(returns)) as p_connect:
+        sessions = runner._open_jump_sessions(3)
+
+    assert sessions == ["first", "third"]
+    assert p_connect.call_count == 3
+    p_connect.assert_called_with("jumper", "jumpy", "hunter3", 2020,
+                                 jumpbox=False)
+
+
+def test_run_jumped():
+    """Each server is run through a checked out jump_host session."""
+
+    runner = Bladerunner({"jump_host": "jumper"})
+    runner.jump_sessions = ["jump_a", "jump_b"]
+
+    with patch.object(runner, "_run_single",
+                      side_effect=lambda srv, jump: (srv, jump)) as p_run:
+        results = runner._run_jumped(["one", "two", "three"])
+
+    assert [srv for srv, _ in results] == ["one", "two", "three"]
+    for _, jumpbox in results:
+        assert jumpbox in runner.jump_sessions
+    assert p_run.call_count == 3
+
+
+def test_run_jumped_safely_to_serial():
+    """A failed first login over the jump_host carries on in serial."""
+
+    runner = Bladerunner({"jump_host": "jumper", "password_safety": True})
+    runner.jump_sessions = ["jump_a", "jump_b"]
+    failed = {"name": "one", "results": [("login", runner.errors[1])]}
+
+    with patch.object(runner, "_run_single", return_value=failed) as p_run:
+        with patch.object(runner, "_run_serial", return_value=[]) as p_serial:
+            results = runner._run_jumped(["one", "two", "three"])
+
+    assert results == [failed]
+    p_run.assert_called_once_with("one")
+    p_serial.assert_called_once_with(["two", "three"])
+
+
+def test_run_jumped_safely():
+    """After the first login the rest are run over the jump_host sessions."""
+
+    runner = Bladerunner({"jump_host": "jumper", "password_safety": True})
+    runner.jump_sessions = ["jump_a", "jump_b"]
+
+    def fake_run(server, jumpbox=None):
+        """Returns a result without a login error."""
+        return {"name": server, "results": [("uptime", jumpbox)]}
+
+    with patch.object(runner, "_run_single", side_effect=fake_run):
+        with patch.object(runner, "_run_serial") as p_serial:
+            results = runner._run_jumped(["one", "two", "three"])
+
+    assert [result["name"] for result in results] == ["one", "two", "three"]
+    assert results[0]["results"] == [("uptime", None)]
+    for result in results[1:]:
+        assert result["results"][0][1] in runner.jump_sessions
+    assert not p_serial.called
+
+
+def test_iter_jumped_safely_to_serial():
+    """A failed first login yields the rest from serial over the jump_host."""
+
+    runner = Bladerunner({"jump_host": "jumper", "password_safety": True})
+    runner.jump_sessions = ["jump_a", "jump_b"]
+    failed = {"name": "one", "results": [("login", runner.errors[4])]}
+
+    with patch.object(runner, "_run_single", return_value=failed):
+        with patch.object(runner, "_iter_serial",
+                          return_value=iter(["two"])) as p_serial:
+            with patch.object(runner, "_iter_completed") as p_completed:
+                results = list(runner._iter_jumped(["one", "two"]))
+
+    assert results == [failed, "two"]
+    p_serial.assert_called_once_with(["two"])
+    assert not p_completed.called
+
+
+def test_known_length_overflow():
+    """Servers too many for len() are treated as a lazy source."""
+
+    assert base._known_length(["one", "two"]) == 2
+    assert base._known_length(iter([]), 3) == 3
+    assert base._known_length(ExpandedServers(["2001:db8::/64"])) is None
+
+
+def test_run_iter_ipv6_network():
+    """An IPv6 /64 is streamed rather than counted with len()."""
+
+    runner = Bladerunner({"threads": 2})
+
+    with patch.object(runner, "_run_single", side_effect=lambda srv: srv):
+        results = runner.run_iter(["uptime"], ["2001:db8::/64"])
+        first = [next(results) for _ in range(3)]
+        results.close()
+
+    assert len(first) == 3
+    assert all(server.startswith("2001:db8::") for server in first)
+
+
 def test_run_thread():
     """If run thread is used the callback should be called with results."""
 
@@ -257,8 +406,25 @@ def test_run_threaded():
             {"10.10.10.1": ["fake"], "10.10.10.2": ["fake"]},
             ["10.10.10.1", "10.10.10.2"],
         ),
+        (
+            ["fake"],
+            ["10.11.12.0/29", "!10.11.12.2/31", "!10.11.12.5", "!host"],
+            None,
+            ["fake"],
+            None,
+            ["10.11.12.1", "10.11.12.4", "10.11.12.6"],
+        ),
+        (
+            [],
+            [],
+            {"10.10.10.0/30": "fake", "!10.10.10.1": None},
+            None,
+            {"10.10.10.2": ["fake"]},
+            ["10.10.10.2"],
+        ),
     ],
-    ids=("basic", "one cmd_on_server", "network expansion", "cmds on network"),
+    ids=("basic", "one cmd_on_server", "network expansion", "cmds on network",
+         "network exclusions", "cmds on network exclusions"),
 )
 def test_prep_servers(cmds, srvs, cmds_on_svrs, ex_cmds, ex_on_svrs, ex_ret):
     """Prep servers should convert commands_on_servers or network addresses."""
@@ -297,20 +463,73 @@ def test_run_parallel_no_check():
     """Check that we're using concurrent.futures correctly."""
 
     runner = Bladerunner({"threads": 21})
-    map_patch = patch.object(
-        base.ThreadPoolExecutor,
-        "map",
-        return_value=iter(["wat", "ok"])
-    )
 
     with patch.object(base, "ThreadPoolExecutor") as patched_pool:
         runner._run_parallel_no_check(["nowhere"])
     patched_pool.assert_called_once_with(max_workers=21)
 
-    with map_patch as patched_map:
-        results = runner._run_parallel_no_check(["nowhere"])
-    patched_map.assert_called_once_with(runner._run_single, ["nowhere"])
-    assert results == ["wat", "ok"]
+    with patch.object(runner, "_run_single", side_effect=str.upper):
+        results = runner._run_parallel_no_check(["wat", "ok"])
+    assert results == ["WAT", "OK"]
+
+
+def test_map_windowed():
+    """Servers are pulled as results finish, and returned in order."""
+
+    pulled = []
+
+    def servers():
+        for server in range(20):
+            pulled.append(server)
+            yield server
+
+    def slow_first(server):
+        if server == 0:
+            time.sleep(0.1)
+        return server
+
+    results = Bladerunner._map_windowed(slow_first, servers(), 2)
+    assert next(results) == 0
+    assert len(pulled) == 4  # a window of twice the workers
+    assert list(results) == list(range(1, 20))
+
+
+def test_run_adaptive_threads():
+    """With adaptive_threads, each connection is recorded by the limiter."""
+
+    runner = Bladerunner({"adaptive_threads": True, "min_threads": 2})
+    limiters = []
+
+    def fake_connect(server, *args):
+        limiters.append(runner.limiter)
+        return (None, -7 if server == "dead" else -4)
+
+    with patch.object(runner, "connect", side_effect=fake_connect):
+        with patch.object(base.AdaptiveLimit, "record") as p_record:
+            results = runner._run_parallel_no_check(["one", "dead"])
+
+    assert [result["name"] for result in results] == ["one", "dead"]
+    assert isinstance(limiters[0], base.AdaptiveLimit)
+    assert limiters[0].in_flight == 0
+    assert sorted(call[0][1] for call in p_record.call_args_list) == [-7, -4]
+
+
+def test_map_windowed_limiter():
+    """A limiter caps the servers in flight, however many threads."""
+
+    limiter = base.AdaptiveLimit(2, 2)
+    in_flight = []
+
+    def run(server):
+        in_flight.append(limiter.in_flight)
+        time.sleep(0.01)
+        return server
+
+    results = Bladerunner._map_windowed(run, range(10), 100, limiter)
+
+    assert list(results) == list(range(10))
+    assert max(in_flight) == 2
+    assert limiter.in_flight == 0
 
 
 def test_run_safely_to_serial():
@@ -350,12 +569,18 @@ def test_run_safely_to_parralel():
     # run once we know the len of servers to run on.
     runner.progress = ProgressBar(3, runner.options)
 
+    first = {"name": "1st", "results": [("uptime", "up")]}
+
     with patch.object(runner, "connect", return_value=("ok", 0)) as p_connect:
-        with patch.object(runner, "send_commands", return_value=[]) as p_send:
+        with patch.object(runner, "send_commands",
+                          return_value=first) as p_send:
             with patch.object(runner, "close") as p_close:
-                with patch.object(runner, "_run_parallel_no_check") as p_run:
+                with patch.object(runner, "_run_parallel_no_check",
+                                  return_value=[]) as p_run:
                     with patch.object(runner.progress, "update") as p_update:
-                        runner._run_parallel_safely(["1st", "2nd", "3rd"])
+                        ret = runner._run_parallel_safely(
+                            ["1st", "2nd", "3rd"],
+                        )
 
     p_connect.assert_called_once_with(
         "1st",
@@ -368,6 +593,23 @@ def test_run_safely_to_parralel():
     # if the progressbar is used we should update it once for the check run
     assert p_update.called
     p_run.assert_called_once_with(["2nd", "3rd"])
+    assert ret == [first]
+
+
+def test_run_safely_timings():
+    """The first server checked is timed like the rest."""
+
+    runner = Bladerunner({"timings": True})
+    first = {"name": "1st", "results": [("uptime", "up")]}
+
+    with patch.object(runner, "connect", return_value=("ok", 1)):
+        with patch.object(runner, "send_commands", return_value=first):
+            with patch.object(runner, "close"):
+                with patch.object(runner, "_run_parallel_no_check",
+                                  return_value=[]):
+                    ret = runner._run_parallel_safely(["1st", "2nd"])
+
+    assert "timings" in ret[0]
 
 
 def test_run_serial():
@@ -389,6 +631,150 @@ def test_run_serial():
     ]
 
 
+def test_run_iter_yields_as_completed():
+    """Results from run_iter come back in the order the servers finish."""
+
+    runner = Bladerunner({"threads": 3})
+
+    def fake_run(server):
+        """Makes the first server the slowest one."""
+        time.sleep({"slow": 0.3, "medium": 0.15}.get(server, 0))
+        return {"name": server, "results": []}
+
+    with patch.object(runner, "_run_single", side_effect=fake_run):
+        results = runner.run_iter("nothing", ["slow", "medium", "fast"])
+        names = [result["name"] for result in results]
+
+    assert names == ["fast", "medium", "slow"]
+
+
+def test_run_lazy_servers():
+    """Lazy sources of servers are run without reading them up front."""
+
+    runner = Bladerunner({
+        "threads": 2,
+        "progressbar": True,
+        "password_safety": True,
+    })
+    read = []
+
+    def servers():
+        for server in ("10.0.0.0/30", "one", "two", "one"):
+            read.append(server)
+            yield server
+
+    def fake_run(server):
+        return {"name": server, "results": []}
+
+    with patch.object(base, "ProgressBar") as patched_pbar:
+        with patch.object(runner, "_run_single", side_effect=fake_run):
+            results = runner.run_iter("nothing", servers())
+            # the first login is checked before reading any further
+            assert next(results)["name"] == "10.0.0.1"
+            assert read == ["10.0.0.0/30"]
+            remaining = [result["name"] for result in results]
+
+    assert sorted(remaining) == ["10.0.0.2", "one", "two"]
+    patched_pbar.assert_called_once_with(0, dict(
+        runner.options,
+        refresh_rate=base.PROGRESS_REFRESH,
+        show_rate=True,
+    ))
+    assert patched_pbar.return_value.grow.call_count == 4
+
+
+def test_run_callable_servers():
+    """A callable source of servers is called for its servers."""
+
+    runner = Bladerunner({"threads": 2})
+
+    with patch.object(runner, "_run_single", side_effect=lambda x: x):
+        assert runner.run("nothing", lambda: ["one", "two"]) == ["one", "two"]
+
+
+def test_run_iter_serial():
+    """With a delay, run_iter yields each server in order."""
+
+    runner = Bladerunner({"delay": 1})
+
+    with patch.object(base.time, "sleep") as p_sleep:
+        with patch.object(runner, "_run_single", side_effect=lambda x: x):
+            results = runner.run_iter("nothing", ["one", "two"])
+            assert next(results) == "one"
+            assert not p_sleep.called
+            assert list(results) == ["two"]
+
+    p_sleep.assert_called_once_with(1)
+
+
+def test_run_iter_ends_jump_host():
+    """The jump_host is closed when the consumer stops iterating early."""
+
+    runner = Bladerunner({
+        "jump_host": "jumper",
+        "jump_pass": "hunter8",
+        "jump_port": 22,
+    })
+
+    with patch.object(runner, "connect", return_value=("jumpbox", 1)):
+        with patch.object(runner, "_run_single", side_effect=lambda x: x):
+            with patch.object(runner, "close") as p_close:
+                results = runner.run_iter("nothing", ["one", "two"])
+                assert next(results) == "one"
+                assert not p_close.called
+                results.close()
+
+    p_close.assert_called_once_with("jumpbox", True)
+    assert runner.sshc is None
+
+
+def test_iter_parallel_safely_login_error():
+    """A failed first login carries on in serial for the other servers."""
+
+    runner = Bladerunner()
+    failed = {"name": "one", "results": [("login", runner.errors[4])]}
+
+    with patch.object(runner, "_run_single", return_value=failed):
+        with patch.object(runner, "_iter_serial") as p_serial:
+            with patch.object(runner, "_iter_completed") as p_completed:
+                results = list(runner._iter_parallel_safely(["one", "two"]))
+
+    assert results == [failed]
+    p_serial.assert_called_once_with(["two"])
+    assert not p_completed.called
+
+
+def test_iter_completed_window():
+    """Only a window of servers are submitted to the executor at once."""
+
+    submitted = []
+
+    def servers():
+        """Record how many servers have been consumed."""
+        for server in range(20):
+            submitted.append(server)
+            yield server
+
+    results = Bladerunner._iter_completed(lambda x: x, servers(), 2)
+    first = next(results)
+    assert first in range(4)
+    assert len(submitted) <= 5
+    assert sorted([first] + list(results)) == list(range(20))
+
+
+def test_login_error():
+    """Only failed logins are counted as login errors."""
+
+    runner = Bladerunner()
+    assert runner._login_error(
+        {"name": "a", "results": [("login", runner.errors[0])]}
+    )
+    assert not runner._login_error({"name": "a", "results": [("login", "ok")]})
+    assert not runner._login_error(
+        {"name": "a", "results": [("ls", "a"), ("login", runner.errors[0])]}
+    )
+
+
 def test_run_single_error():
     """Ensure an error is passed back during run_single on connect errors."""
 
@@ -447,6 +833,85 @@ def test_run_single_success():
     assert p_update.called
 
 
+def test_run_single_timings():
+    """With timings, each result includes the time spent in each phase."""
+
+    runner = Bladerunner({"timings": True})
+    runner.commands = ["uptime", "who"]
+
+    def fake_connect(*args):
+        with runner._phase("resolve"):
+            pass
+        return ("ok", 1)
+
+    with patch.object(runner, "connect", side_effect=fake_connect):
+        with patch.object(runner, "_send_cmd", return_value="fine"):
+            with patch.object(runner, "close"):
+                results = runner._run_single("nowhere")
+
+    timings = results["timings"]
+    assert set(timings) == {"resolve", "commands", "close", "total"}
+    assert [command for command, _ in timings["commands"]] == ["uptime", "who"]
+    assert runner._timing.current is None
+
+
+def test_run_single_no_timings():
+    """Without timings, phases aren't timed and results are unchanged."""
+
+    runner = Bladerunner()
+    assert runner._phase("resolve") is base.NOT_TIMING
+
+    with patch.object(runner, "connect", return_value=("ok", 1)):
+        with patch.object(runner, "send_commands",
+                          return_value={"name": "nowhere", "results": []}):
+            with patch.object(runner, "close"):
+                results = runner._run_single("nowhere")
+
+    assert "timings" not in results
+
+
+def test_run_single_cached():
+    """With the session_cache on, sessions are reused instead of closed."""
+
+    runner = Bladerunner({"session_cache": 5})
+    runner.session_cache.checker = None
+
+    with patch.object(runner, "connect", return_value=("ok", 1)) as p_connect:
+        with patch.object(runner, "send_commands", return_value=[]) as p_send:
+            with patch.object(runner, "close") as p_close:
+                runner._run_single("somewhere")
+                runner._run_single("somewhere")
+
+    p_connect.assert_called_once_with(
+        "somewhere",
+        runner.options["username"],
+        None,
+        22,
+    )
+    assert p_send.call_count == 2
+    assert not p_close.called
+    assert "somewhere" in runner.session_cache
+
+    with patch.object(runner, "close") as p_close:
+        runner.close_cached_sessions()
+    p_close.assert_called_once_with("ok", True)
+
+
+def test_session_alive(pexpect_exceptions):
+    """Cached sessions must be alive and return to a shell prompt."""
+
+    runner = Bladerunner()
+    sshc = Mock()
+    assert runner._session_alive(sshc)
+    sshc.sendline.assert_called_once_with()
+
+    sshc.expect_list = Mock(side_effect=pexpect_exceptions("gone"))
+    assert not runner._session_alive(sshc)
+
+    sshc.isalive = Mock(return_value=False)
+    assert not runner._session_alive(sshc)
+
+
 def test_send_cmd_unix_endings(unicode_chr):
     """Ensure the correct line ending is used when unix is specified."""
 
@@ -458,7 +923,7 @@ def test_send_cmd_unix_endings(unicode_chr):
     server = Mock()
     # server.expect returns an integer of the prompt matched in its list
     # we want to return N+1 to simulate matching a passwd prompt
-    server.expect = Mock(return_value=(
+    server.expect_list = Mock(return_value=(
         len(runner.options["shell_prompts"]) +
         len(runner.options["extra_prompts"]) +
         1
@@ -473,7 +938,7 @@ def test_send_cmd_unix_endings(unicode_chr):
     # the second password should be send with sendline
     server.sendline.assert_called_once_with("hunter55")
 
-    assert server.expect.call_count == 2
+    assert server.expect_list.call_count == 2
 
 
 def test_send_cmd_winderps_endings(unicode_chr):
@@ -484,7 +949,7 @@ def test_send_cmd_winderps_endings(unicode_chr):
         "windows_line_endings": True,
     })
     server = Mock()
-    server.expect = Mock(return_value=1)
+    server.expect_list = Mock(return_value=1)
 
     with patch.object(base, "format_output") as p_format_out:
         runner._send_cmd("faked", server)
@@ -495,7 +960,7 @@ def test_send_cmd_winderps_endings(unicode_chr):
         unicode_chr(0x000A),
     ))
 
-    assert server.expect.call_count == 1
+    assert server.expect_list.call_count == 1
 
 
 def test_send_cmd_no_line_endings():
@@ -508,7 +973,7 @@ def test_send_cmd_no_line_endings():
         "windows_line_endings": False,
     })
     server = Mock()
-    server.expect = Mock(return_value=1)
+    server.expect_list = Mock(return_value=1)
 
     with patch.object(base, "format_output") as p_format_out:
         runner._send_cmd("fake_cmd", server)
@@ -520,7 +985,7 @@ def test_send_cmd_no_line_endings():
     )
     server.sendline.assert_called_once_with("fake_cmd")
 
-    assert server.expect.call_count == 1
+    assert server.expect_list.call_count == 1
 
 
 @pytest.mark.skipif(
@@ -532,7 +997,7 @@ def test_send_cmd_no_preference():
 
     runner = Bladerunner()
     server = Mock()
-    server.expect = Mock(return_value=1)
+    server.expect_list = Mock(return_value=1)
 
     with patch.object(base, "format_output") as p_format_out:
         runner._send_cmd("mock", server)
@@ -540,14 +1005,14 @@ def test_send_cmd_no_preference():
     p_format_out.assert_called_once_with(server.before, "mock", runner.options)
     server.sendline.assert_called_once_with("mock")
 
-    assert server.expect.call_count == 1
+    assert server.expect_list.call_count == 1
 
 
 def test_fallback_prompt_guess(pexpect_exceptions):
     """If a TIMEOUT or EOF error is raised, call _try_for_unmatched_prompt."""
 
     server = Mock()
-    server.expect = Mock(side_effect=pexpect_exceptions("mock exception"))
+    server.expect_list = Mock(side_effect=pexpect_exceptions("mock exception"))
     runner = Bladerunner({
         "username": "guy",
         "password": "hunter2",
@@ -577,6 +1042,7 @@ def test_try_for_unmatched_works():
     runner = Bladerunner()
 
     server = Mock()
+    runner._session_hosts[server] = "somehost"
     with patch.object(runner, "_push_expect_forward") as p_push:
         with patch.object(base, "format_output") as p_format:
             runner._try_for_unmatched_prompt(
@@ -585,7 +1051,8 @@ def test_try_for_unmatched_works():
                 "fake",
             )
 
-    assert "fake\\ output" in runner.options["shell_prompts"]
+    assert "fake\\ output" in runner.prompt_store.get("somehost")
+    assert "fake\\ output" not in runner.options["shell_prompts"]
     p_format.assert_called_once_with(
         bytes_or_string("fake output"),
         "fake",
@@ -599,7 +1066,7 @@ def test_try_for_unmatched_fails():
 
     runner = Bladerunner()
     server = Mock()
-    server.expect = Mock(side_effect=pexpect.TIMEOUT("fake"))
+    server.expect_list = Mock(side_effect=pexpect.TIMEOUT("fake"))
     server.before = bytes_or_string("mock output")
 
     with patch.object(runner, "send_interrupt") as p_interrupt:
@@ -610,7 +1077,7 @@ def test_try_for_unmatched_fails():
         )
 
     assert ret == -1
-    assert "out" in runner.options["shell_prompts"]
+    assert "out" in runner.prompt_store.get(None)
     p_interrupt.assert_called_once_with(server)
 
 
@@ -636,7 +1103,7 @@ def test_try_unmatched_fails_from_login():
 
     runner = Bladerunner()
     server = Mock()
-    server.expect = Mock(side_effect=pexpect.TIMEOUT("fake"))
+    server.expect_list = Mock(side_effect=pexpect.TIMEOUT("fake"))
     server.before = bytes_or_string("mock output")
 
     with patch.object(runner, "send_interrupt") as p_interrupt:
@@ -648,7 +1115,7 @@ def test_try_unmatched_fails_from_login():
         )
 
     assert ret == (None, -6)
-    assert "out" in runner.options["shell_prompts"]
+    assert "out" in runner.prompt_store.get(None)
     p_interrupt.assert_called_once_with(server)
 
 
@@ -665,6 +1132,79 @@ def test_send_commands_basic():
     assert ret == {"name": "nowhere", "results": [("fake", "ok")]}
 
 
+def test_send_commands_spilled():
+    """With capture_spill, the spilled outputs are listed in the results."""
+
+    runner = Bladerunner({"capture_limit": 10, "capture_spill": True})
+    runner.commands = ["cat big"]
+    server = Mock()
+    server.logfile_read = None
+
+    def fake_send(command, server):
+        capture = runner._start_capture(server, command)
+        capture.spills.append((command, "/tmp/spilled"))
+        return runner._captured(server, capture)
+
+    with patch.object(runner, "_send_cmd", side_effect=fake_send):
+        ret = runner.send_commands(server, "nowhere")
+
+    assert ret["spilled"] == [("cat big", "/tmp/spilled")]
+    assert server.logfile_read.spills == []
+    assert isinstance(server.logfile_read, base.Capture)
+
+
+def test_start_capture():
+    """A Capture is only teed in with a capture_limit, and only once."""
+
+    server = Mock()
+    server.logfile_read = "debug"
+    assert Bladerunner()._start_capture(server, "ls") is None
+
+    runner = Bladerunner({"capture_limit": 1024})
+    capture = runner._start_capture(server, "ls")
+
+    assert capture is server.logfile_read
+    assert capture.chain == "debug"
+    assert capture.spill is None
+    assert runner._start_capture(server, "ls") is capture
+    assert runner._captured(server, capture) is server.before
+    assert runner._captured(server, None) is server.before
+
+
+def test_decode_after_bad_byte():
+    """A bad byte in one output doesn't make the next ones latin-1."""
+
+    runner = Bladerunner()
+    server = Mock()
+
+    assert runner._decode(server, b"bad\xff\n") == u"bad\xff\n"
+    assert runner._encodings[server] == "latin-1"
+    assert runner._decode(server, b"caf\xc3\xa9\n") == u"caf\xe9\n"
+    assert runner._encodings[server] == "utf-8"
+
+
+def test_framed_bad_byte_then_utf8():
+    """Framed results after an output with a bad byte are still utf-8."""
+
+    runner = Bladerunner({"framed": True})
+    server = Mock()
+    outputs = [
+        b"echo BR''_S_x; printf\r\nBR_S_x\r\nbad\xff\r\n",
+        b"echo BR''_S_y; printf\r\nBR_S_y\r\ncaf\xc3\xa9\r\n",
+    ]
+    results = []
+    for marker, output in zip(("x", "y"), outputs):
+        server.before = output
+        start = "BR_S_{0}".format(marker).encode("ascii")
+        results.append(base.format_framed_output(
+            runner._captured(server, None),
+            start,
+            runner.options,
+        ))
+
+    assert results == [u"bad\xff", u"caf\xe9"]
+
+
 def test_send_commands_on_hosts():
     """Testing the calls when using the commands on servers dictionary."""
 
@@ -710,12 +1250,178 @@ def test_build_ssh_with_key(fake_key):
     assert cmd == "ssh -p 66 -t -i {0} -vvv bob@somewhere".format(fake_key)
 
 
+def test_build_ssh_proxyjump_master():
+    """The jump_host connection becomes the ControlMaster when multiplexed."""
+
+    runner = Bladerunner({
+        "jump_host": "jumper",
+        "jump_transport": "proxyjump",
+    })
+    cmd = runner._build_ssh_command("jumper", "joe", 22)
+    control_path = runner._control_path()
+    runner._stop_control_master()
+
+    assert cmd == (
+        "ssh -p 22 -t -o ControlMaster=auto -o ControlPath={0} "
+        "-o ControlPersist=60 joe@jumper"
+    ).format(control_path)
+    assert runner.jump_control is None
+    assert not os.path.exists(os.path.dirname(control_path))
+
+
+def test_build_ssh_proxyjump_target():
+    """Targets are proxied through the jump_host master's socket."""
+
+    runner = Bladerunner({
+        "jump_host": "jumper",
+        "jump_user": "jimbo",
+        "jump_port": 2222,
+        "jump_transport": "proxyjump",
+    })
+    cmd = runner._build_ssh_command("target", "joe", 22)
+    control_path = runner._control_path()
+    runner._stop_control_master()
+
+    assert cmd == (
+        "ssh -p 22 -t -o 'ProxyCommand=ssh -o BatchMode=yes -o "
+        "ControlPath={0} -p 2222 -W %h:%p jimbo@jumper' joe@target"
+    ).format(control_path)
+
+
+def test_run_proxyjump():
+    """With the proxyjump transport hosts are run in parallel, locally."""
+
+    runner = Bladerunner({
+        "jump_host": "jumper",
+        "jump_pass": "hunter6",
+        "jump_transport": "proxyjump",
+        "jump_sessions": 5,
+    })
+
+    with patch.object(runner, "connect", return_value=("ok", 0)):
+        with patch.object(runner, "_run_parallel") as p_run:
+            with patch.object(runner, "close") as p_close:
+                with patch.object(runner, "_stop_control_master") as p_stop:
+                    runner.run("nothing", ["a", "b"])
+
+    p_run.assert_called_once_with(["a", "b"])
+    p_close.assert_called_once_with("ok", True)
+    assert p_stop.called
+    assert runner.sshc is None
+
+
+def test_connect_proxyjump_ignores_sshc():
+    """A new local ssh process is spawned per target when multiplexed."""
+
+    runner = Bladerunner({
+        "jump_host": "jumper",
+        "jump_transport": "proxyjump",
+    })
+    runner.sshc = Mock()
+    sshr = Mock()
+    sshr.expect_list = Mock(return_value=3)
+
+    with patch.object(runner.resolver, "resolve", return_value=True):
+        with patch.object(base.pexpect, "spawn", return_value=sshr) as p_spawn:
+            with patch.object(runner, "_multipass") as p_multipass:
+                runner.connect("target", "joe", "hunter5", 22)
+    runner._stop_control_master()
+
+    assert p_spawn.called
+    assert not runner.sshc.sendline.called
+    assert runner.sshc is not sshr
+    p_multipass.assert_called_once_with(sshr, "hunter5", 3)
+
+
 def test_connect_no_resolve():
     """If we can't resolve the host connect should return immediately."""
 
     runner = Bladerunner()
-    with patch.object(base, "can_resolve", return_value=False):
+    with patch.object(runner.resolver, "resolve", return_value=False):
+        assert runner.connect("nowhere", "bob", "hunter2", 22) == (None, -3)
+
+
+def test_connect_hosts_map():
+    """Hosts are resolved through the runner's resolver and its hosts map."""
+
+    runner = Bladerunner({"hosts_map": {"nowhere": None}})
+    with patch.object(base.pexpect, "spawn") as p_spawn:
         assert runner.connect("nowhere", "bob", "hunter2", 22) == (None, -3)
+    assert not p_spawn.called
+
+
+def test_run_prefetches_hosts():
+    """Hosts are resolved ahead of time when the list is known."""
+
+    runner = Bladerunner()
+
+    with patch.object(runner.resolver, "prefetch") as p_prefetch:
+        with patch.object(runner.resolver, "cancel") as p_cancel:
+            with patch.object(runner, "_run_parallel"):
+                runner.run("nothing", ["one", "two"])
+
+    targets, threads = p_prefetch.call_args[0]
+    assert list(targets) == ["one", "two"]
+    assert threads == runner.options["threads"]
+    assert p_cancel.called
+
+
+def test_connect_unreachable():
+    """Hosts which failed the probe fail to connect without ssh."""
+
+    runner = Bladerunner({"hosts_map": {"dead": "10.0.0.1"}})
+    runner.unreachable.add("dead")
+
+    with patch.object(base.pexpect, "spawn") as p_spawn:
+        assert runner.connect("dead", "bob", "hunter2", 22) == (None, -7)
+    assert not p_spawn.called
+    assert "dead" not in runner.unreachable
+
+
+def test_run_probes_hosts():
+    """The probe_timeout option probes hosts in batches before running."""
+
+    runner = Bladerunner({"probe_timeout": 0.5, "port": 2222})
+    probed = []
+
+    def fake_probe(targets, port, timeout, resolver):
+        probed.append(len(targets))
+        assert (port, timeout) == (2222, 0.5)
+        assert resolver is runner.resolver
+        return {"host0"}
+
+    def fake_run(server):
+        assert "host0" in runner.unreachable  # probed before running
+        return server
+
+    servers = ["host{0}".format(i) for i in range(base.PROBE_BATCH + 1)]
+    with patch.object(base, "probe", side_effect=fake_probe):
+        with patch.object(runner, "_run_single", side_effect=fake_run):
+            with patch.object(runner.resolver, "prefetch"):
+                results = runner.run("nothing", servers)
+
+    assert results == servers
+    assert probed == [base.PROBE_BATCH, 1]
+    assert not runner.unreachable
+
+
+def test_run_jumped_skips_probe():
+    """Hosts aren't probed from here when they're reached by a jump_host."""
+
+    runner = Bladerunner({
+        "probe_timeout": 0.5,
+        "jump_host": "jumper",
+        "jump_pass": "hunter2",
+        "jump_port": 22,
+    })
+
+    with patch.object(base, "probe") as p_probe:
+        with patch.object(runner, "connect", return_value=("jumpbox", 1)):
+            with patch.object(runner, "_run_serial", side_effect=list):
+                with patch.object(runner, "close"):
+                    runner.run("nothing", ["one", "two"])
+
+    assert not p_probe.called
 
 
 def test_connect_new_connection():
@@ -723,9 +1429,9 @@ def test_connect_new_connection():
 
     runner = Bladerunner({"debug": 2, "jump_host": "nowhere", "timeout": 14})
     sshr = Mock()
-    sshr.expect = Mock(return_value="faked")
+    sshr.expect_list = Mock(return_value="faked")
 
-    with patch.object(base, "can_resolve", return_value=True):
+    with patch.object(runner.resolver, "resolve", return_value=True):
         with patch.object(base.pexpect, "spawn", return_value=sshr) as p_spawn:
             with patch.object(runner, "_multipass") as p_multipass:
                 runner.connect("nowhere", "bobby", "hunter44", 15)
@@ -733,25 +1439,39 @@ def test_connect_new_connection():
     p_spawn.assert_called_once_with("ssh -p 15 -t -vv bobby@nowhere",
                                     timeout=14)
     p_multipass.assert_called_once_with(sshr, "hunter44", "faked")
-    sshr.expect.assert_called_once_with(
-        runner.options["passwd_prompts"] +
-        runner.options["shell_prompts"] +
-        runner.options["extra_prompts"],
+    sshr.expect_list.assert_called_once_with(
+        runner._prompts(base.LOGIN_PROMPTS),
         runner.options["timeout"],
     )
     assert runner.sshc == sshr  # could be used as a jumpbox in future connects
     assert sshr.logfile_read == FakeStdOut  # debug is set, logging to stdout
 
 
+def test_connect_local_not_shared():
+    """Connecting from the local host explicitly doesn't set self.sshc."""
+
+    runner = Bladerunner({"jump_host": "nowhere"})
+    sshr = Mock()
+    sshr.expect_list = Mock(return_value="faked")
+
+    with patch.object(runner.resolver, "resolve", return_value=True):
+        with patch.object(base.pexpect, "spawn", return_value=sshr):
+            with patch.object(runner, "_multipass"):
+                runner.connect("nowhere", "bobby", "hunter44", 15,
+                               jumpbox=False)
+
+    assert runner.sshc is None
+
+
 def test_connect_new_exceptions(pexpect_exceptions):
     """If TIMEOUT or EOF exceptions are raised, connect returns (None, -7)."""
 
     runner = Bladerunner({"debug": 2, "jump_host": "nowhere"})
     sshr = Mock()
-    sshr.expect = Mock(side_effect=pexpect_exceptions("faked"))
+    sshr.expect_list = Mock(side_effect=pexpect_exceptions("faked"))
     sshr.isalive = Mock(return_value=False)
 
-    with patch.object(base, "can_resolve", return_value=True):
+    with patch.object(runner.resolver, "resolve", return_value=True):
         with patch.object(base.pexpect, "spawn", return_value=sshr) as p_spawn:
             res = runner.connect("nowhere", "noone", "hunter29", 99)
 
@@ -765,11 +1485,11 @@ def test_connect_exception_guess(pexpect_exceptions):
 
     runner = Bladerunner({"timeout": "fake"})
     sshr = Mock()
-    sshr.expect = Mock(side_effect=pexpect_exceptions("not real"))
+    sshr.expect_list = Mock(side_effect=pexpect_exceptions("not real"))
     sshr.before = Mock(return_value="what")
     sshr.isalive = Mock(return_value=True)
 
-    with patch.object(base, "can_resolve", return_value=True):
+    with patch.object(runner.resolver, "resolve", return_value=True):
         with patch.object(base.pexpect, "spawn", return_value=sshr) as p_spawn:
             with patch.object(runner, "_try_for_unmatched_prompt") as p_guess:
                 res = runner.connect("fence", "tim", "hunter1", 4)
@@ -785,31 +1505,47 @@ def test_connect_from_jumpbox():
     runner = Bladerunner({"jump_host": "faked"})
     runner.sshc = Mock()
     runner.sshc.before.find = Mock(return_value=-1)  # permission not denied
-    runner.sshc.expect = Mock(return_value="fake")
+    runner.sshc.expect_list = Mock(return_value="fake")
 
-    with patch.object(base, "can_resolve", return_value=True):
+    with patch.object(runner.resolver, "resolve", return_value=True):
         with patch.object(runner, "_multipass") as p_multipass:
             runner.connect("where", "johnny", "hunter13", 43)
 
     runner.sshc.sendline.assert_called_once_with("ssh -p 43 -t johnny@where")
-    runner.sshc.expect.assert_called_once_with(
-        runner.options["passwd_prompts"] +
-        runner.options["shell_prompts"] +
-        runner.options["extra_prompts"],
+    runner.sshc.expect_list.assert_called_once_with(
+        runner._prompts(base.LOGIN_PROMPTS),
         runner.options["timeout"],
     )
     p_multipass.assert_called_once_with(runner.sshc, "hunter13", "fake")
 
 
+def test_connect_from_given_jumpbox():
+    """An explicit jumpbox session is used instead of self.sshc."""
+
+    runner = Bladerunner({"jump_host": "faked"})
+    runner.sshc = Mock()
+    jumpbox = Mock()
+    jumpbox.before.find = Mock(return_value=-1)
+    jumpbox.expect_list = Mock(return_value="fake")
+
+    with patch.object(runner.resolver, "resolve", return_value=True):
+        with patch.object(runner, "_multipass") as p_multipass:
+            runner.connect("where", "jim", "hunter4", 22, jumpbox=jumpbox)
+
+    jumpbox.sendline.assert_called_once_with("ssh -p 22 -t jim@where")
+    assert not runner.sshc.sendline.called
+    p_multipass.assert_called_once_with(jumpbox, "hunter4", "fake")
+
+
 def test_connect_from_jb_failures(pexpect_exceptions):
     """Test the pexpect excpetions are caught from inside a jumpbox."""
 
     runner = Bladerunner({"jump_host": "notreal"})
     runner.sshc = Mock()
-    runner.sshc.expect = Mock(side_effect=pexpect_exceptions("fake error"))
+    runner.sshc.expect_list = Mock(side_effect=pexpect_exceptions("fake error"))
     runner.sshc.before = Mock(return_value="things")
 
-    with patch.object(base, "can_resolve", return_value=True):
+    with patch.object(runner.resolver, "resolve", return_value=True):
         with patch.object(runner, "send_interrupt") as p_interrupt:
             ret = runner.connect("place", "frank", "hunter63", 101)
 
@@ -825,7 +1561,7 @@ def test_connect_from_jb_denied():
     runner.sshc = Mock()
     runner.sshc.before.find = Mock(return_value=1)
 
-    with patch.object(base, "can_resolve", return_value=True):
+    with patch.object(runner.resolver, "resolve", return_value=True):
         with patch.object(runner, "send_interrupt") as p_interrupt:
             ret = runner.connect("home", "self", "hunter22", 443)
 
@@ -836,10 +1572,8 @@ def test_connect_from_jb_denied():
 
     runner.sshc.before.find.assert_called_once_with(expected_call)
     runner.sshc.sendline.assert_called_once_with("ssh -p 443 -t self@home")
-    runner.sshc.expect.assert_called_once_with(
-        runner.options["passwd_prompts"] +
-        runner.options["shell_prompts"] +
-        runner.options["extra_prompts"],
+    runner.sshc.expect_list.assert_called_once_with(
+        runner._prompts(base.LOGIN_PROMPTS),
         runner.options["timeout"],
     )
     p_interrupt.assert_called_once_with(runner.sshc)
@@ -877,7 +1611,7 @@ def test_login_new_host():
 
     runner = Bladerunner()
     sshc = Mock()
-    sshc.expect = Mock(side_effect=iter([2, 22]))  # passwd, then shell
+    sshc.expect_list = Mock(side_effect=iter([2, 22]))  # passwd, then shell
     assert runner.login(sshc, "fake", 0) == (sshc, 1)
     assert sshc.sendline.mock_calls == [call("yes"), call("fake")]
 
@@ -887,7 +1621,7 @@ def test_login_new_host_failures(pexpect_exceptions):
 
     runner = Bladerunner()
     sshc = Mock()
-    sshc.expect = Mock(side_effect=pexpect_exceptions("fake exception"))
+    sshc.expect_list = Mock(side_effect=pexpect_exceptions("fake exception"))
 
     with patch.object(runner, "send_interrupt") as p_interrupt:
         assert runner.login(sshc, "hunter12", 0) == (None, -1)
@@ -901,7 +1635,7 @@ def test_login_send_password():
 
     runner = Bladerunner()
     sshc = Mock()
-    sshc.expect = Mock(return_value=22)
+    sshc.expect_list = Mock(return_value=22)
     assert runner.login(sshc, "mock word", 1) == (sshc, 1)
     sshc.sendline.assert_called_once_with("mock word")
 
@@ -911,7 +1645,7 @@ def test_login_fail_guess(pexpect_exceptions):
 
     runner = Bladerunner()
     sshc = Mock()
-    sshc.expect = Mock(side_effect=pexpect_exceptions("fake explosion"))
+    sshc.expect_list = Mock(side_effect=pexpect_exceptions("fake explosion"))
 
     with patch.object(runner, "_try_for_unmatched_prompt") as p_try_for:
         runner.login(sshc, "passwerd", 1)
@@ -930,7 +1664,7 @@ def test_login_passwd_fail():
 
     runner = Bladerunner()
     sshc = Mock()
-    sshc.expect = Mock(return_value=1)
+    sshc.expect_list = Mock(return_value=1)
 
     with patch.object(runner, "send_interrupt") as p_interrupt:
         assert runner.login(sshc, "fakepasswd", 1) == (sshc, -5)
@@ -959,37 +1693,172 @@ def test_login_unused_password():
     assert runner.login(sshc, "no passwd sent", 9000) == (sshc, 1)
 
 
-def test_send_interrupt(unicode_chr, pexpect_exceptions):
+def test_send_interrupt(unicode_chr):
     """Ensure Bladerunner sends ^c to the sshc when jumpboxing."""
 
     runner = Bladerunner()
     sshc = Mock()
-    # any EOF or TIMEOUT exceptions are ignored
-    sshc.expect = Mock(side_effect=pexpect_exceptions("faked exception"))
 
     with patch.object(runner, "_push_expect_forward") as p_push:
         runner.send_interrupt(sshc)
 
     sshc.sendline.assert_called_once_with(unicode_chr(0x003))
-    sshc.expect.assert_called_once_with(
-        runner.options["shell_prompts"] + runner.options["extra_prompts"], 3)
+    assert not sshc.expect_list.called
     p_push.assert_called_once_with(sshc)
 
 
+def test_push_expect_forward_quiet():
+    """A prompt already in the buffer is found without waiting."""
+
+    runr = Bladerunner()
+    sshc = Mock()
+    sshc.expect_list = Mock(side_effect=[0, pexpect.TIMEOUT("quiet")])
+
+    assert runr._push_expect_forward(sshc) is True
+
+    assert sshc.expect_list.mock_calls == [
+        call(runr._prompts(base.SHELL_PROMPTS), 0),
+        call(runr._prompts(base.SHELL_PROMPTS), base.RESYNC_QUIET),
+    ]
+
+
+def test_push_expect_forward_escalates():
+    """Timeouts escalate until the prompt shows, then extras are drained."""
+
+    runr = Bladerunner()
+    sshc = Mock()
+    sshc.expect_list = Mock(side_effect=[
+        pexpect.TIMEOUT("x"),
+        pexpect.TIMEOUT("x"),
+        0,
+        0,
+        pexpect.TIMEOUT("quiet"),
+    ])
+
+    assert runr._push_expect_forward(sshc) is True
+
+    timeouts = [args[1] for _, args, _ in sshc.expect_list.mock_calls]
+    assert timeouts == list(base.RESYNC_WAITS[:3]) + [base.RESYNC_QUIET] * 2
+
+
 def test_push_expect_forward(pexpect_exceptions):
     """Verify the calls made to push the pexpect connection object forward."""
 
     runr = Bladerunner()
     sshc = Mock()
     # any EOF or TIMEOUT exceptions are ignored
-    sshc.expect = Mock(side_effect=pexpect_exceptions("faked exception"))
+    sshc.expect_list = Mock(side_effect=pexpect_exceptions("faked exception"))
+
+    assert runr._push_expect_forward(sshc) is False
 
-    runr._push_expect_forward(sshc)
+    if pexpect_exceptions is pexpect.EOF:
+        expected = base.RESYNC_WAITS[:1]
+    else:
+        expected = base.RESYNC_WAITS
+    assert sshc.expect_list.mock_calls == [
+        call(runr._prompts(base.SHELL_PROMPTS), wait) for wait in expected
+    ]
+
+
+def test_push_expect_forward_bounded():
+    """A shell that keeps printing prompts is not followed forever."""
+
+    runr = Bladerunner()
+    sshc = Mock()
+    sshc.expect_list = Mock(return_value=0)
+
+    assert runr._push_expect_forward(sshc) is True
+    assert len(sshc.expect_list.mock_calls) == base.RESYNC_MAX_PROMPTS + 1
 
-    assert sshc.expect.mock_calls == [
-        call(runr.options["shell_prompts"] + runr.options["extra_prompts"], 2),
-        call(runr.options["shell_prompts"] + runr.options["extra_prompts"], 2),
+
+def test_resync():
+    """The resync waits are decided without any pexpect object."""
+
+    resync = base._Resync()
+    waits = []
+    for outcome in ("timed_out", "matched", "matched", "timed_out"):
+        waits.append(resync.wait)
+        getattr(resync, outcome)()
+
+    assert waits == [
+        base.RESYNC_WAITS[0],
+        base.RESYNC_WAITS[1],
+        base.RESYNC_QUIET,
+        base.RESYNC_QUIET,
     ]
+    assert resync.wait is None
+    assert resync.found is True
+
+
+def test_resync_gives_up():
+    """Without a prompt, the resync ends after the last of RESYNC_WAITS."""
+
+    resync = base._Resync()
+    for _ in base.RESYNC_WAITS:
+        resync.timed_out()
+
+    assert resync.wait is None
+    assert resync.found is False
+
+
+def test_login_failure():
+    """Negative error codes are mapped to the login error result."""
+
+    runner = Bladerunner()
+
+    assert runner._error_message(-3) == runner.errors[2]
+    assert runner._login_failure("somewhere", -7) == {
+        "name": "somewhere",
+        "results": [("login", runner.errors[6])],
+    }
+
+
+def test_password_code():
+    """Another password prompt after the password means it was wrong."""
+
+    runner = Bladerunner()
+    passlen = len(runner.options["passwd_prompts"])
+
+    assert runner._password_prompted(passlen)
+    assert not runner._password_prompted(passlen + 1)
+    assert runner._password_code(passlen) == -5
+    assert runner._password_code(passlen + 1) == 1
+
+
+def test_unmatched_result():
+    """The unmatched prompt result depends on where it was called from."""
+
+    runner = Bladerunner()
+    sshc = Mock()
+
+    assert runner._unmatched_result(sshc, "", "login", True) == (sshc, 1)
+    assert runner._unmatched_result(None, "", "login", True) == (None, -6)
+    assert runner._unmatched_result(None, "out", "ls", False) == -1
+    with patch.object(base, "format_output", return_value="ok") as p_fmt:
+        assert runner._unmatched_result(sshc, "out", "ls", False) == "ok"
+    p_fmt.assert_called_once_with("out", "ls", runner.options)
+
+
+def test_host_results():
+    """Replies are built into the results of a host."""
+
+    runner = Bladerunner({"framed": True})
+    results = runner._host_results(
+        Mock(),
+        "somewhere",
+        ["ls", "false", "sleep 100"],
+        [("ok", 0), ("", 1), (-1, None)],
+    )
+
+    assert results == {
+        "name": "somewhere",
+        "results": [
+            ("ls", "ok"),
+            ("false", "no output from: false"),
+            ("sleep 100", "did not return after issuing: sleep 100"),
+        ],
+        "exit_codes": [0, 1, None],
+    }
 
 
 def test_close_and_terminate():
@@ -1008,17 +1877,368 @@ def test_close_keep_open(pexpect_exceptions):
     runner = Bladerunner()
     sshc = Mock()
     # exceptions are ignored here, we hope we're back on the jumpbox
-    sshc.expect = Mock(side_effect=pexpect_exceptions("mock exception"))
+    sshc.expect_list = Mock(side_effect=pexpect_exceptions("mock exception"))
 
     runner.close(sshc, False)
     sshc.sendline.assert_called_once_with("exit")
-    sshc.expect.assert_called_once_with(
-        runner.options["shell_prompts"] +
-        runner.options["extra_prompts"],
+    sshc.expect_list.assert_called_once_with(
+        runner._prompts(base.SHELL_PROMPTS),
         runner.options["cmd_timeout"],
     )
 
 
+def test_prompts_compiled_once():
+    """The compiled prompts are reused until the prompts change."""
+
+    runner = Bladerunner({"extra_prompts": ["extra"]})
+    compiled = runner._prompts(base.SHELL_PROMPTS)
+
+    assert runner._prompts(base.SHELL_PROMPTS) is compiled
+    assert len(compiled) == len(runner.options["shell_prompts"]) + 1
+    assert compiled[-1].pattern == b"extra"
+    assert runner._prompts(base.LOGIN_PROMPTS)[0].pattern == \
+        codecs.encode(runner.options["passwd_prompts"][0], "utf-8")
+
+
+def test_prompts_learned_prompt():
+    """Prompts learned on a host are expected from that host only."""
+
+    runner = Bladerunner()
+    server = Mock()
+    other = Mock()
+    runner._session_hosts[server] = "somehost"
+    runner._session_hosts[other] = "otherhost"
+    compiled = runner._prompts(base.COMMAND_PROMPTS, server)
+
+    runner._learn_prompt(b"some output\nhost:~ >", server)
+    learned = runner._prompts(base.COMMAND_PROMPTS, server)
+
+    assert runner.prompt_store.get("somehost") == ["host:~\\ \\>"]
+    assert len(learned) == len(compiled) + 1
+    assert learned[len(runner.options["shell_prompts"])].search(b"host:~ >")
+    assert runner._prompts(base.COMMAND_PROMPTS, other) is compiled
+    assert runner._prompts(base.COMMAND_PROMPTS) is compiled
+
+
+def test_send_cmd_learned_prompt_index():
+    """Learned prompts don't shift the index of the password prompts."""
+
+    runner = Bladerunner({"second_password": "hunter2"})
+    server = Mock()
+    runner._session_hosts[server] = "somehost"
+    runner.prompt_store.learn("somehost", "learned")
+    prompts = runner._prompts(base.COMMAND_PROMPTS, server)
+
+    # the last shell prompt, then the first password prompt
+    server.expect_list = Mock(side_effect=[
+        len(prompts) - len(runner.options["passwd_prompts"]) - 1,
+        len(prompts) - len(runner.options["passwd_prompts"]),
+        0,
+    ])
+
+    with patch.object(base, "format_output"):
+        runner._send_cmd("fake", server)
+        assert server.sendline.mock_calls == [call("fake")]
+        runner._send_cmd("fake", server)
+
+    assert server.sendline.mock_calls == [
+        call("fake"),
+        call("fake"),
+        call("hunter2"),
+    ]
+
+
+def test_session_hosts():
+    """Sessions are tracked to the host they're currently logged into."""
+
+    runner = Bladerunner({"jump_host": "jumper", "jump_port": 22})
+    jumpbox = Mock()
+    jumpbox.expect_list = Mock(return_value=30)
+
+    with patch.object(runner.resolver, "resolve", return_value=True):
+        runner.connect("target", "user", "pass", 22, jumpbox=jumpbox)
+
+    assert runner._session_hosts[jumpbox] == "target"
+    runner.close(jumpbox, False)
+    assert runner._session_hosts[jumpbox] == "jumper"
+
+
+def test_prompt_file_saved(tmpdir):
+    """The learned prompts are saved to the prompt_file after a run."""
+
+    prompt_file = str(tmpdir.join("prompts.json"))
+    runner = Bladerunner({"prompt_file": prompt_file})
+    runner.prompt_store.learn("somehost", "learned")
+
+    with patch.object(runner, "_run_parallel"):
+        runner.run("nothing", "nowhere")
+
+    assert Bladerunner({"prompt_file": prompt_file}).prompt_store.get(
+        "somehost"
+    ) == ["learned"]
+
+
+def test_prompts_changed_options():
+    """Prompts added to the options directly are also picked up."""
+
+    runner = Bladerunner()
+    compiled = runner._prompts(base.SHELL_PROMPTS)
+    runner.options["extra_prompts"].append("added")
+
+    assert runner._prompts(base.SHELL_PROMPTS)[-1].pattern == b"added"
+    assert runner._prompts(base.SHELL_PROMPTS) is not compiled
+
+
+def test_frame():
+    """Commands are wrapped in markers split by quotes in the command line."""
+
+    line, start, end = Bladerunner._frame("uptime;  ")
+    marker = start[len(b"BR_S_"):].decode("ascii")
+
+    assert line == (
+        "echo BR''_S_{0}; {{\nuptime\n}}; echo BR''_E_{0}:$?".format(marker)
+    )
+    assert start.decode("ascii") not in line
+    assert not end.search(line.encode("ascii"))
+    status = "BR_E_{0}:127\r\n".format(marker).encode("ascii")
+    assert end.search(status).group(1) == b"127"
+    assert not end.search("BR_E_{0}:1".format(marker).encode("ascii"))
+
+    assert "\nsleep 5 &\n}; echo BR" in Bladerunner._frame("sleep 5 &")[0]
+    assert "{\n:\n}; echo BR" in Bladerunner._frame("")[0]
+
+
+def test_frame_status_split_across_reads():
+    """An exit status arriving over several reads is read in full."""
+
+    _, _, end = Bladerunner._frame("false")
+    marker = end.pattern[len(b"BR_E_"):end.pattern.index(b":")]
+    script = "printf BR_E_{0}:1; sleep 0.2; printf '27\\n'".format(
+        marker.decode("ascii"))
+    sshc = pexpect.spawn("sh", ["-c", script])
+    sshc.expect_list([end], 5)
+    sshc.close()
+
+    assert sshc.match.group(1) == b"127"
+
+
+def test_frame_trailing_comment():
+    """A trailing comment in the command doesn't swallow the end marker."""
+
+    line, start, end = Bladerunner._frame("uptime  # how long")
+    shell = subprocess.Popen(
+        ["sh"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    output, _ = shell.communicate(line.encode("ascii") + b"\n")
+
+    assert start in output
+    assert end.search(output).group(1) == b"0"
+
+
+def framed_server(output, status, replies=None):
+    """Builds a mock pexpect object which has finished a framed command."""
+
+    end = base.re.compile(b"BR_E_x:(\\d+)")
+    server = Mock()
+    server.before = b"echo BR''_S_x; cmd\r\nBR_S_x\r\n" + output
+    server.match = end.search("BR_E_x:{0}".format(status).encode("ascii"))
+    server.expect_list = Mock(side_effect=replies or [0, 0])
+    return server, ("line", b"BR_S_x", end)
+
+
+def test_send_framed():
+    """The output between the markers is returned with the exit status."""
+
+    runner = Bladerunner({"framed": True})
+    server, frame = framed_server(b"one\r\ntwo\r\n", 3)
+
+    with patch.object(runner, "_frame", return_value=frame):
+        assert runner._send_framed("cmd", server) == ("one\ntwo", 3)
+
+    server.sendline.assert_called_once_with("line")
+    assert server.expect_list.mock_calls[0] == call(
+        [frame[2]] + runner._options_prompts(("passwd_prompts",)),
+        runner.options["cmd_timeout"],
+    )
+    assert server.expect_list.mock_calls[1] == call(
+        runner._prompts(base.SHELL_PROMPTS, server),
+        base.FRAMED_PROMPT_WAIT,
+    )
+
+
+def test_send_framed_learns_prompt():
+    """An unknown prompt after the end marker is learned for the host."""
+
+    runner = Bladerunner({"framed": True})
+    server, frame = framed_server(b"", 0, [0, pexpect.TIMEOUT("fake")])
+    runner._session_hosts[server] = "somehost"
+
+    with patch.object(runner, "_frame", return_value=frame):
+        with patch.object(base, "format_framed_output", return_value="ok"):
+            server.before = b"\r\nhost>>> "
+            assert runner._send_framed("cmd", server) == ("ok", 0)
+
+    assert runner.prompt_store.get("somehost") == ["host\\>\\>\\>\\ "]
+
+
+def test_send_framed_second_password():
+    """A password prompt is answered with the second_password."""
+
+    runner = Bladerunner({"framed": True, "second_password": "hunter2"})
+    server, frame = framed_server(b"ok\r\n", 0, [1, 0, 0])
+
+    with patch.object(runner, "_frame", return_value=frame):
+        assert runner._send_framed("sudo cmd", server) == ("ok", 0)
+
+    assert server.sendline.mock_calls == [call("line"), call("hunter2")]
+    assert server.expect_list.mock_calls[1] == call(
+        [frame[2]],
+        runner.options["cmd_timeout"],
+    )
+
+
+def test_send_framed_timeout(pexpect_exceptions):
+    """A framed command which doesn't finish is interrupted."""
+
+    runner = Bladerunner({"framed": True})
+    server, frame = framed_server(b"", 0, pexpect_exceptions("fake"))
+
+    with patch.object(runner, "_frame", return_value=frame):
+        with patch.object(runner, "send_interrupt") as p_interrupt:
+            assert runner._send_framed("sleep 100", server) == (-1, None)
+
+    p_interrupt.assert_called_once_with(server)
+
+
+def test_send_commands_framed():
+    """Framed commands also report their exit codes."""
+
+    runner = Bladerunner({"framed": True})
+    runner.commands = ["true", "false"]
+    server = Mock()
+
+    with patch.object(runner, "_send_framed",
+                      side_effect=[("ok", 0), ("", 1)]) as p_framed:
+        ret = runner.send_commands(server, "nowhere")
+
+    assert p_framed.mock_calls == [call("true", server), call("false", server)]
+    assert ret == {
+        "name": "nowhere",
+        "results": [("true", "ok"), ("false", "no output from: false")],
+        "exit_codes": [0, 1],
+    }
+
+
+def pipelined_frames(count):
+    """Builds fake frames and matching pexpect before/match values."""
+
+    frames = []
+    befores = []
+    matches = []
+    for index in range(count):
+        start = "BR_S_{0}".format(index).encode("ascii")
+        end = base.re.compile("BR_E_{0}:(\\d+)".format(index).encode("ascii"))
+        frames.append(("line{0}".format(index), start, end))
+        befores.append(b"prompt$ echo\r\n" + start + b"\r\nout" +
+                       str(index).encode("ascii") + b"\r\n")
+        matches.append(end.search(
+            "BR_E_{0}:{0}".format(index).encode("ascii")
+        ))
+    return frames, befores, matches
+
+
+def test_send_pipelined():
+    """All commands are sent in one write and read back by their markers."""
+
+    runner = Bladerunner({"pipelined": True, "unix_line_endings": True})
+    frames, befores, matches = pipelined_frames(3)
+    server = Mock()
+
+    def fake_expect(patterns, timeout):
+        """Moves the before and match along with each end marker."""
+        index = len(server.expect_list.mock_calls) - 1
+        if index < 3:
+            server.before = befores[index]
+            server.match = matches[index]
+        return 0
+
+    server.expect_list = Mock(side_effect=fake_expect)
+
+    with patch.object(runner, "_frame", side_effect=frames):
+        replies = runner._send_pipelined(["a", "b", "c"], server)
+
+    assert replies == [("out0", 0), ("out1", 1), ("out2", 2)]
+    server.send.assert_called_once_with("line0\nline1\nline2\n")
+    assert server.expect_list.call_count == 4  # each end, then the prompt
+
+
+def test_send_pipelined_timeout(pexpect_exceptions):
+    """Commands after one that times out are reported as unfinished."""
+
+    runner = Bladerunner({"pipelined": True})
+    frames, befores, matches = pipelined_frames(3)
+    server = Mock()
+    server.before = befores[0]
+    server.match = matches[0]
+    server.expect_list = Mock(side_effect=[0, pexpect_exceptions("fake")])
+
+    with patch.object(runner, "_frame", side_effect=frames):
+        with patch.object(runner, "send_interrupt") as p_interrupt:
+            replies = runner._send_pipelined(["a", "b", "c"], server)
+
+    assert replies == [("out0", 0), (-1, None), (-1, None)]
+    p_interrupt.assert_called_once_with(server)
+
+
+def test_send_pipelined_password_prompt():
+    """A password prompt stops the pipeline, it would eat the commands."""
+
+    runner = Bladerunner({"pipelined": True})
+    frames, befores, _ = pipelined_frames(2)
+    server = Mock()
+    server.before = befores[0]
+    server.expect_list = Mock(return_value=1)
+
+    with patch.object(runner, "_frame", side_effect=frames):
+        with patch.object(runner, "send_interrupt") as p_interrupt:
+            replies = runner._send_pipelined(["sudo a", "b"], server)
+
+    assert replies == [("out0", None), (-1, None)]
+    p_interrupt.assert_called_once_with(server)
+
+
+def test_send_commands_pipelined():
+    """The pipelined replies are split back into the results per command."""
+
+    runner = Bladerunner({"pipelined": True})
+    runner.commands = ["a", "b"]
+    server = Mock()
+
+    with patch.object(runner, "_send_pipelined",
+                      return_value=[("ok", 0), (-1, None)]) as p_pipelined:
+        ret = runner.send_commands(server, "nowhere")
+
+    p_pipelined.assert_called_once_with(["a", "b"], server)
+    assert ret == {
+        "name": "nowhere",
+        "results": [("a", "ok"), ("b", "did not return after issuing: b")],
+        "exit_codes": [0, None],
+    }
+
+
+def test_send_cmd_framed():
+    """_send_cmd returns only the output of a framed command."""
+
+    runner = Bladerunner({"framed": True})
+    server = Mock()
+
+    with patch.object(runner, "_send_framed", return_value=("ok", 0)):
+        assert runner._send_cmd("true", server) == "ok"
+
+
 def test_one_extra_prompt():
     """You can use a string or a list to provide extra prompts."""
 
@@ -1053,6 +2273,61 @@ def test_setup_interactive_many(fake_inter):
     inter.assert_any_call("place", False)
 
 
+def test_setup_interactive_report(fake_inter):
+    """Each new host is reported with its connection status and latency."""
+
+    runner = Bladerunner()
+
+    def fake_interactive(host, connect):
+        """Only the host named "good" logs in."""
+
+        return fake_inter if host == "good" else None
+
+    with patch.object(runner, "interactive", side_effect=fake_interactive):
+        report = runner.setup_interactive(["good", "bad"])
+
+    assert list(runner.interactive_hosts.keys()) == [fake_inter.server]
+    assert sorted(report.keys()) == ["bad", "good"]
+    assert report["good"]["connected"] is True
+    assert report["bad"]["connected"] is False
+    for host_report in report.values():
+        assert host_report["seconds"] >= 0
+
+
+def test_setup_interactive_jump_host():
+    """Concurrent sessions each keep, and close, their own jump session."""
+
+    runner = Bladerunner({"jump_host": "jumper", "threads": 3})
+    hosts = ["one", "two", "three"]
+    jumpboxes = {}
+
+    def fake_connect(target, *_, **kwargs):
+        """Returns a new jump session, or the target through its jumpbox."""
+
+        if target == "jumper":
+            time.sleep(0.01)  # let the setups overlap
+            return (Mock(name="jump"), 1)
+        jumpboxes[target] = kwargs["jumpbox"]
+        return ("{0} via jump".format(target), 1)
+
+    with patch.object(runner, "connect", side_effect=fake_connect):
+        report = runner.setup_interactive(hosts)
+
+    assert all(report[host]["connected"] for host in hosts)
+    sessions = [runner.interactive_hosts[host].sshc for host in hosts]
+    assert len(set(id(session) for session in sessions)) == 3
+    for host in hosts:
+        assert jumpboxes[host] is runner.interactive_hosts[host].sshc
+    assert runner.sshc is None
+
+    with patch.object(runner, "close") as p_close:
+        runner.end_interactive()
+
+    for session in sessions:
+        p_close.assert_any_call(session, True)
+    assert p_close.call_count == 6
+
+
 def test_end_interactive():
     """Ensure we can remove interactive sessions from teh object pool."""
 
@@ -1091,7 +2366,8 @@ def test_run_interactive(capfd):
 
     with patch.object(runner, "setup_interactive") as mock_setup:
         with threadpool_mock as mock_threadpool:
-            runner.run_interactive("fake cmd", "fake host")
+            with patch.object(base, "as_completed", side_effect=list):
+                runner.run_interactive("fake cmd", "fake host")
 
     mock_setup.assert_called_once_with("fake host")
     mock_threadpool.assert_called_once_with(max_workers=14)
@@ -1124,7 +2400,12 @@ def test_run_interactive_returns():
 
     with patch.object(runner, "setup_interactive") as mock_setup:
         with threadpool_mock as mock_threadpool:
-            results = runner.run_interactive("ok", "host", print_results=False)
+            with patch.object(base, "as_completed", side_effect=list):
+                results = runner.run_interactive(
+                    "ok",
+                    "host",
+                    print_results=False,
+                )
 
     mock_setup.assert_called_once_with("host")
     mock_threadpool.assert_called_once_with(max_workers=17)
@@ -1244,3 +2525,47 @@ def test_interactive_connect_failure():
 
     assert res is None
     patched_connect.assert_called_once_with(status_return=True)
+
+
+def test_run_interactive_dispatches_first():
+    """All hosts are submitted before any result is waited on."""
+
+    runner = Bladerunner({"threads": 4})
+    runner.interactive_hosts = {"one": Mock(), "two": Mock()}
+
+    submitted = []
+
+    def fake_submit(*args):
+        """Records the submission, the result reports how many were sent."""
+
+        submitted.append(args)
+        fake_result = Mock()
+        fake_result.result = Mock(
+            side_effect=lambda: "submitted: {0}".format(len(submitted)),
+        )
+        return fake_result
+
+    fake_thread = Mock()
+    fake_thread.__enter__ = fake_context
+    fake_thread.__exit__ = fake_context
+    fake_thread.submit = Mock(side_effect=fake_submit)
+
+    threadpool_mock = patch.object(
+        base,
+        "ThreadPoolExecutor",
+        return_value=fake_thread,
+    )
+    callback = Mock()
+
+    with threadpool_mock:
+        with patch.object(base, "as_completed", side_effect=list):
+            results = runner.run_interactive(
+                "uptime",
+                print_results=False,
+                callback=callback,
+            )
+
+    assert results == {"one": "submitted: 2", "two": "submitted: 2"}
+    assert callback.call_count == 2
+    callback.assert_any_call("one", "submitted: 2")
+    callback.assert_any_call("two", "submitted: 2")
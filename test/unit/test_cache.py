@@ -0,0 +1,90 @@
+"""Unit tests for Bladerunner's session cache."""
+
+
+from mock import Mock
+from mock import patch
+
+from bladerunner import cache
+from bladerunner.cache import SessionCache
+
+
+def test_checkout_returns_checked_in():
+    """A checked in session is handed back once, then removed."""
+
+    sessions = SessionCache(2)
+    sessions.checkin("host", "session")
+
+    assert "host" in sessions
+    assert sessions.checkout("host") == "session"
+    assert sessions.checkout("host") is None
+    assert len(sessions) == 0
+
+
+def test_lru_eviction():
+    """The least recently used session is closed when over max_size."""
+
+    closer = Mock()
+    sessions = SessionCache(2, closer=closer)
+    sessions.checkin("one", "first")
+    sessions.checkin("two", "second")
+    sessions.checkout("one")
+    sessions.checkin("one", "first")
+    sessions.checkin("three", "third")
+
+    closer.assert_called_once_with("second")
+    assert "one" in sessions and "three" in sessions
+
+
+def test_replacing_closes_old():
+    """Checking in a second session for a host closes the first."""
+
+    closer = Mock()
+    sessions = SessionCache(5, closer=closer)
+    sessions.checkin("host", "old")
+    sessions.checkin("host", "new")
+
+    closer.assert_called_once_with("old")
+    assert sessions.checkout("host") == "new"
+
+
+def test_idle_timeout():
+    """Sessions idle for longer than idle_timeout are closed."""
+
+    closer = Mock()
+    sessions = SessionCache(5, idle_timeout=30, closer=closer)
+
+    with patch.object(cache, "TIMER", return_value=100):
+        sessions.checkin("stale", "old")
+    with patch.object(cache, "TIMER", return_value=120):
+        sessions.checkin("fresh", "new")
+    with patch.object(cache, "TIMER", return_value=140):
+        assert sessions.checkout("stale") is None
+        assert sessions.checkout("fresh") == "new"
+
+    closer.assert_called_once_with("old")
+
+
+def test_dead_sessions_are_dropped():
+    """Sessions failing the liveness check are closed, not returned."""
+
+    closer = Mock()
+    checker = Mock(return_value=False)
+    sessions = SessionCache(5, closer=closer, checker=checker)
+    sessions.checkin("host", "dead")
+
+    assert sessions.checkout("host") is None
+    checker.assert_called_once_with("dead")
+    closer.assert_called_once_with("dead")
+
+
+def test_clear():
+    """Clearing the cache closes everything in it."""
+
+    closer = Mock()
+    sessions = SessionCache(5, closer=closer)
+    sessions.checkin("one", "first")
+    sessions.checkin("two", "second")
+    sessions.clear()
+
+    assert len(sessions) == 0
+    assert closer.call_count == 2
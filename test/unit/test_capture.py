@@ -0,0 +1,191 @@
+"""Unit tests for Bladerunner's bounded output capture."""
+
+
+import io
+import os
+import re
+
+import pexpect
+import pytest
+from mock import Mock
+
+from bladerunner import Bladerunner
+from bladerunner.capture import SEARCH_MIN, Capture, spill_prefix
+
+
+class FakeSpawn(object):
+    """Stands in for pexpect.spawn, data is read with read."""
+
+    buffer_type = io.BytesIO
+
+    def __init__(self):
+        self.searchwindowsize = None
+        self._before = io.BytesIO()
+
+    def read(self, data):
+        """Reads like pexpect does, logging then adding to the buffer."""
+
+        self.logfile_read.write(data)
+        self._before.write(data)
+
+    @property
+    def before(self):
+        return self._before.getvalue()
+
+
+def test_under_limit():
+    """Output under the limit is left as it is."""
+
+    sshc = FakeSpawn()
+    sshc.logfile_read = Capture(sshc, 1000)
+    sshc.logfile_read.start("ls")
+    sshc.read(b"small output")
+
+    assert sshc.searchwindowsize == 500
+    assert sshc.logfile_read.finish(sshc.before) == b"small output"
+    assert sshc.searchwindowsize is None
+    assert sshc.logfile_read.spills == []
+
+
+def test_over_limit_keeps_head_and_tail():
+    """Only the head and tail are kept, pexpect's buffer is trimmed."""
+
+    sshc = FakeSpawn()
+    capture = sshc.logfile_read = Capture(sshc, 1000)
+    capture.start("cat big")
+    for line in range(1000):
+        sshc.read("line {0}\n".format(line).encode("ascii"))
+
+    assert len(sshc.before) <= 1000 + len(b"line 999\n")
+    output = capture.finish(sshc.before).decode("ascii").splitlines()
+
+    assert output[0] == "line 0"
+    assert output[-1] == "line 999"
+    assert any(line.endswith("bytes not kept]") for line in output)
+    assert len(output) < 150
+
+
+def test_cut_on_lines():
+    """The head and tail are cut on line endings, not inside characters."""
+
+    sshc = FakeSpawn()
+    capture = sshc.logfile_read = Capture(sshc, 40)
+    capture.start("cat")
+    for _ in range(20):
+        sshc.read(u"caf\u00e9 cr\u00e8me\n".encode("utf-8"))
+
+    output = capture.finish(sshc.before).decode("utf-8").splitlines()
+
+    assert output[0] == u"caf\u00e9 cr\u00e8me"
+    assert output[-1] == u"caf\u00e9 cr\u00e8me"
+
+
+def test_spill(tmpdir):
+    """Outputs over the limit are written to a temporary file in full."""
+
+    sshc = FakeSpawn()
+    capture = sshc.logfile_read = Capture(sshc, 10)
+    prefix = os.path.join(str(tmpdir), "spill-")
+
+    capture.start("small", prefix)
+    sshc.read(b"tiny")
+    capture.finish(sshc.before)
+    assert tmpdir.listdir() == []
+
+    capture.start("big", prefix)
+    for _ in range(5):
+        sshc.read(b"0123456789")
+    output = capture.finish(sshc.before)
+
+    [(command, path)] = capture.take_spills()
+    assert command == "big"
+    assert path in output.decode("ascii")
+    with open(path, "rb") as spilled:
+        assert spilled.read() == b"0123456789" * 5
+    assert capture.take_spills() == []
+
+
+def test_chained():
+    """The previous logfile_read is still written to, even when idle."""
+
+    chain = Mock()
+    capture = Capture(FakeSpawn(), 10, chain=chain)
+    capture.write(b"before starting")
+    capture.flush()
+
+    chain.write.assert_called_once_with(b"before starting")
+    chain.flush.assert_called_once_with()
+    assert capture.total == 0
+
+
+def test_old_pexpect_warns():
+    """Without pexpect's private buffer, a warning is issued and the results
+    are still cut to the head and tail."""
+
+    sshc = Mock(spec=["searchwindowsize"], searchwindowsize=None)
+
+    with pytest.warns(RuntimeWarning):
+        capture = Capture(sshc, 30)
+
+    assert not capture.trims
+    capture.start("cat big")
+    for _ in range(5):
+        capture.write(b"0123456789\n")
+
+    output = capture.finish(b"0123456789\n" * 5).splitlines()
+    assert output[0] == b"0123456789"
+    assert output[-1] == b"0123456789"
+    assert b"[33 bytes not kept]" in output
+
+
+def test_window_fits_patterns():
+    """The search window fits the patterns, however small the limit."""
+
+    sshc = FakeSpawn()
+    capture = Capture(sshc, 10)
+    long_prompt = re.compile(b"x" * 1000)
+
+    capture.start("ls")
+    assert sshc.searchwindowsize == SEARCH_MIN
+    capture.start("ls", patterns=[re.compile(b"\\$ "), long_prompt])
+    assert sshc.searchwindowsize == 1000
+
+
+def test_limit_smaller_than_marker():
+    """The end marker is still matched with a limit smaller than it."""
+
+    _, start, end = Bladerunner._frame("seq")
+    marker = end.pattern.split(b":")[0].decode("ascii")
+    script = "seq 1 5000; echo {0}; echo {1}:0".format(
+        start.decode("ascii"),
+        marker,
+    )
+    sshc = pexpect.spawn("sh", ["-c", script])
+    capture = sshc.logfile_read = Capture(sshc, 8)
+    capture.start("seq", patterns=[end])
+    sshc.expect_list([end], 10)
+    sshc.close()
+
+    assert sshc.match.group(1) == b"0"
+
+
+def test_spill_prefix():
+    """Hostnames are made safe for file names."""
+
+    assert spill_prefix("some/host:22") == "bladerunner-some_host_22-"
+    assert spill_prefix(None) == "bladerunner--"
+
+
+def test_real_spawn():
+    """The capture bounds what a real pexpect object keeps."""
+
+    sshc = pexpect.spawn("sh", ["-c", "seq 1 50000; echo EN''D"])
+    capture = sshc.logfile_read = Capture(sshc, 4096)
+    capture.start("seq")
+    sshc.expect_list([re.compile(b"END")], 10)
+    output = capture.finish(sshc.before).decode("ascii").splitlines()
+    sshc.close()
+
+    assert output[0] == "1"
+    assert output[-1] == "50000"
+    assert len(output) < 1000
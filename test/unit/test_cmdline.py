@@ -1,6 +1,7 @@
 """Tests for the command line entry."""
 
 
+import io
 import os
 import sys
 import pytest
@@ -31,6 +32,8 @@ def option_mismatches():
         "jump_host": "jumpbox",
         "jump_user": "jumpbox-user",
         "jump_port": "jumpbox-port",
+        "jump_sessions": "jumpbox-sessions",
+        "jump_transport": "jumpbox-transport",
         "jump_password": "jumpbox-password",
         "password_safety": "no-password-check",
         "passwd_prompts": "match",
@@ -38,6 +41,10 @@ def option_mismatches():
         "extra_prompts": "match",
         "csv_char": "csv-separator",
         "progressbar": "--",
+        "session_cache": "--",
+        "session_idle": "--",
+        "resolve_ttl": "--",
+        "hosts_map": "--",
         "cmd_timeout": "command-timeout",
         "width": "--",
     }
@@ -193,6 +200,51 @@ def test_valid_style_is_pretty():
     assert pretty.called
 
 
+def test_timings_summary(capfd):
+    """With timings, a summary of them is written after the results."""
+
+    results = iter([
+        {"name": "one", "results": [], "timings": {"login": 1, "total": 2}},
+        {"name": "two", "results": [], "timings": {"login": 3, "total": 4}},
+    ])
+
+    with pytest.raises(SystemExit):
+        with patch.object(cmdline, "csv_results",
+                          side_effect=lambda results, _: list(results)):
+            cmdline_exit(results, {"style": -1, "timings": True})
+
+    stdout, _ = capfd.readouterr()
+    assert stdout.splitlines()[0].split()[0] == "phase"
+    assert stdout.splitlines()[1].split()[:2] == ["login", "2"]
+
+
+@pytest.mark.parametrize("stacked", [False, True])
+def test_timings_consolidated(capfd, stacked):
+    """Pretty and stacked results are still printed with timings."""
+
+    results = iter([
+        {
+            "name": "one",
+            "results": [("uptime", "up 1 day")],
+            "timings": {"login": 1, "total": 2},
+        },
+    ])
+
+    with pytest.raises(SystemExit):
+        cmdline_exit(results, {
+            "style": 0,
+            "stacked": stacked,
+            "timings": True,
+            "width": 80,
+        })
+
+    stdout, _ = capfd.readouterr()
+    assert "up 1 day" in stdout
+    assert "one" in stdout
+    assert any(line.split()[:2] == ["login", "1"]
+               for line in stdout.splitlines())
+
+
 def test_reading_command_file():
     """Make a tempfile, ensure it's read into the commands list."""
 
@@ -253,7 +305,35 @@ def test_reading_hostsfile():
     settings = FakeSettings()
     get_servers(settings)
 
-    assert hosts == settings.servers
+    assert hosts == list(settings.servers)
+
+
+def test_reading_hosts_from_stdin():
+    """A host file of - reads the hosts from stdin, lazily."""
+
+    class FakeSettings(object):
+        host_file = ["-"]
+        servers = []
+
+    settings = FakeSettings()
+    with patch.object(sys, "stdin", io.StringIO(u"one two\nthree\n")):
+        get_servers(settings)
+        assert list(settings.servers) == ["one", "two", "three"]
+
+
+def test_empty_hostsfile_exits(tmpdir):
+    """An empty hosts file is the same as giving no hosts."""
+
+    hostsfile = tmpdir.join("hosts")
+    hostsfile.write("\n")
+
+    class FakeSettings(object):
+        host_file = [str(hostsfile)]
+        servers = []
+
+    with patch.object(cmdline, "print_help", return_value="help"):
+        with pytest.raises(SystemExit):
+            get_servers(FakeSettings())
 
 
 def test_hostsfile_ioerrors_exit():
@@ -285,10 +365,15 @@ def test_unlisting_argparse():
         csv_char = [".fail"]  # only the first char should be used
         ascii = True
         threads = [50]
+        min_threads = [2]
         jump_port = [24]
+        jump_sessions = [4]
         port = [25]
         debug = [3]
         output_file = False
+        prompt_file = ["prompts.json"]
+        probe_timeout = [0.5]
+        capture_limit = [65536]
         style = None
         width = False
 
@@ -304,8 +389,11 @@ def test_unlisting_argparse():
         "jump_pass",
         "port",
         "jump_port",
+        "jump_sessions",
         "threads",
         "debug",
+        "prompt_file",
+        "capture_limit",
     ]
     for unlist in unlistings:
         assert getattr(settings, unlist) == getattr(FakeSettings, unlist)[0]
@@ -442,19 +530,52 @@ def test_stacked_is_called_when_flat():
 def test_main_calls():
     """Verify the console entry point calls with mock."""
 
-    with patch.object(cmdline, "cmdline_entry", return_value=(1, 2, 3)):
+    options = {"style": 0}
+    with patch.object(cmdline, "cmdline_entry", return_value=(1, 2, options)):
         with patch.object(cmdline, "Bladerunner") as br_patch:
             with patch.object(cmdline, "cmdline_exit") as exit_patch:
                 cmdline.main()
 
     # the 3rd return from cmdline_entry is the options dict, used in BR init
-    br_patch.assert_called_once_with(3)
+    br_patch.assert_called_once_with(options)
 
     # run should be called with the 1st and 2nd return as commands and servers
-    br_patch.run.aassert_called_once_with(1, 2)
+    br_patch().run.assert_called_once_with(1, 2)
 
     # finally, the exit call takes the return from run and the initial options
-    exit_patch.assert_called_once_with(br_patch().run(), 3)
+    exit_patch.assert_called_once_with(br_patch().run(), options)
+
+
+def test_main_streams_csv():
+    """CSV output is written from run_iter as each result arrives."""
+
+    options = {"style": -1}
+    with patch.object(cmdline, "cmdline_entry", return_value=(1, 2, options)):
+        with patch.object(cmdline, "Bladerunner") as br_patch:
+            with patch.object(cmdline, "cmdline_exit") as exit_patch:
+                cmdline.main()
+
+    br_patch().run_iter.assert_called_once_with(1, 2)
+    assert not br_patch().run.called
+    exit_patch.assert_called_once_with(br_patch().run_iter(), options)
+
+
+def test_streams_results():
+    """Only the CSV style can be written before all results are in."""
+
+    assert cmdline.streams_results({"style": -1})
+    assert cmdline.streams_results({"style": 4})
+    assert not cmdline.streams_results({"style": 2})
+    assert not cmdline.streams_results({"style": -1, "stacked": True})
+
+
+def test_csv_to_stdout_hides_progressbar():
+    """The progressbar would be mixed in with CSV results on stdout."""
+
+    sys.argv.extend(["--csv", "-nN", "w", "host"])
+    _, _, options = cmdline_entry()
+    assert options["style"] == -1
+    assert options["progressbar"] is False
 
 
 def test_main_kb_interrupt():
@@ -0,0 +1,137 @@
+"""Unit tests for Bladerunner's adaptive concurrency limit."""
+
+
+import time
+import threading
+
+from mock import patch
+
+from bladerunner import concurrency
+from bladerunner.concurrency import AdaptiveLimit, local_headroom
+
+
+def limit(minimum=2, maximum=100):
+    """Returns an AdaptiveLimit without any local headroom restrictions."""
+
+    with patch.object(concurrency, "local_headroom", return_value=1000):
+        return AdaptiveLimit(minimum, maximum)
+
+
+def test_slow_start():
+    """The limit grows by a host per success until the first congestion."""
+
+    adaptive = limit()
+    for _ in range(10):
+        adaptive.record(0.1)
+
+    assert adaptive.limit == 12
+
+
+def test_maximum():
+    """The limit never grows past the maximum."""
+
+    adaptive = limit(maximum=5)
+    for _ in range(10):
+        adaptive.record(0.1)
+
+    assert adaptive.limit == 5
+
+
+def test_headroom_ceiling():
+    """The maximum is lowered to the local headroom."""
+
+    with patch.object(concurrency, "local_headroom", return_value=3):
+        adaptive = AdaptiveLimit(4, 100)
+
+    assert adaptive.ceiling == 3
+    assert adaptive.minimum == 3
+
+
+def test_errors_decrease():
+    """Congestion errors halve the limit, once per round of hosts."""
+
+    adaptive = limit()
+    for _ in range(14):
+        adaptive.record(0.1)
+    assert adaptive.limit == 16
+
+    adaptive.record(20, -7)
+    assert adaptive.limit == 8
+    adaptive.record(20, -1)
+    assert adaptive.limit == 8  # still within the same round
+
+    adaptive.record(0.1, -3)  # unresolvable, not congestion
+    assert adaptive.limit == 8.125  # additive increase after congestion
+
+    for _ in range(8):
+        adaptive.record(0.1)
+    adaptive.record(20, -7)
+    assert adaptive.limit < 5
+
+
+def test_minimum():
+    """The limit doesn't drop below the minimum."""
+
+    adaptive = limit(minimum=3)
+    adaptive.record(20, -7)
+
+    assert adaptive.limit == 3
+
+
+def test_latency_congestion():
+    """Connections slowing down past slow_factor decrease the limit."""
+
+    adaptive = limit()
+    for _ in range(6):
+        adaptive.record(0.1)
+    assert adaptive.limit == 8
+
+    for _ in range(3):
+        adaptive.record(2)
+
+    assert adaptive.limit == 4
+
+
+def test_acquire_blocks_at_limit():
+    """acquire waits for a release once the limit is in flight."""
+
+    adaptive = limit(minimum=1)
+    adaptive.acquire()
+    acquired = []
+
+    def acquire():
+        adaptive.acquire()
+        acquired.append(True)
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    time.sleep(0.1)
+    assert not acquired
+
+    adaptive.release()
+    thread.join(1)
+    assert acquired
+    assert adaptive.in_flight == 1
+
+
+def test_local_headroom():
+    """Headroom is the free file descriptors divided between hosts."""
+
+    with patch.object(concurrency.resource, "getrlimit",
+                      return_value=(1024, 4096)):
+        with patch.object(concurrency, "_open_fds", return_value=32):
+            with patch.object(concurrency, "open", side_effect=IOError,
+                              create=True):
+                headroom = local_headroom()
+
+    assert headroom == (1024 - 32 - concurrency.FD_RESERVE) // 3
+
+
+def test_local_headroom_unlimited():
+    """Without any limits found the headroom is unlimited."""
+
+    with patch.object(concurrency.resource, "getrlimit",
+                      side_effect=ValueError):
+        with patch.object(concurrency, "open", side_effect=IOError,
+                          create=True):
+            assert local_headroom() == float("inf")
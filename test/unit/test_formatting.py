@@ -7,6 +7,7 @@ from __future__ import unicode_literals
 
 import os
 import sys
+import time
 import pytest
 import tempfile
 from mock import call
@@ -93,18 +94,32 @@ def test_no_empties():
     assert emptyless == ["something", "else", "and", "things"]
 
 
-def test_no_empties_encodings(fake_unicode_encode_error):
-    """All of DEFAULT_ENCODINGS should be tried on items in the input list."""
+def test_no_empties_text():
+    """Items are already text, they're only stripped, never re-encoded."""
 
-    decode_patch = patch.object(
-        formatting.codecs,
-        "encode",
-        side_effect=fake_unicode_encode_error,
-    )
-    with decode_patch as patched_encode:
-        assert formatting.no_empties(["something"]) == []
+    with patch.object(formatting.codecs, "encode") as patched_encode:
+        assert formatting.no_empties([" something ", "", "🍔"]) == [
+            "something",
+            "🍔",
+        ]
+
+    assert not patched_encode.called
 
-    assert_all_encodings("something", patched_encode)
+
+def test_decode():
+    """Bytes are decoded once, trying the given encoding first."""
+
+    assert formatting.decode(b"caf\xc3\xa9") == ("café", "utf-8")
+    assert formatting.decode(b"caf\xe9") == ("café", "latin-1")
+    assert formatting.decode(b"caf\xc3\xa9", "latin-1") == (
+        "café",
+        "utf-8",
+    )
+    assert formatting.decode(b"\xff\xfeh\x00", "utf-16") == (
+        "h",
+        "utf-16",
+    )
+    assert formatting.decode("text") == ("text", None)
 
 
 def test_format_output():
@@ -123,6 +138,19 @@ def test_format_output():
     assert output == "lots of interesting\noutput n stuff"
 
 
+def test_format_framed_output():
+    """Everything after the start marker is output, without blank lines."""
+
+    fake_output = (
+        b"[me@host ~]$ echo BR''_S_x; ls\r\nBR_S_x\r\n\x1b[0mfile\r\n\r\n"
+        b"other file\r\n"
+    )
+
+    output = formatting.format_framed_output(fake_output, b"BR_S_x")
+
+    assert output == "file\nother file"
+
+
 def test_command_in_second_line():
     """Long commands and small terminals can lead to leakage."""
 
@@ -143,6 +171,34 @@ def test_command_in_second_line():
     assert output == "lots of interesting\noutput n stuff"
 
 
+def test_command_echo_only_leading_lines():
+    """Only the lines the echo could wrap into are checked for the command."""
+
+    command = "echo " + "x" * 70
+    fake_output = "\n".join([
+        "someshell# {0}".format(command[:50]),
+        command[50:],
+        "real output",
+        "more output",
+        "later output mentioning {0}".format(command[5:40]),
+        "someshell#",
+    ])
+
+    if sys.version_info >= (3, 0):
+        fake_output = bytes(fake_output, "utf-8")
+
+    output = formatting.format_output(fake_output, command)
+
+    assert output.splitlines() == [
+        "real output",
+        "more output",
+        "later output mentioning {0}".format(command[5:40]),
+    ]
+    assert formatting._echo_pattern(command) is \
+        formatting._echo_pattern(command)
+    assert formatting._echo_pattern("short") is None
+
+
 def test_unknown_returns_line():
     """Let it fail if the shell cant display it if we can't decode."""
 
@@ -169,9 +225,60 @@ def test_format_line_decode_errors(fake_unicode_decode_error):
     )
 
     with decode_patch as patched_decode:
-        assert formatting.format_line("sure thing") == "sure thing"
+        assert formatting.format_line(b"sure thing") == b"sure thing"
 
-    assert_all_encodings("sure thing", patched_decode)
+    assert len(patched_decode.mock_calls) == len(formatting.DEFAULT_ENCODINGS)
+    assert_all_encodings(b"sure thing", patched_decode)
+
+
+def test_clean_lines():
+    """The whole buffer is cleaned at once, then split into lines."""
+
+    output = (
+        b"\x1b[01;32mgreen\x1b[0m\r\n   indented\x1b[12Gtabbed\r\n"
+        b"reset\x1b[m\x0f\r\n"
+    )
+
+    assert formatting.clean_lines(output) == [
+        "green",
+        "indentedtabbed",
+        "reset",
+    ]
+
+
+def test_clean_lines_lone_carriage_returns():
+    """Lines separated only by carriage returns are still split."""
+
+    output = b"progress 10%\rprogress 50%\rprogress 100%\r\ndone\r\n"
+
+    assert formatting.clean_lines(output) == [
+        "progress 10%",
+        "progress 50%",
+        "progress 100%",
+        "done",
+    ]
+
+
+def test_clean_lines_undecodable():
+    """Output that can't be decoded at once is cleaned line by line."""
+
+    with patch.object(formatting, "decode", return_value=(None, None)):
+        with patch.object(formatting, "format_line") as p_format_line:
+            lines = formatting.clean_lines(b"one\ntwo", {})
+
+    assert p_format_line.mock_calls == [call(b"one", {}), call(b"two", {})]
+    assert lines == [p_format_line.return_value] * 2
+
+
+def test_password_pattern():
+    """Passwords are hidden by one alternation, longest first."""
+
+    options = {"password": ["hunter", "hunter22"], "jump_password": "a.b"}
+    pattern = formatting._password_pattern(options)
+
+    assert pattern is formatting._password_pattern(options)
+    assert pattern.sub("*", "hunter22 hunter a.b axb") == "* * * axb"
+    assert formatting._password_pattern({"password": None}) is None
 
 
 def test_consolidate_results(fake_results):
@@ -215,6 +322,77 @@ def test_csv_custom_char(fake_results, capfd):
             assert results in stdout
 
 
+def test_consolidate_keeps_order():
+    """Groups are returned in the order they were first seen."""
+
+    results = [
+        {"name": "a", "results": [("uptime", "1 day")]},
+        {"name": "b", "results": [("uptime", "2 days")]},
+        {"name": "c", "results": [("uptime", "1 day")]},
+        {"name": "d", "results": [("uptime", "3 days")]},
+        {"name": "e", "results": [("uptime", "2 days")]},
+    ]
+
+    assert [group["names"] for group in formatting.consolidate(results)] == [
+        ["a", "c"],
+        ["b", "e"],
+        ["d"],
+    ]
+
+
+def test_consolidate_large_results():
+    """Large results are grouped by their digest."""
+
+    big = "x" * (formatting.DIGEST_OVER + 1)
+
+    with patch.object(formatting.hashlib, "sha1",
+                      wraps=formatting.hashlib.sha1) as p_sha1:
+        groups = formatting.consolidate([
+            {"name": "a", "results": [("cat", big)]},
+            {"name": "b", "results": [("cat", big)]},
+            {"name": "c", "results": [("cat", big[:-1] + "y")]},
+        ])
+
+    assert p_sha1.call_count == 3
+    assert [group["names"] for group in groups] == [["a", "b"], ["c"]]
+    assert groups[0]["results"] == [("cat", big)]
+
+    with patch.object(formatting.hashlib, "sha1") as p_sha1:
+        formatting.consolidate(
+            [{"name": "a", "results": [("cat", big)]}],
+            digest_over=None,
+        )
+
+    assert not p_sha1.called
+
+
+def test_consolidate_exit_codes():
+    """Servers with the same output but different exit codes are split."""
+
+    groups = formatting.consolidate([
+        {"name": "a", "results": [("ls", "x")], "exit_codes": [0]},
+        {"name": "b", "results": [("ls", "x")], "exit_codes": [2]},
+        {"name": "c", "results": [("ls", "x")], "exit_codes": [0]},
+    ])
+
+    assert [group["names"] for group in groups] == [["a", "c"], ["b"]]
+
+
+def test_consolidate_many_distinct():
+    """Consolidating many distinct results doesn't compare every pair."""
+
+    results = [
+        {"name": str(i), "results": [("hostname", str(i))]}
+        for i in range(20000)
+    ]
+
+    start = time.time()
+    groups = formatting.consolidate(results)
+
+    assert len(groups) == 20000
+    assert time.time() - start < 5
+
+
 def test_csv_on_consolidated(fake_results, capfd):
     """CSV results should still work post consolidation."""
 
@@ -469,6 +647,91 @@ def test_user_requested_raise(fake_unicode_decode_error):
     )
 
 
+def test_output_sink_buffers(tmpdir):
+    """The output file is opened once and written when the buffer fills."""
+
+    output_file = str(tmpdir.join("output.txt"))
+    sink = formatting.OutputSink(output_file, buffer_size=10)
+
+    real_open = formatting.io.open
+    with patch.object(formatting.io, "open", wraps=real_open) as p_open:
+        sink.write("12345")
+        assert not os.path.exists(output_file)
+        sink.write("67890")
+        sink.write("abc")
+        sink.flush()
+        sink.close()
+
+    p_open.assert_called_once_with(output_file, "a", encoding="utf-8",
+                                   errors="replace")
+    assert sink.encoding == "utf-8"
+    with open(output_file, "r") as openoutput:
+        assert openoutput.read() == "1234567890abc"
+
+
+def test_output_sink_stdout(capfd):
+    """Without an output_file the sink writes to stdout."""
+
+    sink = formatting.OutputSink()
+    sink.write("hello ")
+    sink.write("world")
+    stdout, _ = capfd.readouterr()
+    assert stdout == ""
+
+    sink.close()
+    stdout, _ = capfd.readouterr()
+    assert stdout == "hello world"
+
+
+def test_output_sink_stdout_errors(fake_unicode_decode_error, tmpdir):
+    """The user is asked for a file if stdout can't take the output."""
+
+    fallback_file = str(tmpdir.join("fallback.txt"))
+    sink = formatting.OutputSink()
+    sink.write("super important data")
+
+    with patch.object(formatting.sys, "stdout") as p_stdout:
+        p_stdout.write.side_effect = fake_unicode_decode_error
+        with patch.object(formatting, "_prompt_for_input_on_error",
+                          side_effect=["yes", fallback_file]):
+            sink.close()
+
+    with open(fallback_file, "r") as openfile:
+        assert openfile.read() == "super important data"
+
+
+def test_output_sink_context(tmpdir):
+    """Results are written through one sink, which is removed afterwards."""
+
+    options = {"output_file": str(tmpdir.join("output.txt"))}
+
+    with formatting.output_sink(options) as sink:
+        formatting.write("one", options, end="\n")
+        with formatting.output_sink(options) as inner:
+            assert inner is sink
+            formatting.write("two", options, end="\n")
+        assert options["output_sink"] is sink
+
+    assert "output_sink" not in options
+    with open(options["output_file"], "r") as openoutput:
+        assert openoutput.read() == "one\ntwo\n"
+
+
+def test_pretty_results_open_once(fake_results, tmpdir):
+    """A whole report is written with a single open of the output file."""
+
+    options = {"output_file": str(tmpdir.join("output.txt")), "width": 80}
+
+    real_open = formatting.io.open
+    with patch.object(formatting.io, "open", wraps=real_open) as p_open:
+        formatting.pretty_results(fake_results, options)
+
+    assert p_open.call_count == 1
+    assert "output_sink" not in options
+    with open(options["output_file"], "r") as openoutput:
+        assert "server_a_1" in openoutput.read()
+
+
 def test_prompt_for_user_input():
     """Make sure we prompt the user with the string provided."""
 
@@ -0,0 +1,103 @@
+"""Unit tests for Bladerunner's lazy host sources."""
+
+
+import io
+
+from mock import patch
+
+from bladerunner import hosts
+from bladerunner.hosts import BoundedSet, iter_host_file, iter_hosts
+
+
+def test_bounded_set():
+    """The least recently added members are forgotten past max_size."""
+
+    seen = BoundedSet(2)
+
+    assert seen.add("one")
+    assert not seen.add("one")
+    assert seen.add("two")
+    assert seen.add("three")
+    assert len(seen) == 2
+    assert "one" not in seen and "three" in seen
+
+
+def test_iter_host_file(tmpdir):
+    """Hosts are split on any whitespace and the file is closed after."""
+
+    host_file = tmpdir.join("hosts")
+    host_file.write("one two\n\n  three\tfour\n")
+
+    with open(str(host_file), "r") as openhosts:
+        assert list(iter_host_file(openhosts)) == [
+            "one", "two", "three", "four",
+        ]
+        assert openhosts.closed
+
+    assert list(iter_host_file(str(host_file)))[-1] == "four"
+
+
+def test_iter_host_file_stdin():
+    """A host file of - reads from stdin, without closing it."""
+
+    fake_stdin = io.StringIO(u"one\ntwo\n")
+    with patch.object(hosts.sys, "stdin", fake_stdin):
+        assert list(iter_host_file("-")) == ["one", "two"]
+
+    assert not fake_stdin.closed
+
+
+def test_iter_hosts_sources():
+    """Strings, networks, files, callables and iterables are all read."""
+
+    sources = [
+        "one",
+        io.StringIO(u"two three\none\n"),
+        lambda: ["10.0.0.0/30", "four"],
+        iter(["10.0.0.2", "five"]),
+    ]
+
+    assert list(iter_hosts(sources)) == [
+        "one", "two", "three", "10.0.0.1", "10.0.0.2", "four", "five",
+    ]
+
+
+def test_iter_hosts_exclusions():
+    """Listed exclusions apply throughout, streamed ones from then on."""
+
+    sources = [
+        "one",
+        "10.0.0.0/29",
+        io.StringIO(u"two\n!three\nthree\n"),
+        "!10.0.0.2/31",
+        "!one",
+    ]
+
+    assert list(iter_hosts(sources, exclude=["10.0.0.6"])) == [
+        "10.0.0.1", "10.0.0.4", "10.0.0.5", "two",
+    ]
+
+
+def test_iter_hosts_is_lazy():
+    """Nothing is read ahead of the hosts which have been yielded."""
+
+    read = []
+
+    def source():
+        for host in ("one", "two", "three"):
+            read.append(host)
+            yield host
+
+    hosts_iter = iter_hosts(source())
+    assert next(hosts_iter) == "one"
+    assert read == ["one"]
+
+
+def test_iter_hosts_bounded_dedupe():
+    """Duplicates are only skipped within the last max_seen hosts."""
+
+    sources = ["one", "two", "one", "three", "one"]
+
+    assert list(iter_hosts(sources, max_seen=2)) == [
+        "one", "two", "three", "one",
+    ]
@@ -38,6 +38,7 @@ def test_connect():
         runner.options["username"],
         runner.options["password"],
         runner.options["port"],
+        jumpbox=None,
     )
 
 
@@ -64,6 +65,7 @@ def test_connect_error():
         runner.options["username"],
         runner.options["password"],
         runner.options["port"],
+        jumpbox=None,
     )
 
     mock_log.assert_called_once_with(runner.errors[0])
@@ -84,7 +86,8 @@ def test_connect_jumpbox():
     with con_mock as mock_connect:
         inter.connect()
 
-    assert inter.bladerunner.sshc == "bananas"
+    assert inter.sshc == "bananas"
+    assert inter.bladerunner.sshc is None
     assert inter.sshr == "bananas"
 
     assert mock_connect.call_count == 2
@@ -93,6 +96,7 @@ def test_connect_jumpbox():
         runner.options["username"],  # a passwd was not set for
         runner.options["password"],  # the jumpbox user so fallback
         runner.options["port"],
+        jumpbox=False,
     )
 
     mock_connect.assert_any_call(
@@ -100,6 +104,7 @@ def test_connect_jumpbox():
         runner.options["username"],
         runner.options["password"],
         runner.options["port"],
+        jumpbox="bananas",
     )
 
 
@@ -126,6 +131,7 @@ def test_connect_jumpbox_error():
         runner.options["username"],
         runner.options["password"],
         runner.options["port"],
+        jumpbox=False,
     )
 
     mock_log.assert_called_once_with(runner.errors[2])
@@ -214,12 +220,13 @@ def test_end_jumpbox():
     sshr = mock.Mock()
     sshc = mock.Mock()
     inter.sshr = sshr
-    inter.bladerunner.sshc = sshc
+    inter.sshc = sshc
 
     with mock.patch.object(inter.bladerunner, "close") as mock_close:
         assert inter.end() is None
 
     assert inter.sshr is None
+    assert inter.sshc is None
 
     assert mock_close.call_count == 2
     mock_close.assert_any_call(sshr, False)
@@ -1,13 +1,26 @@
 """Some unit tests for Bladerunner's network utilities."""
 
 
+import time
+import socket
+import threading
+
 import pytest
+from mock import Mock
+from mock import patch
+
+from bladerunner import networking
 
 from bladerunner.networking import (
     can_resolve,
+    iter_subnet,
+    subnet_size,
     ips_in_subnet,
-    _ip_to_binary,
-    _binary_to_ip,
+    ExpandedServers,
+    Resolver,
+    probe,
+    _ip_to_int,
+    _int_to_ip,
 )
 
 
@@ -17,8 +30,12 @@ from bladerunner.networking import (
         ("10.0.0.0/30", ["10.0.0.1", "10.0.0.2"]),
         ("192.168.16.5/32", ["192.168.16.5"]),
         ("10.16.255.16/255.255.255.255", ["10.16.255.16"]),
+        ("10.0.0.6/31", ["10.0.0.6", "10.0.0.7"]),
+        ("fe80::/126", ["fe80::1", "fe80::2", "fe80::3"]),
+        ("2001:db8::5/128", ["2001:db8::5"]),
     ),
-    ids=("simple small", "slash 32", "expanded slash 32"),
+    ids=("simple small", "slash 32", "expanded slash 32", "point to point",
+         "ipv6", "ipv6 single"),
 )
 def test_example_networks(network, expected):
     """Test some example network exact conversions."""
@@ -49,9 +66,11 @@ def test_in_network(ipaddr, network):
         "10.9.8.0/-3",
         "10.9.8.0/34",
         "1.2.3.4",
+        "fe80::/129",
+        "some.host/24",
     ),
     ids=("invalid ip", "invalid subnet", "mask too big", "invalid slash",
-         "oversized slash", "no mask")
+         "oversized slash", "no mask", "oversized ipv6", "hostname")
 )
 def test_invalid_returns_none(ipaddr):
     assert ips_in_subnet(ipaddr) is None
@@ -64,9 +83,338 @@ def test_can_resolve():
     assert not can_resolve("googly.boogly.doodley-do.1234abcd")
 
 
-def test_converting_back_and_forth():
-    """Test converting back to ip from binary."""
+@pytest.mark.parametrize(
+    "starting, bits",
+    (("10.1.2.3", 32), ("2001:db8::ff", 128)),
+    ids=("ipv4", "ipv6"),
+)
+def test_converting_back_and_forth(starting, bits):
+    """Test converting back to ip from an integer."""
+
+    ip_int, ip_bits = _ip_to_int(starting)
+    assert ip_bits == bits
+    assert _int_to_ip(ip_int, bits) == starting
+
+
+def test_iter_subnet_is_lazy():
+    """Huge networks are counted and walked without building a list."""
+
+    assert subnet_size("10.0.0.0/8") == 2 ** 24 - 2
+    assert subnet_size("2001:db8::/32") == 2 ** 96 - 1
+    assert subnet_size("10.0.0.0/33") is None
+
+    members = iter_subnet("2001:db8::/32")
+    assert next(members) == "2001:db8::1"
+    assert next(members) == "2001:db8::2"
+
+
+def test_iter_subnet_exclusions():
+    """Excluded addresses and networks are skipped."""
+
+    members = list(iter_subnet(
+        "10.0.0.0/28",
+        ["10.0.0.3", "10.0.0.8/30", "10.0.0.9", "fe80::1", "nonsense"],
+    ))
+    assert members == [
+        "10.0.0.1", "10.0.0.2", "10.0.0.4", "10.0.0.5", "10.0.0.6",
+        "10.0.0.7", "10.0.0.12", "10.0.0.13", "10.0.0.14",
+    ]
+
+
+def test_expanded_servers():
+    """ExpandedServers is a lazy sequence of hosts and network members."""
+
+    servers = ExpandedServers(
+        ["first", "10.0.0.0/29", "skipped", "10.0.0.2"],
+        ["skipped", "10.0.0.2/31"],
+    )
+
+    assert len(servers) == 5
+    assert list(servers) == [
+        "first", "10.0.0.1", "10.0.0.4", "10.0.0.5", "10.0.0.6",
+    ]
+    assert servers[0] == "first"
+    assert servers[-1] == "10.0.0.6"
+    assert len(servers[1:]) == 4
+    assert list(servers[1:3]) == ["10.0.0.1", "10.0.0.4"]
+    assert list(servers[1:][1:]) == ["10.0.0.4", "10.0.0.5", "10.0.0.6"]
+    assert not ExpandedServers([])
+    with pytest.raises(IndexError):
+        servers[5]
+
+
+def test_expanded_servers_huge():
+    """A /8 has a length and members without being expanded."""
+
+    servers = ExpandedServers(["10.0.0.0/8"])
+
+    assert len(servers) == 2 ** 24 - 2
+    assert servers[1] == "10.0.0.2"
+    assert len(servers[1:]) == 2 ** 24 - 3
+
+
+def test_expanded_servers_index():
+    """Indexing is worked out arithmetically, around the exclusions."""
+
+    servers = ExpandedServers(
+        ["10.0.0.0/27", "host", "10.0.1.0/28"],
+        ["10.0.0.0/30", "10.0.0.8/29", "10.0.0.30", "10.0.1.3"],
+    )
+    expanded = list(servers)
+
+    assert [servers[i] for i in range(len(expanded))] == expanded
+    assert [servers[-i] for i in range(1, len(expanded) + 1)] == \
+        expanded[::-1]
+    assert [servers[3:][i] for i in range(len(expanded) - 3)] == \
+        expanded[3:]
+
+    with patch.object(ExpandedServers, "__iter__") as p_iter:
+        assert ExpandedServers(["10.0.0.0/8"])[-1] == "10.255.255.254"
+    assert not p_iter.called
+
+
+def test_expanded_servers_ipv6():
+    """An IPv6 /64 is counted by size, it's too large for len()."""
+
+    servers = ExpandedServers(["2001:db8::/64"])
+
+    assert servers.size() == 2 ** 64 - 1
+    assert servers
+    assert servers[1:].size() == 2 ** 64 - 2
+    assert servers[-1] == "2001:db8::ffff:ffff:ffff:ffff"
+    with pytest.raises(OverflowError):
+        len(servers)
+
+
+def test_resolver_hosts_map():
+    """The hosts map and IP addresses are answered without a lookup."""
+
+    lookup = Mock(return_value=True)
+    resolver = Resolver(hosts={"mapped": "10.0.0.1", "gone": None},
+                        lookup=lookup)
+
+    assert resolver.resolve("mapped")
+    assert not resolver.resolve("gone")
+    assert resolver.resolve("10.1.2.3")
+    assert resolver.resolve("2001:db8::1")
+    assert not lookup.called
+
+
+def test_resolver_ttl():
+    """Results are cached until the ttl runs out."""
+
+    lookup = Mock(side_effect=[False, True])
+    resolver = Resolver(ttl=30, lookup=lookup)
+
+    with patch.object(networking, "TIMER", return_value=100):
+        assert not resolver.resolve("somewhere")
+        assert not resolver.resolve("somewhere")
+        assert resolver.cached("somewhere") is False
+    assert lookup.call_count == 1
+
+    with patch.object(networking, "TIMER", return_value=131):
+        assert resolver.cached("somewhere") is None
+        assert resolver.resolve("somewhere")
+    assert lookup.call_count == 2
+
+
+def test_resolver_no_cache():
+    """A ttl of 0 looks the host up every time."""
+
+    lookup = Mock(return_value=True)
+    resolver = Resolver(ttl=0, lookup=lookup)
+
+    assert resolver.resolve("somewhere")
+    assert resolver.resolve("somewhere")
+    assert lookup.call_count == 2
+    assert resolver.prefetch(["somewhere"]) is None
+
+
+def test_resolver_max_entries():
+    """The oldest results are dropped past max_entries."""
+
+    lookup = Mock(return_value=True)
+    resolver = Resolver(max_entries=2, lookup=lookup)
+
+    for host in ("one", "two", "three"):
+        resolver.resolve(host)
+
+    assert resolver.cached("one") is None
+    assert resolver.cached("three") is True
+
+
+def test_resolver_shares_lookups():
+    """Concurrent lookups of the same host wait for the first one."""
+
+    calls = []
+
+    def slow_lookup(target):
+        calls.append(target)
+        time.sleep(0.1)
+        return True
+
+    resolver = Resolver(lookup=slow_lookup)
+    threads = [
+        threading.Thread(target=resolver.resolve, args=("somewhere",))
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == ["somewhere"]
+
+
+def test_resolver_prefetch():
+    """Prefetching resolves every host concurrently, in the background."""
+
+    def slow_lookup(target):
+        time.sleep(0.1)
+        return target != "bad"
+
+    resolver = Resolver(lookup=slow_lookup)
+    hosts = ["host{0}".format(i) for i in range(20)] + ["bad"]
+
+    start = time.time()
+    resolver.prefetch(hosts, max_workers=21).join()
+
+    assert time.time() - start < 1
+    assert all(resolver.cached(host) for host in hosts[:-1])
+    assert resolver.cached("bad") is False
+
+
+@pytest.fixture
+def listening_port():
+    """Returns a local port which accepts connections."""
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(16)
+    yield server.getsockname()[1]
+    server.close()
+
+
+@pytest.fixture
+def closed_port():
+    """Returns a local port which refuses connections."""
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    port = server.getsockname()[1]
+    server.close()
+    return port
+
+
+def test_probe_reachable(listening_port):
+    """Targets accepting connections aren't returned."""
+
+    hosts = {"mapped": "127.0.0.1", "gone": None}
+    targets = ["127.0.0.1", "mapped", "gone"]
+
+    assert probe(targets, listening_port, 1, hosts) == set()
+
+
+def test_probe_refused(closed_port):
+    """Targets refusing the connection are returned without waiting."""
+
+    start = time.time()
+    assert probe(["127.0.0.1"], closed_port, 5) == {"127.0.0.1"}
+    assert time.time() - start < 1
+
+
+def test_probe_timeout():
+    """Targets still connecting at the deadline are unreachable."""
+
+    sock = Mock()
+    sock.connect_ex.return_value = networking.errno.EINPROGRESS
+
+    # without selectors, on python 2, select.select is used
+    with patch.object(networking, "selectors", new=None):
+        with patch.object(networking.socket, "socket", return_value=sock):
+            with patch.object(networking.select, "select",
+                              return_value=([], [], [])) as p_select:
+                with patch.object(networking, "TIMER",
+                                  side_effect=[0, 0, 1]):
+                    unreachable = probe(["10.0.0.1"], 22, 1)
+
+    assert unreachable == {"10.0.0.1"}
+    p_select.assert_called_once_with([], [sock], [sock], 1)
+    assert sock.close.called
+
+
+def test_probe_high_fds(listening_port, closed_port):
+    """Sockets numbered over select's limit of 1024 can still be probed."""
+
+    if networking.selectors is None:
+        pytest.skip("selectors requires python 3.4+")
+
+    held = []
+    try:
+        try:
+            while len(held) < 1100:
+                held.append(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+        except (OSError, socket.error):
+            pytest.skip("can't open enough file descriptors")
+
+        assert held[-1].fileno() >= 1024
+        assert probe(["127.0.0.1"], listening_port, 1) == set()
+        assert probe(["127.0.0.1"], closed_port, 1) == {"127.0.0.1"}
+    finally:
+        for sock in held:
+            sock.close()
+
+
+def test_probe_uses_resolver(listening_port):
+    """Targets are resolved through the resolver, never one by one."""
+
+    resolver = Resolver(lookup=Mock(return_value="127.0.0.1"))
+
+    with patch.object(networking.socket, "getaddrinfo",
+                      wraps=socket.getaddrinfo) as p_getaddrinfo:
+        assert probe(["web1"], listening_port, 1, resolver=resolver) == set()
+
+    assert resolver.address("web1") == "127.0.0.1"
+    for lookup in p_getaddrinfo.mock_calls:
+        assert lookup[1][-1] == socket.AI_NUMERICHOST
+
+
+def test_probe_slow_dns(listening_port):
+    """A slow lookup doesn't hold up the batch, its host isn't probed."""
+
+    def slow_lookup(target):
+        if target == "slow":
+            time.sleep(2)
+        return "127.0.0.1"
+
+    resolver = Resolver(lookup=slow_lookup)
+    start = time.time()
+    targets = ["slow", "fast"]
+
+    assert probe(targets, listening_port, 0.3, resolver=resolver) == set()
+    assert time.time() - start < 1
+    assert resolver.address("fast") == "127.0.0.1"
+    assert resolver.address("slow") is None
+
+
+def test_resolver_addresses():
+    """Known addresses are answered without a lookup, unresolvable skipped."""
+
+    lookup = Mock(side_effect=lambda target: {"web": "10.0.0.5"}.get(target))
+    resolver = Resolver(hosts={"mapped": "10.0.0.9", "gone": None},
+                        lookup=lookup)
+
+    assert resolver.addresses(
+        ["10.0.0.1", "mapped", "gone", "web", "nowhere"],
+        1,
+    ) == {"10.0.0.1": "10.0.0.1", "mapped": "10.0.0.9", "web": "10.0.0.5"}
+    assert resolver.resolve("web") and not resolver.resolve("nowhere")
+    assert lookup.call_count == 2
+
+
+def test_probe_skips_unresolvable():
+    """Targets which can't be resolved are left to the resolver."""
 
-    starting = "10.1.2.3"
-    made_binary = _ip_to_binary(starting)
-    assert _binary_to_ip(made_binary) == starting
+    error = socket.gaierror("nope")
+    with patch.object(networking.socket, "getaddrinfo", side_effect=error):
+        assert probe(["nowhere"], 22, 1) == set()
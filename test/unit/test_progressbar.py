@@ -2,7 +2,9 @@
 
 
 import os
+import time
 import pytest
+import threading
 from mock import call
 from mock import Mock
 from mock import patch
@@ -26,6 +28,17 @@ def test_setup(capfd):
     assert out.startswith("ok then")
 
 
+def test_grow():
+    """The total can grow, and the counters make room for it."""
+
+    pbar = ProgressBar(9, {"width": 40, "show_counters": True})
+    width = pbar.width
+    pbar.grow()
+
+    assert pbar.total == 10
+    assert pbar.width == width - 2
+
+
 @pytest.mark.parametrize(
     "options",
     [
@@ -168,6 +181,71 @@ def test_update_quarters(capfd):
     assert "[=]" in stdout
 
 
+def test_update_threaded():
+    """Updates from many threads are all counted."""
+
+    pbar = ProgressBar(1000, {"width": 40, "refresh_rate": 10})
+    threads = [
+        threading.Thread(target=lambda: [pbar.update() for _ in range(100)])
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert pbar.counter == 1000
+
+
+def test_refresh_rate(capfd):
+    """With a refresh_rate, updates only count and redraws are on a timer."""
+
+    pbar = ProgressBar(4, {"width": 8, "refresh_rate": 1000})
+    with patch.object(progressbar.threading, "Thread") as p_thread:
+        pbar.setup()
+    p_thread.return_value.start.assert_called_once_with()
+    stdout, _ = capfd.readouterr()
+    assert stdout == "[      ]"
+
+    pbar.update()
+    pbar.update()
+    stdout, _ = capfd.readouterr()
+    assert stdout == ""
+
+    pbar._redraw()
+    pbar._redraw()  # unchanged, not drawn again
+    stdout, _ = capfd.readouterr()
+    assert stdout == "\r[===   ]"
+
+
+def test_refresh_timer(capfd):
+    """The timer thread redraws the bar until it's cleared."""
+
+    pbar = ProgressBar(2, {"width": 8, "refresh_rate": 100})
+    pbar.setup()
+    pbar.update(2)
+    time.sleep(0.2)
+    pbar.clear()
+
+    stdout, _ = capfd.readouterr()
+    assert "\r[======]" in stdout
+    assert pbar._timer is None
+
+
+def test_show_rate():
+    """The rate and time remaining follow the bar, at a fixed width."""
+
+    pbar = ProgressBar(100, {"width": 60, "show_rate": True})
+    assert pbar.width == 60 - 2 - progressbar.RATE_WIDTH
+
+    pbar._started = time.time() - 10
+    rate = pbar._rate(25, 100)
+    assert len(rate) == progressbar.RATE_WIDTH
+    assert rate.strip().startswith("2.5/s ETA 0:00:3")
+    assert pbar._rate(0, 100) == " " * progressbar.RATE_WIDTH
+    assert len(pbar._render(25, 100, pbar.width)) == 60
+
+
 def test_clear(capfd):
     """Ensure we print whitespace over the bar and carriage return."""
 
@@ -0,0 +1,93 @@
+"""Unit tests for Bladerunner's learned prompt store."""
+
+
+import json
+import threading
+
+from bladerunner.prompts import PromptStore
+
+
+def test_learn_per_host():
+    """Prompts are only kept for the host they were learned on."""
+
+    store = PromptStore()
+
+    assert store.learn("one", "prompt\\$")
+    assert not store.learn("one", "prompt\\$")
+    assert store.get("one") == ["prompt\\$"]
+    assert store.get("two") == []
+    assert "one" in store and "two" not in store
+    assert store.compiled("one")[0].search(b"user@one prompt$")
+
+
+def test_max_prompts():
+    """Only the most recently learned prompts are kept per host."""
+
+    store = PromptStore(max_prompts=2)
+    for prompt in ("first", "second", "third"):
+        store.learn("host", prompt)
+
+    assert store.get("host") == ["second", "third"]
+
+
+def test_max_hosts():
+    """The least recently learned host is dropped when over max_hosts."""
+
+    store = PromptStore(max_hosts=2)
+    store.learn("one", "a")
+    store.learn("two", "b")
+    store.learn("one", "c")
+    store.learn("three", "d")
+
+    assert len(store) == 2
+    assert "two" not in store
+    assert store.get("one") == ["a", "c"]
+
+
+def test_learn_threaded():
+    """Prompts learned from many threads at once are all kept."""
+
+    store = PromptStore(max_prompts=100)
+    threads = [
+        threading.Thread(target=store.learn, args=("host", str(prompt)))
+        for prompt in range(50)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(store.get("host"), key=int) == [str(x) for x in range(50)]
+
+
+def test_save_and_load(tmpdir):
+    """Prompts saved to the path are loaded by the next store."""
+
+    path = str(tmpdir.join("prompts.json"))
+    store = PromptStore(path)
+    store.learn("host", "learned")
+    store.learn(None, "unknown host")
+
+    assert store.save()
+    assert not store.save()  # nothing new to write
+    assert json.load(open(path)) == {"host": ["learned"]}
+    assert PromptStore(path).get("host") == ["learned"]
+
+
+def test_load_bad_file(tmpdir):
+    """A missing or unreadable file starts with an empty store."""
+
+    bad_file = tmpdir.join("prompts.json")
+    bad_file.write("{not json")
+
+    assert len(PromptStore(str(bad_file))) == 0
+    assert len(PromptStore(str(tmpdir.join("missing.json")))) == 0
+
+
+def test_save_without_path():
+    """Nothing is written without a path."""
+
+    store = PromptStore()
+    store.learn("host", "learned")
+
+    assert not store.save()
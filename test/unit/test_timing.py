@@ -0,0 +1,86 @@
+"""Unit tests for Bladerunner's per phase timings."""
+
+
+from mock import patch
+
+from bladerunner import timing
+from bladerunner.timing import (
+    NOT_TIMING,
+    Timings,
+    format_summary,
+    percentile,
+    summarize,
+)
+
+
+def test_timings_phases():
+    """Time spent inside a phase is added to it."""
+
+    with patch.object(timing, "TIMER", side_effect=[10, 11, 13, 14, 14.5, 20]):
+        timings = Timings()
+        with timings.phase("login"):
+            pass
+        with timings.phase("login"):
+            pass
+        timings.add_command("uptime", 0.25)
+        result = timings.as_dict()
+
+    assert result == {
+        "login": 2.5,
+        "commands": [("uptime", 0.25)],
+        "total": 10,
+    }
+
+
+def test_not_timing():
+    """The stand in context manager does nothing."""
+
+    with NOT_TIMING as not_timing:
+        assert not_timing is NOT_TIMING
+
+
+def test_percentile():
+    """Percentiles are by nearest rank."""
+
+    values = list(range(1, 101))
+
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([3], 99) == 3
+    assert percentile([], 50) is None
+
+
+def test_summarize():
+    """Timings are summarized per phase and per command, in order."""
+
+    summary = summarize([
+        {"resolve": 0.1, "commands": [("uptime", 1.0), ("who", 0.5)],
+         "total": 2},
+        {"resolve": 0.3, "login": 1, "commands": [("uptime", 3.0)],
+         "total": 4},
+        {"resolve": 0.2, "commands": [], "total": 0.2},
+    ])
+
+    assert list(summary) == [
+        "resolve", "login", "commands", "total", "command: uptime",
+        "command: who",
+    ]
+    assert summary["resolve"] == {
+        "count": 3, "p50": 0.2, "p95": 0.3, "p99": 0.3, "max": 0.3,
+    }
+    assert summary["commands"]["count"] == 2
+    assert summary["commands"]["max"] == 3.0
+    assert summary["command: uptime"]["p50"] == 1.0
+
+
+def test_format_summary():
+    """The summary is formatted as a table, one line per phase."""
+
+    table = format_summary(summarize([{"login": 1.5, "total": 2}]))
+    lines = table.splitlines()
+
+    assert lines[0].split() == ["phase", "count", "p50", "p95", "p99", "max"]
+    assert lines[1].split() == ["login", "1", "1.500s", "1.500s", "1.500s",
+                                "1.500s"]
+    assert len(lines) == 3